@@ -5,14 +5,26 @@ except ImportError:  # pragma: no cover
     __version__ = "unknown"
 
 
-from .fixtures import DjangoAssertNumQueries, DjangoCaptureOnCommitCallbacks, Settings
+from .fixtures import (
+    BoundedCaptureQueriesContext,
+    DjangoAssertMaxQueryTime,
+    DjangoAssertNoSeqScans,
+    DjangoAssertNumQueries,
+    DjangoCaptureOnCommitCallbacks,
+    DjangoQuerySnapshot,
+    Settings,
+)
 from .plugin import DjangoDbBlocker
 
 
 __all__ = [
+    "BoundedCaptureQueriesContext",
+    "DjangoAssertMaxQueryTime",
+    "DjangoAssertNoSeqScans",
     "DjangoAssertNumQueries",
     "DjangoCaptureOnCommitCallbacks",
     "DjangoDbBlocker",
+    "DjangoQuerySnapshot",
     "Settings",
     "__version__",
 ]
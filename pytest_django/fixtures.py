@@ -2,17 +2,28 @@
 
 from __future__ import annotations
 
+import copy
+import difflib
+import json
 import os
-from collections.abc import Callable, Generator, Iterable, Sequence
+import re
+import threading
+import time
+import warnings
+from collections import Counter, deque
+from collections.abc import Callable, Generator, Iterable, Iterator, Sequence
 from contextlib import AbstractContextManager, contextmanager
 from functools import partial
-from typing import TYPE_CHECKING, Any, Protocol
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Protocol, overload
 
 import pytest
 
 from . import live_server_helper
 from .django_compat import is_django_unittest
-from .lazy_django import skip_if_no_django
+from .instrumentation import normalize_sql, returns_rows, track_fetched_rows
+from .lazy_django import django_settings_is_configured, skip_if_no_django
+from .tracing import trace_span
 
 
 if TYPE_CHECKING:
@@ -20,6 +31,7 @@ if TYPE_CHECKING:
 
     import django
     import django.test
+    from typing_extensions import Self
 
     from . import DjangoDbBlocker
     from .django_compat import _User, _UserModel
@@ -39,11 +51,14 @@ __all__ = [
     "client",
     "db",
     "django_assert_max_num_queries",
+    "django_assert_max_query_time",
+    "django_assert_no_seq_scans",
     "django_assert_num_queries",
     "django_capture_on_commit_callbacks",
     "django_db_reset_sequences",
     "django_db_serialized_rollback",
     "django_db_setup",
+    "django_query_snapshot",
     "django_user_model",
     "django_username_field",
     "live_server",
@@ -73,9 +88,20 @@ def django_db_modify_db_settings_xdist_suffix(request: pytest.FixtureRequest) ->
         _set_suffix_to_test_databases(suffix=xdist_suffix)
 
 
+@pytest.fixture(scope="session")
+def django_db_modify_db_settings_shard_suffix(request: pytest.FixtureRequest) -> None:
+    skip_if_no_django()
+
+    shard = request.config.getoption("django_shard")
+    if shard is not None:
+        # Put a suffix like _shard1, _shard2 etc on --django-shard shards
+        _set_suffix_to_test_databases(suffix=f"shard{shard[0]}")
+
+
 @pytest.fixture(scope="session")
 def django_db_modify_db_settings_parallel_suffix(
     django_db_modify_db_settings_tox_suffix: None,  # noqa: ARG001
+    django_db_modify_db_settings_shard_suffix: None,  # noqa: ARG001
     django_db_modify_db_settings_xdist_suffix: None,  # noqa: ARG001
 ) -> None:
     skip_if_no_django()
@@ -109,38 +135,154 @@ def django_db_createdb(request: pytest.FixtureRequest) -> bool:
     return create_db
 
 
+class DbPlan:
+    """How a test uses the databases, resolved once from its Django test case
+    class, its ``django_db`` mark and its fixtures, and stored in the stash of
+    the item by :func:`get_db_plan`."""
+
+    __slots__ = (
+        "available_apps",
+        "databases",
+        "marked",
+        "reasons",
+        "reset_sequences",
+        "serialized_rollback",
+        "transactional",
+        "uses_db",
+    )
+
+    def __init__(
+        self,
+        *,
+        uses_db: bool = False,
+        transactional: bool = False,
+        reset_sequences: bool = False,
+        databases: _DjangoDbDatabases = None,
+        serialized_rollback: bool = False,
+        available_apps: _DjangoDbAvailableApps = None,
+        marked: bool = False,
+        reasons: tuple[str, ...] = (),
+    ) -> None:
+        self.uses_db = uses_db
+        self.transactional = transactional
+        self.reset_sequences = reset_sequences
+        #: ``None`` for the default database.
+        self.databases = databases
+        self.serialized_rollback = serialized_rollback
+        self.available_apps = available_apps
+        #: Whether the test has a ``django_db`` mark.
+        self.marked = marked
+        #: What the above is derived from, e.g. ``"transactional_db fixture"``.
+        self.reasons = reasons
+
+
+db_plan_key = pytest.StashKey[DbPlan]()
+
+
+def get_db_plan(item: pytest.Item) -> DbPlan:
+    """Get the database plan of a test.
+
+    The plan is stored by :func:`store_db_plan` once the collection is
+    finished, as the plugins and conftests may add marks to the tests until
+    then; before that, it is resolved on each call. It is resolved from the
+    fixtures the test requests statically, so the fixtures requested
+    dynamically must still be taken into account when the test runs.
+    """
+    plan = item.stash.get(db_plan_key, None)
+    if plan is None:
+        plan = _resolve_db_plan(item)
+    return plan
+
+
+def store_db_plan(item: pytest.Item) -> DbPlan:
+    """Resolve the database plan of a test and store it in its stash."""
+    plan = item.stash[db_plan_key] = _resolve_db_plan(item)
+    return plan
+
+
+def _resolve_db_plan(item: pytest.Item) -> DbPlan:
+    test_cls = getattr(item, "cls", None)
+    if test_cls is not None and django_settings_is_configured():
+        from django.test import TestCase, TransactionTestCase
+
+        if issubclass(test_cls, TransactionTestCase):
+            # Note, TestCase is a subclass of TransactionTestCase.
+            base = TestCase if issubclass(test_cls, TestCase) else TransactionTestCase
+            return DbPlan(
+                uses_db=True,
+                transactional=base is TransactionTestCase,
+                reset_sequences=test_cls.reset_sequences,
+                databases=test_cls.databases,
+                serialized_rollback=test_cls.serialized_rollback,
+                available_apps=test_cls.available_apps,
+                reasons=(f"{base.__name__} subclass",),
+            )
+
+    reasons = []
+    marker = item.get_closest_marker("django_db")
+    if marker:
+        (
+            transactional,
+            reset_sequences,
+            databases,
+            serialized_rollback,
+            available_apps,
+        ) = validate_django_db(marker)
+        reasons.append("django_db mark")
+    else:
+        (
+            transactional,
+            reset_sequences,
+            databases,
+            serialized_rollback,
+            available_apps,
+        ) = False, False, None, False, None
+
+    fixtures = getattr(item, "fixturenames", ())
+    reasons.extend(
+        f"{fixture} fixture"
+        for fixture in (
+            "db",
+            "transactional_db",
+            "live_server",
+            "django_db_reset_sequences",
+            "django_db_serialized_rollback",
+        )
+        if fixture in fixtures
+    )
+    reset_sequences = reset_sequences or "django_db_reset_sequences" in fixtures
+    transactional = (
+        transactional
+        or reset_sequences
+        or "transactional_db" in fixtures
+        or "live_server" in fixtures
+    )
+    return DbPlan(
+        uses_db=marker is not None or transactional or "db" in fixtures,
+        transactional=transactional,
+        reset_sequences=reset_sequences,
+        databases=databases,
+        serialized_rollback=serialized_rollback or "django_db_serialized_rollback" in fixtures,
+        available_apps=available_apps,
+        marked=marker is not None,
+        reasons=tuple(reasons),
+    )
+
+
 def _get_databases_for_test(test: pytest.Item) -> tuple[Iterable[str], bool]:
     """Get the database aliases that need to be setup for a test, and whether
     they need to be serialized."""
     from django.db import DEFAULT_DB_ALIAS, connections
-    from django.test import TransactionTestCase
 
-    test_cls = getattr(test, "cls", None)
-    if test_cls and issubclass(test_cls, TransactionTestCase):
-        serialized_rollback = getattr(test_cls, "serialized_rollback", False)
-        databases = getattr(test_cls, "databases", None)
-    else:
-        fixtures = getattr(test, "fixturenames", ())
-        marker_db = test.get_closest_marker("django_db")
-        if marker_db:
-            (
-                _transaction,
-                _reset_sequences,
-                databases,
-                serialized_rollback,
-                _available_apps,
-            ) = validate_django_db(marker_db)
-        elif "db" in fixtures or "transactional_db" in fixtures or "live_server" in fixtures:
-            serialized_rollback = "django_db_serialized_rollback" in fixtures
-            databases = None
-        else:
-            return (), False
-    if databases is None:
-        return (DEFAULT_DB_ALIAS,), serialized_rollback
-    elif databases == "__all__":
-        return connections, serialized_rollback
+    plan = get_db_plan(test)
+    if not plan.uses_db:
+        return (), False
+    if plan.databases is None:
+        return (DEFAULT_DB_ALIAS,), plan.serialized_rollback
+    elif plan.databases == "__all__":
+        return connections, plan.serialized_rollback
     else:
-        return databases, serialized_rollback
+        return plan.databases, plan.serialized_rollback
 
 
 def _get_databases_for_setup(
@@ -159,6 +301,270 @@ def _get_databases_for_setup(
     return aliases, serialized_aliases
 
 
+def _routes_databases(config: pytest.Config) -> bool:
+    """Whether the tests using databases other than the default one are routed
+    to the workers of their xdist group, with ``--django-route-databases``."""
+    return bool(config.getoption("django_route_databases")) and bool(
+        getattr(config.option, "loadgroup", False)
+    )
+
+
+def _get_database_group(test: pytest.Item) -> str | None:
+    """Get the xdist group of a test using databases other than the default
+    one, named after these databases."""
+    from django.db import DEFAULT_DB_ALIAS
+
+    databases, _ = _get_databases_for_test(test)
+    other_databases = sorted(set(databases) - {DEFAULT_DB_ALIAS})
+    if not other_databases:
+        return None
+    return "django_db:" + ",".join(other_databases)
+
+
+class RoutedDatabases:
+    """Sets up the databases used only by the tests routed to the worker by
+    ``--django-route-databases``, when the first of these tests runs."""
+
+    def __init__(
+        self,
+        setup: Callable[[set[str], set[str]], list[Any]],
+        aliases: set[str],
+        serialized_aliases: set[str],
+    ) -> None:
+        self._setup = setup
+        #: The aliases which are set up.
+        self.aliases = set(aliases)
+        self.serialized_aliases = serialized_aliases
+        #: The configurations to tear down the databases set up on demand.
+        self.configs: list[Any] = []
+
+    def setup(self, aliases: Iterable[str]) -> None:
+        """Set up the databases of the aliases which are not set up yet."""
+        missing = set(aliases) - self.aliases
+        if missing:
+            self.configs.extend(self._setup(missing, missing & self.serialized_aliases))
+            self.aliases |= missing
+
+
+routed_databases_key = pytest.StashKey[RoutedDatabases]()
+
+
+class BackgroundDatabaseSetup:
+    """Sets up the test databases in a background thread while the tests are
+    collected, for ``--django-background-db-setup``.
+
+    The databases set up are those of the previous run, recorded in the pytest
+    cache, named with the suffixes of :fixture:`django_db_modify_db_settings`.
+    The background thread uses its own copy of the settings of the databases,
+    so that the fixtures modify them as usual. :fixture:`django_db_setup` then
+    uses these databases if it needs the same ones with the same settings, and
+    otherwise tears them down to set up its own.
+    """
+
+    cache_key = "django/db_setup"
+
+    def __init__(self, config: pytest.Config, django_db_blocker: DjangoDbBlocker) -> None:
+        assert config.cache is not None
+        self.config = config
+        self.django_db_blocker = django_db_blocker
+        #: The aliases and serialized aliases set up by the previous run.
+        self.setup: tuple[list[str], list[str]] | None = None
+        setup = config.cache.get(self.cache_key, None)
+        if setup is not None:
+            self.setup = setup["aliases"], setup["serialized_aliases"]
+        self._keepdb = bool(config.getvalue("reuse_db")) and not config.getvalue("create_db")
+        self._use_migrations = not config.getvalue("nomigrations")
+        self._thread: threading.Thread | None = None
+        self._error: Exception | None = None
+        # The settings of the databases before the setup, and after it.
+        self._settings: dict[str, Any] = {}
+        self._test_settings: dict[str, Any] = {}
+        self._db_cfg: list[tuple[str, str, bool]] = []
+        self._serialized_contents: dict[str, str] = {}
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection(self) -> None:
+        # The pytest-xdist controller runs no tests.
+        if (
+            self.setup is None
+            or not self.setup[0]
+            or not django_settings_is_configured()
+            or self.config.getvalue("collectonly")
+            or self.config.pluginmanager.has_plugin("dsession")
+        ):
+            return
+
+        from django.db import connections
+
+        # Fills in the defaults of the settings.
+        self._settings = copy.deepcopy(connections.settings)
+        for suffix in _get_parallel_suffixes(self.config):
+            _set_suffix_to_test_databases(suffix, self._settings)
+        for alias in self.setup[0]:
+            # Not shared with the other threads.
+            connection = _create_connection(alias, self._settings[alias])
+            if connection.vendor == "sqlite" and connection.creation.is_in_memory_db(
+                connection.creation._get_test_db_name()
+            ):
+                return
+
+        if not self._use_migrations:
+            _disable_migrations()
+        self._thread = threading.Thread(target=self._setup_databases, name="django_db_setup")
+        self._thread.start()
+
+    def _setup_databases(self) -> None:
+        from django.conf import settings
+        from django.db import connections
+        from django.test.utils import setup_databases
+
+        assert self.setup is not None
+        aliases, serialized_aliases = self.setup
+        databases = copy.deepcopy(self._settings)
+        names = {alias: settings.DATABASES[alias]["NAME"] for alias in databases}
+        # The connections of this thread, with their own settings.
+        for alias, db_settings in databases.items():
+            connections[alias] = _create_connection(alias, db_settings)
+        try:
+            with (
+                self.django_db_blocker._unblock_thread(),
+                trace_span(self.config, "setup_databases", aliases=aliases),
+            ):
+                db_cfg = setup_databases(
+                    verbosity=self.config.option.verbose,
+                    interactive=False,
+                    aliases=set(aliases),
+                    serialized_aliases=set(serialized_aliases),
+                    keepdb=self._keepdb,
+                )
+            self._db_cfg = [
+                (connection.alias, old_name, destroy) for connection, old_name, destroy in db_cfg
+            ]
+            self._test_settings = {
+                alias: copy.deepcopy(connections[alias].settings_dict) for alias in databases
+            }
+            for alias in aliases:
+                contents = getattr(connections[alias], "_test_serialized_contents", None)
+                if contents is not None:
+                    self._serialized_contents[alias] = contents
+        except Exception as exc:  # noqa: BLE001
+            self._error = exc
+        finally:
+            for alias in databases:
+                connections[alias].close()
+                del connections[alias]
+                # Set by the creation of the test databases.
+                settings.DATABASES[alias]["NAME"] = names[alias]
+
+    def _wait(self) -> bool:
+        """Wait for the setup, and get whether it succeeded."""
+        assert self._thread is not None
+        self._thread.join()
+        self._thread = None
+        if self._error is not None:
+            warnings.warn(
+                pytest.PytestWarning(
+                    f"Error when setting up the test databases in the background: {self._error!r}"
+                ),
+                stacklevel=1,
+            )
+            return False
+        return True
+
+    def join(
+        self,
+        aliases: set[str],
+        serialized_aliases: set[str],
+        keepdb: bool,
+        use_migrations: bool,
+    ) -> list[Any] | None:
+        """Record the databases to set up in the next run, and get the
+        configuration to tear down the databases set up in the background, if
+        they are the given ones with the current settings.
+
+        Otherwise, the databases set up in the background are torn down.
+        """
+        assert self.config.cache is not None
+        self.config.cache.set(
+            self.cache_key,
+            {"aliases": sorted(aliases), "serialized_aliases": sorted(serialized_aliases)},
+        )
+        if self._thread is None or not self._wait():
+            return None
+
+        from django.conf import settings
+        from django.db import connections
+
+        assert self.setup is not None
+        if (
+            self._settings == settings.DATABASES
+            and (sorted(aliases), sorted(serialized_aliases)) == self.setup
+            and (keepdb, use_migrations) == (self._keepdb, self._use_migrations)
+        ):
+            for alias, db_settings in self._test_settings.items():
+                connections[alias].close()
+                settings.DATABASES[alias].update(db_settings)
+            for alias, contents in self._serialized_contents.items():
+                connections[alias]._test_serialized_contents = contents
+            return [
+                (connections[alias], old_name, destroy)
+                for alias, old_name, destroy in self._db_cfg
+            ]
+
+        self._teardown_databases()
+        return None
+
+    def _teardown_databases(self) -> None:
+        from django.conf import settings
+        from django.test.utils import teardown_databases
+
+        if self._keepdb:
+            return
+        # Not with the connections of this thread, which may use other databases.
+        db_cfg = [
+            (_create_connection(alias, self._test_settings[alias]), old_name, destroy)
+            for alias, old_name, destroy in self._db_cfg
+        ]
+        names = {alias: db_settings["NAME"] for alias, db_settings in settings.DATABASES.items()}
+        with self.django_db_blocker.unblock():
+            teardown_databases(db_cfg, verbosity=self.config.option.verbose)
+        # Restored by the destruction of the test databases.
+        for alias, name in names.items():
+            settings.DATABASES[alias]["NAME"] = name
+
+    def pytest_sessionfinish(self) -> None:
+        # No test used the databases.
+        if self._thread is not None and self._wait():
+            self._teardown_databases()
+
+
+background_db_setup_key = pytest.StashKey[BackgroundDatabaseSetup]()
+
+
+def _create_connection(alias: str, db_settings: dict[str, Any]) -> Any:
+    """Create a connection to a database with its own copy of the settings."""
+    from django.db.utils import load_backend
+
+    backend = load_backend(db_settings["ENGINE"])
+    return backend.DatabaseWrapper(copy.deepcopy(db_settings), alias)
+
+
+def _get_parallel_suffixes(config: pytest.Config) -> list[str]:
+    """Get the suffixes the default :fixture:`django_db_modify_db_settings`
+    adds to the names of the test databases."""
+    suffixes = []
+    tox_environment = os.getenv("TOX_PARALLEL_ENV")
+    if tox_environment:
+        suffixes.append(tox_environment)
+    shard = config.getoption("django_shard")
+    if shard is not None:
+        suffixes.append(f"shard{shard[0]}")
+    xdist_suffix = getattr(config, "workerinput", {}).get("workerid")
+    if xdist_suffix:
+        suffixes.append(xdist_suffix)
+    return suffixes
+
+
 @pytest.fixture(scope="session")
 def django_db_setup(  # noqa: PLR0917
     request: pytest.FixtureRequest,
@@ -180,21 +586,52 @@ def django_db_setup(  # noqa: PLR0917
     if django_db_keepdb and not django_db_createdb:
         setup_databases_args["keepdb"] = True
 
-    aliases, serialized_aliases = _get_databases_for_setup(request.session.items)
-
-    with django_db_blocker.unblock():
-        db_cfg = setup_databases(
-            verbosity=request.config.option.verbose,
-            interactive=False,
-            aliases=aliases,
-            serialized_aliases=serialized_aliases,
-            **setup_databases_args,
+    def setup(aliases: set[str], serialized_aliases: set[str]) -> list[Any]:
+        with (
+            django_db_blocker.unblock(),
+            trace_span(request.config, "setup_databases", aliases=sorted(aliases)),
+        ):
+            db_cfg: list[Any] = setup_databases(
+                verbosity=request.config.option.verbose,
+                interactive=False,
+                aliases=aliases,
+                serialized_aliases=serialized_aliases,
+                **setup_databases_args,
+            )
+        return db_cfg
+
+    items = request.session.items
+    aliases, serialized_aliases = _get_databases_for_setup(items)
+    routed_databases = None
+    if _routes_databases(request.config):
+        # The databases used only by the routed tests are set up by the
+        # workers which run them.
+        aliases, _ = _get_databases_for_setup(
+            [item for item in items if _get_database_group(item) is None]
         )
+        routed_databases = RoutedDatabases(setup, aliases, serialized_aliases)
+        request.config.stash[routed_databases_key] = routed_databases
+
+    db_cfg = None
+    background_db_setup = request.config.stash.get(background_db_setup_key, None)
+    if background_db_setup is not None:
+        db_cfg = background_db_setup.join(
+            aliases,
+            serialized_aliases & aliases,
+            keepdb=setup_databases_args.get("keepdb", False),
+            use_migrations=django_db_use_migrations,
+        )
+    if db_cfg is None:
+        db_cfg = setup(aliases, serialized_aliases & aliases)
 
     yield
 
+    if routed_databases is not None:
+        del request.config.stash[routed_databases_key]
+        db_cfg = db_cfg + routed_databases.configs
+
     if not django_db_keepdb:
-        with django_db_blocker.unblock():
+        with django_db_blocker.unblock(), trace_span(request.config, "teardown_databases"):
             try:
                 teardown_databases(db_cfg, verbosity=request.config.option.verbose)
             except Exception as exc:  # noqa: BLE001
@@ -215,33 +652,23 @@ def _django_db_helper(
 
     from django import VERSION
 
-    marker = request.node.get_closest_marker("django_db")
-    if marker:
-        (
-            transactional,
-            reset_sequences,
-            databases,
-            serialized_rollback,
-            available_apps,
-        ) = validate_django_db(marker)
-    else:
-        (
-            transactional,
-            reset_sequences,
-            databases,
-            serialized_rollback,
-            available_apps,
-        ) = False, False, None, False, None
+    routed_databases = request.config.stash.get(routed_databases_key, None)
+    if routed_databases is not None:
+        routed_databases.setup(_get_databases_for_test(request.node)[0])
 
+    plan = get_db_plan(request.node)
+    # The fixtures may also have been requested dynamically.
+    reset_sequences = plan.reset_sequences or ("django_db_reset_sequences" in request.fixturenames)
     transactional = (
-        transactional
+        plan.transactional
         or reset_sequences
         or ("transactional_db" in request.fixturenames or "live_server" in request.fixturenames)
     )
-    reset_sequences = reset_sequences or ("django_db_reset_sequences" in request.fixturenames)
-    serialized_rollback = serialized_rollback or (
+    serialized_rollback = plan.serialized_rollback or (
         "django_db_serialized_rollback" in request.fixturenames
     )
+    databases = plan.databases
+    available_apps = plan.available_apps
 
     with django_db_blocker.unblock():
         import django.db
@@ -355,10 +782,13 @@ def _disable_migrations() -> None:
     migrate.Command = MigrateSilentCommand
 
 
-def _set_suffix_to_test_databases(suffix: str) -> None:
-    from django.conf import settings
+def _set_suffix_to_test_databases(suffix: str, databases: dict[str, Any] | None = None) -> None:
+    if databases is None:
+        from django.conf import settings
 
-    for db_settings in settings.DATABASES.values():
+        databases = settings.DATABASES
+
+    for db_settings in databases.values():
         test_name = db_settings.get("TEST", {}).get("NAME")
 
         if not test_name:
@@ -632,9 +1062,11 @@ def live_server(
         or "localhost"
     )
 
-    server = live_server_helper.LiveServer(addr)
+    with trace_span(request.config, "live_server start"):
+        server = live_server_helper.LiveServer(addr)
     yield server
-    server.stop()
+    with trace_span(request.config, "live_server stop"):
+        server.stop()
 
 
 @pytest.fixture(autouse=True)
@@ -669,6 +1101,7 @@ class DjangoAssertNumQueries(Protocol):
     """The type of the `django_assert_num_queries` and
     `django_assert_max_num_queries` fixtures."""
 
+    @overload
     def __call__(
         self,
         num: int,
@@ -676,8 +1109,153 @@ class DjangoAssertNumQueries(Protocol):
         info: str | None = ...,
         *,
         using: str | None = ...,
-    ) -> django.test.utils.CaptureQueriesContext:
-        pass  # pragma: no cover
+        capture_limit: None = ...,
+        max_rows: int | None = ...,
+    ) -> django.test.utils.CaptureQueriesContext: ...
+
+    @overload
+    def __call__(
+        self,
+        num: int,
+        connection: Any | None = ...,
+        info: str | None = ...,
+        *,
+        using: str | None = ...,
+        capture_limit: int,
+        max_rows: int | None = ...,
+    ) -> BoundedCaptureQueriesContext: ...
+
+
+class _CountingQueriesLog(deque[dict[str, str]]):
+    """A ``connection.queries_log`` which counts the queries appended to it."""
+
+    def __init__(self, maxlen: int) -> None:
+        super().__init__(maxlen=maxlen)
+        #: The number of queries appended, including the ones dropped.
+        self.appended = 0
+
+    def append(self, query: dict[str, str]) -> None:
+        self.appended += 1
+        super().append(query)
+
+
+class BoundedCaptureQueriesContext:
+    """Context manager that counts the queries executed by a connection, but
+    only keeps the last ``capture_limit`` of them.
+
+    Like Django's ``CaptureQueriesContext``, it forces a debug cursor, so it
+    counts the same queries, including the transaction statements. But the
+    ``connection.queries_log`` is swapped for a log keeping ``capture_limit``
+    queries, so memory use does not grow with the number of queries and the
+    count is not capped by the size of the log.
+
+    ``len()`` returns the number of queries executed, while iterating,
+    indexing and ``captured_queries`` only cover the kept queries.
+    """
+
+    def __init__(self, connection: Any, capture_limit: int) -> None:
+        if capture_limit < 0:
+            raise ValueError("capture_limit must not be negative")
+        self.connection = connection
+        self.capture_limit = capture_limit
+        self._queries = _CountingQueriesLog(capture_limit)
+
+    def __iter__(self) -> Iterator[dict[str, str]]:
+        return iter(self._queries)
+
+    def __getitem__(self, index: int) -> dict[str, str]:
+        return self._queries[index]
+
+    def __len__(self) -> int:
+        return self._queries.appended
+
+    @property
+    def captured_queries(self) -> list[dict[str, str]]:
+        return list(self._queries)
+
+    def __enter__(self) -> Self:
+        self.force_debug_cursor = self.connection.force_debug_cursor
+        self.connection.force_debug_cursor = True
+        # Run any initialization queries if needed so that they won't be
+        # included as part of the count.
+        self.connection.ensure_connection()
+        self._queries_log = self.connection.queries_log
+        self.connection.queries_log = self._queries
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.connection.queries_log = self._queries_log
+        self.connection.force_debug_cursor = self.force_debug_cursor
+
+
+def _get_connection(connection: Any | None, using: str | None) -> Any:
+    """Resolve the ``connection``/``using`` arguments of the query fixtures."""
+    from django.db import connection as default_conn, connections
+
+    if connection and using:
+        raise ValueError('The "connection" and "using" parameter cannot be used together')
+
+    if connection is not None:
+        return connection
+    elif using is not None:
+        return connections[using]
+    else:
+        return default_conn
+
+
+@contextmanager
+def _assert_max_rows(conn: Any, max_rows: int | None, info: str | None) -> Generator[None]:
+    """Fail if a query returns more than ``max_rows`` rows.
+
+    The rows are counted as they are fetched, or taken from the row count of
+    the result when the database reports it.
+    """
+    if max_rows is None:
+        yield
+        return
+
+    large_results: list[dict[str, Any]] = []
+
+    def count_rows(
+        execute: Callable[..., Any],
+        sql: str,
+        params: Any,
+        many: bool,
+        context: dict[str, Any],
+    ) -> Any:
+        result = execute(sql, params, many, context)
+        cursor = context["cursor"]
+        if not returns_rows(cursor, sql):
+            return result
+        query = {"sql": sql, "rows": 0, "rowcount": max(cursor.rowcount, 0)}
+        if query["rowcount"] > max_rows:
+            large_results.append(query)
+
+        def fetched(rows: int) -> None:
+            was_large = max(query["rows"], query["rowcount"]) > max_rows
+            query["rows"] += rows
+            if not was_large and query["rows"] > max_rows:
+                large_results.append(query)
+
+        track_fetched_rows(context, fetched)
+        return result
+
+    with conn.execute_wrapper(count_rows):
+        yield
+
+    if large_results:
+        count = len(large_results)
+        msg = (
+            f"Expected every query to return at most {max_rows} rows, "
+            f"but {count} {'query' if count == 1 else 'queries'} returned more"
+        )
+        if info:
+            msg += f"\n{info}"
+        msg += "\n\n" + "\n\n".join(
+            f"{max(query['rows'], query['rowcount'])} rows: {query['sql']}"
+            for query in large_results
+        )
+        pytest.fail(msg)
 
 
 @contextmanager
@@ -689,22 +1267,21 @@ def _assert_num_queries(
     info: str | None = None,
     *,
     using: str | None = None,
-) -> Generator[django.test.utils.CaptureQueriesContext]:
-    from django.db import connection as default_conn, connections
+    capture_limit: int | None = None,
+    max_rows: int | None = None,
+) -> Generator[django.test.utils.CaptureQueriesContext | BoundedCaptureQueriesContext]:
     from django.test.utils import CaptureQueriesContext
 
-    if connection and using:
-        raise ValueError('The "connection" and "using" parameter cannot be used together')
+    conn = _get_connection(connection, using)
 
-    if connection is not None:
-        conn = connection
-    elif using is not None:
-        conn = connections[using]
+    context: django.test.utils.CaptureQueriesContext | BoundedCaptureQueriesContext
+    if capture_limit is None:
+        context = CaptureQueriesContext(conn)
     else:
-        conn = default_conn
+        context = BoundedCaptureQueriesContext(conn, capture_limit)
 
     verbose = config.getoption("verbose") > 0
-    with CaptureQueriesContext(conn) as context:
+    with context, _assert_max_rows(conn, max_rows, info):
         yield context
         num_performed = len(context)
         if exact:
@@ -720,8 +1297,13 @@ def _assert_num_queries(
             if info:
                 msg += f"\n{info}"
             if verbose:
-                sqls = (q["sql"] for q in context.captured_queries)
-                msg += "\n\nQueries:\n========\n\n" + "\n\n".join(sqls)
+                captured_queries = context.captured_queries
+                if len(captured_queries) < num_performed:
+                    title = f"Last {len(captured_queries)} of {num_performed} queries:"
+                else:
+                    title = "Queries:"
+                sqls = (q["sql"] for q in captured_queries)
+                msg += f"\n\n{title}\n{'=' * len(title)}\n\n" + "\n\n".join(sqls)
             else:
                 msg += " (add -v option to show queries)"
             pytest.fail(msg)
@@ -730,13 +1312,337 @@ def _assert_num_queries(
 @pytest.fixture
 def django_assert_num_queries(pytestconfig: pytest.Config) -> DjangoAssertNumQueries:
     """Allows to check for an expected number of DB queries."""
-    return partial(_assert_num_queries, pytestconfig)
+    return partial(_assert_num_queries, pytestconfig)  # type: ignore[return-value]
 
 
 @pytest.fixture
 def django_assert_max_num_queries(pytestconfig: pytest.Config) -> DjangoAssertNumQueries:
     """Allows to check for an expected maximum number of DB queries."""
-    return partial(_assert_num_queries, pytestconfig, exact=False)
+    return partial(_assert_num_queries, pytestconfig, exact=False)  # type: ignore[return-value]
+
+
+class DjangoAssertMaxQueryTime(Protocol):
+    """The type of the `django_assert_max_query_time` fixture."""
+
+    def __call__(
+        self,
+        ms: float,
+        connection: Any | None = ...,
+        info: str | None = ...,
+        *,
+        using: str | None = ...,
+    ) -> AbstractContextManager[None]:
+        pass  # pragma: no cover
+
+
+@contextmanager
+def _assert_max_query_time(
+    ms: float,
+    connection: Any | None = None,
+    info: str | None = None,
+    *,
+    using: str | None = None,
+) -> Generator[None]:
+    conn = _get_connection(connection, using)
+
+    slow_queries: list[tuple[float, str]] = []
+
+    def time_query(
+        execute: Callable[..., Any],
+        sql: str,
+        params: Any,
+        many: bool,
+        context: dict[str, Any],
+    ) -> Any:
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if duration_ms > ms:
+            slow_queries.append((duration_ms, sql))
+        return result
+
+    with conn.execute_wrapper(time_query):
+        yield
+
+    if slow_queries:
+        count = len(slow_queries)
+        msg = (
+            f"Expected every query to take at most {ms:g} ms, "
+            f"but {count} {'query' if count == 1 else 'queries'} took longer"
+        )
+        if info:
+            msg += f"\n{info}"
+        msg += "\n\n" + "\n\n".join(
+            f"{duration_ms:.1f} ms: {sql}" for duration_ms, sql in slow_queries
+        )
+        pytest.fail(msg, pytrace=False)
+
+
+@pytest.fixture
+def django_assert_max_query_time() -> DjangoAssertMaxQueryTime:
+    """Allows to check for a maximum duration of every DB query."""
+    skip_if_no_django()
+
+    return _assert_max_query_time
+
+
+class DjangoAssertNoSeqScans(Protocol):
+    """The type of the `django_assert_no_seq_scans` fixture."""
+
+    def __call__(
+        self,
+        min_rows: int = ...,
+        connection: Any | None = ...,
+        info: str | None = ...,
+        *,
+        using: str | None = ...,
+    ) -> AbstractContextManager[None]:
+        pass  # pragma: no cover
+
+
+_SQL_TABLE_ALIAS_RE = re.compile(
+    r'\b(?:FROM|JOIN)\s+[`"]?(\w+)[`"]?\s+(?:AS\s+)?[`"]?(\w+)[`"]?', re.IGNORECASE
+)
+_SQLITE_SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+
+def _explain_sqlite(cursor: Any, sql: str, params: Any) -> tuple[list[str], list[str]]:
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+    plan = [row[-1] for row in cursor.fetchall()]
+    # SQLite refers to aliased tables by their alias.
+    aliases = {alias: table for table, alias in _SQL_TABLE_ALIAS_RE.findall(sql)}
+    scanned = []
+    for detail in plan:
+        match = _SQLITE_SCAN_RE.match(detail)
+        if match and " USING " not in detail:
+            name: str = match.group(1)
+            scanned.append(aliases.get(name, name))
+    return plan, scanned
+
+
+_POSTGRESQL_INDEX_SCANS = ("Index Scan", "Index Only Scan")
+
+
+def _explain_postgresql(cursor: Any, sql: str, params: Any) -> tuple[list[str], list[str]]:
+    # Tables in tests are tiny, so the planner would always prefer sequential
+    # scans. With them disabled, a sequential scan means no index is usable.
+    cursor.execute("SET enable_seqscan = off")
+    try:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        result = cursor.fetchone()[0]
+    finally:
+        cursor.execute("RESET enable_seqscan")
+    if isinstance(result, str):
+        result = json.loads(result)
+
+    plan: list[str] = []
+    scanned: list[str] = []
+
+    def walk(node: dict[str, Any], depth: int) -> None:
+        relation = node.get("Relation Name")
+        line = node["Node Type"]
+        if relation:
+            line += f" on {relation}"
+            # An index scan without an index condition reads the whole index,
+            # which the planner only chooses as sequential scans are disabled.
+            if node["Node Type"] == "Seq Scan" or (
+                node["Node Type"] in _POSTGRESQL_INDEX_SCANS and "Index Cond" not in node
+            ):
+                scanned.append(relation)
+        plan.append("  " * depth + line)
+        for child in node.get("Plans", ()):
+            walk(child, depth + 1)
+
+    walk(result[0]["Plan"], 0)
+    return plan, scanned
+
+
+def _explain_mysql(cursor: Any, sql: str, params: Any) -> tuple[list[str], list[str]]:
+    cursor.execute(f"EXPLAIN {sql}", params)
+    columns = [column[0] for column in cursor.description]
+    rows = [dict(zip(columns, row, strict=True)) for row in cursor.fetchall()]
+    plan = [f"{row['table']}: {row['type']} (key: {row['key']})" for row in rows]
+    scanned = [row["table"] for row in rows if row["type"] == "ALL"]
+    return plan, scanned
+
+
+_EXPLAIN_FUNCS = {
+    "sqlite": _explain_sqlite,
+    "postgresql": _explain_postgresql,
+    "mysql": _explain_mysql,
+}
+
+
+@contextmanager
+def _raw_cursor(conn: Any) -> Generator[Any]:
+    """Get a cursor whose queries are neither passed to the execute wrappers
+    nor logged, so that the queries of pytest-django are not counted with
+    those of the test."""
+    conn.ensure_connection()
+    execute_wrappers = conn.execute_wrappers
+    conn.execute_wrappers = []
+    try:
+        with conn.wrap_database_errors:
+            cursor = conn.make_cursor(conn.create_cursor())
+        with cursor:
+            yield cursor
+    finally:
+        conn.execute_wrappers = execute_wrappers
+
+
+@contextmanager
+def _assert_no_seq_scans(
+    min_rows: int = 0,
+    connection: Any | None = None,
+    info: str | None = None,
+    *,
+    using: str | None = None,
+) -> Generator[None]:
+    conn = _get_connection(connection, using)
+    try:
+        explain = _EXPLAIN_FUNCS[conn.vendor]
+    except KeyError:
+        raise pytest.UsageError(
+            f"django_assert_no_seq_scans does not support the {conn.vendor} database backend."
+        ) from None
+
+    # Keyed by the SQL, so that a query executed in a loop is explained once.
+    selects: dict[str, Any] = {}
+
+    def capture_selects(
+        execute: Callable[..., Any],
+        sql: str,
+        params: Any,
+        many: bool,
+        context: dict[str, Any],
+    ) -> Any:
+        if not many and sql.lstrip()[:6].upper() == "SELECT":
+            selects.setdefault(sql, params)
+        return execute(sql, params, many, context)
+
+    with conn.execute_wrapper(capture_selects):
+        yield
+
+    failures = []
+    row_counts: dict[str, int] = {}
+    with _raw_cursor(conn) as cursor:
+        table_names = set(conn.introspection.table_names(cursor))
+        for sql, params in selects.items():
+            plan, scanned = explain(cursor, sql, params)
+            full_scans = []
+            for table in scanned:
+                if table not in table_names:
+                    continue
+                if table not in row_counts:
+                    # The table name comes from the database introspection.
+                    count_sql = f"SELECT COUNT(*) FROM {conn.ops.quote_name(table)}"  # noqa: S608
+                    cursor.execute(count_sql)
+                    row_counts[table] = cursor.fetchone()[0]
+                if row_counts[table] > min_rows:
+                    full_scans.append(f"{table} ({row_counts[table]} rows)")
+            if full_scans:
+                failures.append(
+                    f"{sql}\n\nFull scan of {', '.join(full_scans)}. Plan:\n"
+                    + "\n".join(f"    {line}" for line in plan)
+                )
+
+    if failures:
+        msg = (
+            f"Expected no full table scans on tables with more than {min_rows} rows, "
+            f"but {len(failures)} {'query does' if len(failures) == 1 else 'queries do'} one"
+        )
+        if info:
+            msg += f"\n{info}"
+        msg += "\n\n" + "\n\n".join(failures)
+        pytest.fail(msg, pytrace=False)
+
+
+@pytest.fixture
+def django_assert_no_seq_scans() -> DjangoAssertNoSeqScans:
+    """Allows to check that the SELECT queries of a block use indexes."""
+    skip_if_no_django()
+
+    return _assert_no_seq_scans
+
+
+class DjangoQuerySnapshot(Protocol):
+    """The type of the `django_query_snapshot` fixture."""
+
+    def __call__(
+        self,
+        name: str | None = ...,
+        connection: Any | None = ...,
+        *,
+        using: str | None = ...,
+    ) -> AbstractContextManager[django.test.utils.CaptureQueriesContext]:
+        pass  # pragma: no cover
+
+
+def _query_snapshot_path(node: pytest.Item, name: str | None, counter: Counter[str]) -> Path:
+    # The test name within its module, e.g. `TestClass.test_method[param]`.
+    test_name = node.nodeid.split("::", 1)[-1].replace("::", ".")
+    if name:
+        test_name = f"{test_name}.{name}"
+    counter[test_name] += 1
+    if counter[test_name] > 1:
+        test_name = f"{test_name}.{counter[test_name]}"
+    filename = re.sub(r"[^\w.\[\]-]+", "_", test_name)
+    return node.path.parent / "__query_snapshots__" / node.path.stem / f"{filename}.sql"
+
+
+#: The notices of the query snapshots created by a test, reported once the
+#: test ran, so that all its snapshots are created in a single run.
+query_snapshot_notices_key = pytest.StashKey[list[str]]()
+
+
+@contextmanager
+def _query_snapshot(
+    request: pytest.FixtureRequest,
+    counter: Counter[str],
+    name: str | None = None,
+    connection: Any | None = None,
+    *,
+    using: str | None = None,
+) -> Generator[django.test.utils.CaptureQueriesContext]:
+    from django.test.utils import CaptureQueriesContext
+
+    conn = _get_connection(connection, using)
+    path = _query_snapshot_path(request.node, name, counter)
+    update = request.config.getoption("update_query_snapshots")
+
+    with CaptureQueriesContext(conn) as context:
+        yield context
+
+    queries = [normalize_sql(q["sql"]) for q in context.captured_queries]
+    content = "".join(f"{query}\n" for query in queries)
+
+    if update or not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+        if not update:
+            request.node.stash.setdefault(query_snapshot_notices_key, []).append(
+                f"Query snapshot {path} did not exist and was created, "
+                "run the test again to compare against it."
+            )
+        return
+
+    expected = path.read_text(encoding="utf-8").splitlines()
+    if expected != queries:
+        diff = difflib.unified_diff(expected, queries, "snapshot", "executed", lineterm="")
+        pytest.fail(
+            f"Executed queries do not match the query snapshot {path}:\n\n"
+            + "\n".join(diff)
+            + "\n\nUse the --update-query-snapshots option to accept the changes.",
+            pytrace=False,
+        )
+
+
+@pytest.fixture
+def django_query_snapshot(request: pytest.FixtureRequest) -> DjangoQuerySnapshot:
+    """Allows to compare the queries executed by a block against a snapshot file."""
+    skip_if_no_django()
+
+    return partial(_query_snapshot, request, Counter())
 
 
 class DjangoCaptureOnCommitCallbacks(Protocol):
@@ -0,0 +1,1004 @@
+"""Instrumentation of the queries executed while pytest-django allows
+database access, and reports on the database usage of the tests.
+
+The instrumentation is only enabled by the command line options which need
+it. Its execute wrapper is installed on Django's connections whenever the
+:class:`~pytest_django.DjangoDbBlocker` unblocks database access, and it
+notifies the registered observers of every query.
+"""
+
+from __future__ import annotations
+
+import abc
+import functools
+import json
+import re
+import shutil
+import threading
+import time
+import urllib.parse
+from collections.abc import Callable, Generator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import pytest
+
+
+if TYPE_CHECKING:
+    import pluggy
+
+
+# The fixtures in which pytest-django sets up and resets the test databases.
+# Their queries are not caused by the test itself.
+INTERNAL_FIXTURES = frozenset({"django_db_setup", "_django_db_helper", "_django_setup_unittest"})
+
+
+class Query:
+    """A query executed through a Django connection, as seen by the observers."""
+
+    __slots__ = (
+        "alias",
+        "duration",
+        "error",
+        "fixture",
+        "many",
+        "nodeid",
+        "params",
+        "phase",
+        "rowcount",
+        "rows",
+        "sql",
+    )
+
+    def __init__(
+        self,
+        alias: str,
+        sql: str,
+        params: Any,
+        *,
+        many: bool,
+        nodeid: str | None,
+        phase: str | None,
+        fixture: str | None,
+    ) -> None:
+        self.alias = alias
+        self.sql = sql
+        self.params = params
+        self.many = many
+        #: The test, the phase of it (setup, call or teardown) and the fixture
+        #: which executed the query, if any.
+        self.nodeid = nodeid
+        self.phase = phase
+        self.fixture = fixture
+        #: In seconds, set once the query is done.
+        self.duration = 0.0
+        #: The exception raised by the query, if any.
+        self.error: BaseException | None = None
+        #: When the instrumentation tracks rows, the number of rows fetched
+        #: from the result of the query so far, and the number of rows in the
+        #: result as reported by the database. They are ``None`` for queries
+        #: which return no rows, and the latter when the database does not
+        #: report it, e.g. on SQLite.
+        self.rows: int | None = None
+        self.rowcount: int | None = None
+
+    @property
+    def internal(self) -> bool:
+        """Whether the query was executed by pytest-django's database setup."""
+        return self.fixture in INTERNAL_FIXTURES
+
+
+class QueryObserver:
+    """Base class of the objects notified of the queries by the instrumentation."""
+
+    def before_query(self, query: Query) -> None:
+        """Called before the query is executed."""
+
+    def after_query(self, query: Query) -> None:
+        """Called after the query is executed, even if it failed."""
+
+    def after_fetch(self, query: Query) -> None:
+        """Called after rows of the result of the query are fetched, when the
+        instrumentation tracks rows."""
+
+
+_SQL_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+_SQL_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_SQL_NUMBER_RE = re.compile(r"(?<![\w\".])-?\d+(?:\.\d+)?(?![\w\"])")
+_SQL_SAVEPOINT_RE = re.compile(r"\bs\d+_x\d+\b")
+_SQL_IN_LIST_RE = re.compile(r"\bIN \(\?(?:, \?)*\)", re.IGNORECASE)
+_SQL_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """Normalize an executed SQL statement to its shape.
+
+    Comments are removed, literal values and placeholders are replaced by
+    ``?``, ``IN`` lists are collapsed and savepoint names are made independent
+    of the thread which created them.
+    """
+    sql = _SQL_COMMENT_RE.sub("", sql)
+    sql = sql.replace("%s", "?")
+    sql = _SQL_STRING_RE.sub("?", sql)
+    sql = _SQL_SAVEPOINT_RE.sub("s?_x?", sql)
+    sql = _SQL_NUMBER_RE.sub("?", sql)
+    sql = _SQL_WHITESPACE_RE.sub(" ", sql).strip()
+    return _SQL_IN_LIST_RE.sub("IN (...)", sql)
+
+
+_DML_RE = re.compile(r"\s*(INSERT|UPDATE|DELETE)\b", re.IGNORECASE)
+
+
+def returns_rows(cursor: Any, sql: str) -> bool:
+    """Whether the query just executed with the cursor returns rows, not
+    counting the modified rows returned by an ``INSERT``, ``UPDATE`` or
+    ``DELETE`` with a ``RETURNING`` clause."""
+    return cursor.description is not None and not _DML_RE.match(sql)
+
+
+class _FetchTracker:
+    """Counts the rows fetched from a cursor, for the query it executed last."""
+
+    def __init__(self, cursor: Any) -> None:
+        self.context: dict[str, Any] | None = None
+        self.callbacks: list[Callable[[int], None]] = []
+        cursor.fetchone = self._wrap_fetch(cursor.fetchone, lambda row: row is not None)
+        cursor.fetchmany = self._wrap_fetch(cursor.fetchmany, len)
+        cursor.fetchall = self._wrap_fetch(cursor.fetchall, len)
+
+    def _wrap_fetch(
+        self, fetch: Callable[..., Any], count: Callable[[Any], int]
+    ) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            result = fetch(*args, **kwargs)
+            rows = count(result)
+            if rows:
+                for callback in self.callbacks:
+                    callback(rows)
+            return result
+
+        return wrapper
+
+
+def track_fetched_rows(context: dict[str, Any], callback: Callable[[int], None]) -> None:
+    """Call ``callback`` with the number of rows fetched from the result of the
+    query executed with the given execute wrapper ``context``, on each fetch.
+
+    Rows read by iterating over the cursor directly are not counted.
+    """
+    cursor = context["cursor"]
+    tracker = cursor.__dict__.get("_pytest_django_fetch_tracker")
+    if tracker is None:
+        tracker = cursor._pytest_django_fetch_tracker = _FetchTracker(cursor)
+    if tracker.context is not context:
+        # A new query was executed with the cursor.
+        tracker.context = context
+        tracker.callbacks = []
+    tracker.callbacks.append(callback)
+
+
+class QueryInstrumentation:
+    """Notifies its observers of the queries executed through Django's
+    connections, and tracks the test, phase and fixture executing them.
+
+    It is registered as a plugin for the latter.
+    """
+
+    def __init__(self) -> None:
+        self.observers: list[QueryObserver] = []
+        self.nodeid: str | None = None
+        self.phase: str | None = None
+        self.fixture: str | None = None
+        #: Whether to count the rows fetched from the results of the queries.
+        self.track_rows = False
+
+    def install(self) -> None:
+        """Install the execute wrapper on the connections of the current thread."""
+        from django.db import connections
+
+        for conn in connections.all():
+            if self._execute_wrapper not in conn.execute_wrappers:
+                # Django's `execute_wrapper()` context manager pops the last
+                # wrapper on exit, so never append after a user's wrapper.
+                conn.execute_wrappers.insert(0, self._execute_wrapper)
+
+    def _execute_wrapper(
+        self,
+        execute: Callable[..., Any],
+        sql: str,
+        params: Any,
+        many: bool,
+        context: dict[str, Any],
+    ) -> Any:
+        __tracebackhide__ = True
+        query = Query(
+            context["connection"].alias,
+            sql,
+            params,
+            many=many,
+            nodeid=self.nodeid,
+            phase=self.phase,
+            fixture=self.fixture,
+        )
+        for observer in self.observers:
+            observer.before_query(query)
+        start = time.perf_counter()
+        try:
+            result = execute(query.sql, params, many, context)
+        except BaseException as exc:
+            query.error = exc
+            raise
+        else:
+            if self.track_rows:
+                self._track_rows(query, context)
+            return result
+        finally:
+            query.duration = time.perf_counter() - start
+            self._after_query(query)
+
+    def _after_query(self, query: Query) -> None:
+        __tracebackhide__ = True
+        # All the observers see the query, even if one of them fails the test,
+        # e.g. `QueryTimeLimit`, and the first error is raised afterwards.
+        error: BaseException | None = None
+        for observer in self.observers:
+            try:
+                observer.after_query(query)
+            except BaseException as exc:  # noqa: BLE001, PERF203
+                if error is None:
+                    error = exc
+        if error is not None:
+            raise error
+
+    def _track_rows(self, query: Query, context: dict[str, Any]) -> None:
+        cursor = context["cursor"]
+        if not returns_rows(cursor, query.sql):
+            return
+        query.rows = 0
+        if cursor.rowcount >= 0:
+            query.rowcount = cursor.rowcount
+
+        def fetched(rows: int) -> None:
+            query.rows = (query.rows or 0) + rows
+            for observer in self.observers:
+                observer.after_fetch(query)
+
+        track_fetched_rows(context, fetched)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self, item: pytest.Item) -> Generator[None]:
+        self.nodeid = item.nodeid
+        self.phase = "setup"
+        yield
+        self.phase = self.fixture = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self) -> Generator[None]:
+        self.phase = "call"
+        yield
+        self.phase = self.fixture = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self) -> Generator[None]:
+        self.phase = "teardown"
+        yield
+        self.nodeid = self.phase = self.fixture = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef: pytest.FixtureDef[Any]) -> Generator[None]:
+        argname = fixturedef.argname
+        # Finalizers run in reverse order: this one runs after the fixture's
+        # own teardown...
+        fixturedef.addfinalizer(self._set_fixture(None))
+        previous = self.fixture
+        self.fixture = argname
+        yield
+        self.fixture = previous
+        # ...and this one before it.
+        fixturedef.addfinalizer(self._set_fixture(argname))
+
+    def _set_fixture(self, argname: str | None) -> Callable[[], None]:
+        def set_fixture() -> None:
+            self.fixture = argname
+
+        return set_fixture
+
+
+class QueryTimeLimit(QueryObserver):
+    """Fails the test when a single query exceeds ``--django-query-timeout``."""
+
+    def __init__(self, limit_ms: float) -> None:
+        self.limit_ms = limit_ms
+
+    def after_query(self, query: Query) -> None:
+        __tracebackhide__ = True
+        if query.error is not None or query.internal:
+            return
+        duration_ms = query.duration * 1000
+        if duration_ms > self.limit_ms:
+            pytest.fail(
+                f"Query took {duration_ms:.1f} ms, exceeding the --django-query-timeout "
+                f"of {self.limit_ms:g} ms:\n\n{query.sql}"
+            )
+
+
+class SqlCommenter(QueryObserver):
+    """Appends a comment in the sqlcommenter format to each query, with the
+    test, phase and fixture executing it.
+
+    See https://google.github.io/sqlcommenter/spec/.
+    """
+
+    def before_query(self, query: Query) -> None:
+        if "/*" in query.sql or "--" in query.sql:
+            # The spec forbids modifying statements with comments.
+            return
+        tags = {"fixture": query.fixture, "phase": query.phase, "test": query.nodeid}
+        comment = ",".join(
+            f"{key}='{urllib.parse.quote(value, safe='')}'"
+            for key, value in sorted(tags.items())
+            if value is not None
+        )
+        if not comment:
+            return
+        if query.params is not None:
+            # The percent-encoding would be taken for placeholders.
+            comment = comment.replace("%", "%%")
+        sql = query.sql.rstrip()
+        if sql.endswith(";"):
+            query.sql = f"{sql[:-1]} /*{comment}*/;"
+        else:
+            query.sql = f"{sql} /*{comment}*/"
+
+
+class DbMetrics(QueryObserver):
+    """Records the database usage of each test in its ``user_properties``,
+    and as the ``django_db_metrics`` attribute of its teardown report."""
+
+    def __init__(self, instrumentation: QueryInstrumentation) -> None:
+        from django.db.backends.signals import connection_created
+
+        self._instrumentation = instrumentation
+        self._reset()
+        connection_created.connect(self._connection_created)
+
+    def _reset(self) -> None:
+        self.queries = 0
+        self.time = 0.0
+        self.connections = 0
+
+    def after_query(self, query: Query) -> None:
+        if not query.internal:
+            self.queries += 1
+            self.time += query.duration
+
+    def _connection_created(self, **kwargs: Any) -> None:  # noqa: ARG002
+        if self._instrumentation.fixture not in INTERNAL_FIXTURES:
+            self.connections += 1
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(
+        self, item: pytest.Item, call: pytest.CallInfo[None]
+    ) -> Generator[None, pluggy.Result[pytest.TestReport]]:
+        if call.when != "teardown":
+            yield
+            return
+        # Before the report is made, as it copies them.
+        item.user_properties.extend(
+            [
+                ("django_db_queries", self.queries),
+                ("django_db_time", round(self.time, 6)),
+                ("django_db_connections", self.connections),
+            ]
+        )
+        outcome = yield
+        outcome.get_result().django_db_metrics = {  # type: ignore[attr-defined]
+            "queries": self.queries,
+            "time": self.time,
+            "connections": self.connections,
+        }
+        self._reset()
+
+
+class SessionReport(abc.ABC):
+    """Base class of the plugins which collect data during each test and
+    report on the whole session in the terminal summary.
+
+    The data of each test is attached to its teardown report as the
+    ``report_attr`` attribute, so that pytest-xdist workers send it to the
+    controller along with the report.
+    """
+
+    report_attr: str
+
+    @abc.abstractmethod
+    def pop_test_data(self) -> Any:
+        """Return the data collected during the current test and reset it.
+
+        It must only consist of plain types, to be serialized by pytest-xdist.
+        """
+
+    @abc.abstractmethod
+    def add_test_data(self, data: Any) -> None:
+        """Add the data of a test to the data of the session."""
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(
+        self, call: pytest.CallInfo[None]
+    ) -> Generator[None, pluggy.Result[pytest.TestReport]]:
+        outcome = yield
+        if call.when == "teardown":
+            setattr(outcome.get_result(), self.report_attr, self.pop_test_data())
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        data = getattr(report, self.report_attr, None)
+        if data is not None:
+            self.add_test_data(data)
+
+
+class LargeResultReport(SessionReport, QueryObserver):
+    """Reports the queries returning more than ``--django-report-rows`` rows
+    in the terminal summary."""
+
+    report_attr = "django_large_results"
+
+    #: The number of queries shown in the summary.
+    max_shown = 20
+
+    def __init__(self, threshold: int) -> None:
+        self.threshold = threshold
+        # The large queries of the current test.
+        self._queries: list[Query] = []
+        self.results: list[dict[str, Any]] = []
+
+    def after_query(self, query: Query) -> None:
+        if query.rowcount is not None and query.rowcount > self.threshold:
+            self._add(query)
+
+    def after_fetch(self, query: Query) -> None:
+        if query.rows is not None and query.rows > self.threshold:
+            self._add(query)
+
+    def _add(self, query: Query) -> None:
+        if not query.internal and not any(q is query for q in self._queries):
+            self._queries.append(query)
+
+    def pop_test_data(self) -> list[dict[str, Any]]:
+        results = [
+            {
+                "nodeid": query.nodeid,
+                "phase": query.phase,
+                "fixture": query.fixture,
+                "sql": query.sql,
+                "rows": query.rows,
+                "rowcount": query.rowcount,
+            }
+            for query in self._queries
+        ]
+        self._queries = []
+        return results
+
+    def add_test_data(self, data: list[dict[str, Any]]) -> None:
+        self.results.extend(data)
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        if not self.results:
+            return
+        terminalreporter.write_sep(
+            "=", f"Django queries returning more than {self.threshold} rows"
+        )
+        results = sorted(
+            self.results,
+            key=lambda result: max(result["rows"] or 0, result["rowcount"] or 0),
+            reverse=True,
+        )
+        for result in results[: self.max_shown]:
+            where = result["phase"]
+            if result["fixture"]:
+                where += f", fixture {result['fixture']}"
+            if result["rowcount"] is None:
+                rows = f"fetched {result['rows']} rows"
+            else:
+                rows = f"fetched {result['rows']} of {result['rowcount']} rows"
+            terminalreporter.write_line(f"{result['nodeid']} ({where}): {rows}")
+            terminalreporter.write_line(f"    {result['sql']}")
+        if len(results) > self.max_shown:
+            terminalreporter.write_line(
+                f"({len(results) - self.max_shown} more queries not shown)"
+            )
+
+
+class FixtureQueryReport(SessionReport, QueryObserver):
+    """Reports the database queries and time of the fixtures, ranked by time,
+    in the terminal summary."""
+
+    report_attr = "django_fixture_usage"
+
+    def __init__(self, count: int) -> None:
+        #: The number of fixtures shown, 0 for all.
+        self.count = count
+        # The usage of the fixtures in the current test and in the session,
+        # by fixture name.
+        self._usage: dict[str, dict[str, Any]] = {}
+        self.usage: dict[str, dict[str, Any]] = {}
+
+    def _get_usage(self, usage: dict[str, dict[str, Any]], argname: str) -> dict[str, Any]:
+        if argname not in usage:
+            usage[argname] = {"setups": 0, "queries": 0, "duration": 0.0}
+        return usage[argname]
+
+    def after_query(self, query: Query) -> None:
+        if query.fixture is not None and not query.internal:
+            usage = self._get_usage(self._usage, query.fixture)
+            usage["queries"] += 1
+            usage["duration"] += query.duration
+
+    def pytest_fixture_setup(self, fixturedef: pytest.FixtureDef[Any]) -> None:
+        if fixturedef.argname not in INTERNAL_FIXTURES:
+            self._get_usage(self._usage, fixturedef.argname)["setups"] += 1
+
+    def pop_test_data(self) -> dict[str, dict[str, Any]]:
+        usage = self._usage
+        self._usage = {}
+        return usage
+
+    def add_test_data(self, data: dict[str, dict[str, Any]]) -> None:
+        for argname, test_usage in data.items():
+            usage = self._get_usage(self.usage, argname)
+            for key, value in test_usage.items():
+                usage[key] += value
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        ranked = sorted(
+            ((argname, usage) for argname, usage in self.usage.items() if usage["queries"]),
+            key=lambda item: item[1]["duration"],
+            reverse=True,
+        )
+        if self.count:
+            title = f"slowest {self.count} Django fixtures by database time"
+        else:
+            title = "Django fixtures by database time"
+        terminalreporter.write_sep("=", title)
+        if not ranked:
+            terminalreporter.write_line("No fixture executed database queries.")
+            return
+        terminalreporter.write_line(f"{'db time':>9} {'queries':>8} {'setups':>7}  fixture")
+        for argname, usage in ranked[: self.count or None]:
+            terminalreporter.write_line(
+                f"{usage['duration']:8.3f}s {usage['queries']:8d} {usage['setups']:7d}  {argname}"
+            )
+
+
+def wrap_method(cls: type, name: str, wrapper: Callable[..., Any]) -> Callable[[], None]:
+    """Replace the method ``name`` of ``cls``, which may be a classmethod, by
+    ``wrapper``, called with the original function followed by its arguments.
+
+    Return a function removing this wrapper. The wrappers of a method may be
+    removed in any order: a wrapper removed under another one only calls the
+    method it wraps, until the outer one is removed along with it.
+    """
+    original = cls.__dict__[name]
+    # E.g. `_pre_setup` is a classmethod in recent Django versions.
+    is_classmethod = isinstance(original, classmethod)
+    func = original.__func__ if is_classmethod else original
+    layer = {"original": original, "active": True}
+
+    @functools.wraps(func)
+    def wrapped(*args: Any, **kwargs: Any) -> Any:
+        if not layer["active"]:
+            return func(*args, **kwargs)
+        return wrapper(func, *args, **kwargs)
+
+    wrapped._pytest_django_layer = layer  # type: ignore[attr-defined]
+    method = classmethod(wrapped) if is_classmethod else wrapped
+    setattr(cls, name, method)
+
+    def restore() -> None:
+        layer["active"] = False
+        if cls.__dict__.get(name) is not method:
+            return
+        # Also remove the wrappers under this one which were removed before.
+        restored = original
+        while True:
+            inner = getattr(
+                restored.__func__ if isinstance(restored, classmethod) else restored,
+                "_pytest_django_layer",
+                None,
+            )
+            if inner is None or inner["active"]:
+                break
+            restored = inner["original"]
+        setattr(cls, name, restored)
+
+    return restore
+
+
+def get_db_kind(test_case: Any) -> str:
+    """Get the kind of database access of a Django test case or test case
+    class: ``db``, ``transactional_db``, ``reset_sequences`` or
+    ``serialized_rollback``."""
+    from django.test import TestCase
+
+    test_case_class: Any = test_case if isinstance(test_case, type) else type(test_case)
+    if issubclass(test_case_class, TestCase):
+        return "db"
+    elif test_case_class.serialized_rollback:
+        return "serialized_rollback"
+    elif test_case_class.reset_sequences:
+        return "reset_sequences"
+    else:
+        return "transactional_db"
+
+
+class DbUsageReport(SessionReport):
+    """Reports the number and duration of the tests by kind of database
+    access, and the costliest transactional tests, in the terminal summary.
+
+    The kind of database access of a test is taken from the Django test case
+    class whose ``_pre_setup`` runs for it, be it the test itself or the one
+    created for it by pytest-django.
+    """
+
+    report_attr = "django_db_usage"
+
+    categories = ("no db", "db", "transactional_db", "reset_sequences", "serialized_rollback")
+
+    #: The number of transactional tests shown in the summary.
+    max_shown = 10
+
+    def __init__(self) -> None:
+        self._reset()
+        # The duration of the phases of the tests whose teardown report was not
+        # received yet, by node id.
+        self._durations: dict[str, float] = {}
+        self.usage = {
+            category: {"tests": 0, "duration": 0.0, "pre_setup": 0.0, "post_teardown": 0.0}
+            for category in self.categories
+        }
+        self.transactional_tests: list[tuple[float, str, str]] = []
+
+    def _reset(self) -> None:
+        self._category = "no db"
+        self._pre_setup = 0.0
+        self._post_teardown = 0.0
+
+    def pytest_sessionstart(self) -> None:
+        from django.test import TransactionTestCase
+
+        # Note that `TestCase` is a subclass of `TransactionTestCase`.
+        self._restore = [
+            wrap_method(TransactionTestCase, "_pre_setup", self._time_pre_setup),
+            wrap_method(TransactionTestCase, "_post_teardown", self._time_post_teardown),
+        ]
+
+    def pytest_sessionfinish(self) -> None:
+        for restore in self._restore:
+            restore()
+
+    def _time_pre_setup(self, func: Callable[..., Any], test_case: Any, *args: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return func(test_case, *args)
+        finally:
+            self._pre_setup += time.perf_counter() - start
+            self._category = get_db_kind(test_case)
+
+    def _time_post_teardown(self, func: Callable[..., Any], test_case: Any, *args: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return func(test_case, *args)
+        finally:
+            self._post_teardown += time.perf_counter() - start
+
+    def pytest_runtest_setup(self, item: pytest.Item) -> None:
+        self._nodeid = item.nodeid
+
+    def pop_test_data(self) -> dict[str, Any]:
+        data = {
+            "nodeid": self._nodeid,
+            "category": self._category,
+            "pre_setup": self._pre_setup,
+            "post_teardown": self._post_teardown,
+        }
+        self._reset()
+        return data
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        self._durations[report.nodeid] = self._durations.get(report.nodeid, 0.0) + report.duration
+        super().pytest_runtest_logreport(report)
+
+    def add_test_data(self, data: dict[str, Any]) -> None:
+        duration = self._durations.pop(data["nodeid"], 0.0)
+        usage = self.usage[data["category"]]
+        usage["tests"] += 1
+        usage["duration"] += duration
+        usage["pre_setup"] += data["pre_setup"]
+        usage["post_teardown"] += data["post_teardown"]
+        if data["category"] not in {"no db", "db"}:
+            self.transactional_tests.append((duration, data["category"], data["nodeid"]))
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        terminalreporter.write_sep("=", "Django database usage")
+        terminalreporter.write_line(
+            f"{'kind':<20} {'tests':>6} {'time':>9} {'_pre_setup':>11} {'_post_teardown':>15}"
+        )
+        for category, usage in self.usage.items():
+            terminalreporter.write_line(
+                f"{category:<20} {usage['tests']:6d} {usage['duration']:8.2f}s "
+                f"{usage['pre_setup']:10.2f}s {usage['post_teardown']:14.2f}s"
+            )
+        if not self.transactional_tests:
+            return
+        terminalreporter.write_line("")
+        terminalreporter.write_line("Costliest transactional tests:")
+        costliest = sorted(self.transactional_tests, reverse=True)[: self.max_shown]
+        for duration, category, nodeid in costliest:
+            terminalreporter.write_line(f"{duration:8.2f}s {category:<20} {nodeid}")
+
+
+class TransactionAudit(SessionReport):
+    """Reports the transactional tests which showed no need for transactions
+    in the terminal summary.
+
+    A transactional test needs them when it uses a live server, accesses the
+    database from another thread, which only sees committed data, or runs
+    ``transaction.on_commit()`` callbacks. Other tests may be converted to
+    cheaper non-transactional tests.
+    """
+
+    report_attr = "django_transaction_audit"
+
+    def __init__(self) -> None:
+        self._reset()
+        #: The node ids of the transactional tests and of the candidates to
+        #: be converted.
+        self.transactional_tests: list[str] = []
+        self.candidates: list[str] = []
+
+    def _reset(self) -> None:
+        self._transactional = False
+        self._needs_transactions = False
+
+    def pytest_sessionstart(self) -> None:
+        from django.db.backends.base.base import BaseDatabaseWrapper
+        from django.db.backends.signals import connection_created
+        from django.test import TransactionTestCase
+
+        self._restore = [
+            wrap_method(TransactionTestCase, "_pre_setup", self._check_pre_setup),
+            wrap_method(BaseDatabaseWrapper, "on_commit", self._check_on_commit),
+            wrap_method(
+                BaseDatabaseWrapper,
+                "run_and_clear_commit_hooks",
+                self._check_run_and_clear_commit_hooks,
+            ),
+        ]
+        connection_created.connect(self._check_connection_created)
+
+    def pytest_sessionfinish(self) -> None:
+        from django.db.backends.signals import connection_created
+
+        for restore in self._restore:
+            restore()
+        connection_created.disconnect(self._check_connection_created)
+
+    def _check_pre_setup(self, func: Callable[..., Any], test_case: Any, *args: Any) -> Any:
+        from django.test import LiveServerTestCase
+
+        self._transactional = get_db_kind(test_case) != "db"
+        if isinstance(test_case, LiveServerTestCase) or (
+            isinstance(test_case, type) and issubclass(test_case, LiveServerTestCase)
+        ):
+            self._needs_transactions = True
+        return func(test_case, *args)
+
+    def _check_on_commit(self, func: Callable[..., Any], connection: Any, *args: Any) -> Any:
+        if not connection.in_atomic_block and connection.get_autocommit():
+            # The callback is run immediately.
+            self._needs_transactions = True
+        return func(connection, *args)
+
+    def _check_run_and_clear_commit_hooks(self, func: Callable[..., Any], connection: Any) -> Any:
+        if connection.run_on_commit:
+            self._needs_transactions = True
+        return func(connection)
+
+    def _check_connection_created(self, **kwargs: Any) -> None:  # noqa: ARG002
+        if threading.get_ident() != self._thread_id:
+            self._needs_transactions = True
+
+    def pytest_runtest_setup(self, item: pytest.Item) -> None:
+        self._nodeid = item.nodeid
+        self._thread_id = threading.get_ident()
+        if "live_server" in getattr(item, "fixturenames", ()):
+            self._needs_transactions = True
+
+    def pop_test_data(self) -> dict[str, Any] | None:
+        data = None
+        if self._transactional:
+            data = {"nodeid": self._nodeid, "needs_transactions": self._needs_transactions}
+        self._reset()
+        return data
+
+    def add_test_data(self, data: dict[str, Any]) -> None:
+        self.transactional_tests.append(data["nodeid"])
+        if not data["needs_transactions"]:
+            self.candidates.append(data["nodeid"])
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        terminalreporter.write_sep("=", "Django transactional tests audit")
+        terminalreporter.write_line(
+            f"{len(self.candidates)} of {len(self.transactional_tests)} transactional "
+            f"tests showed no need for transactions:"
+        )
+        for nodeid in sorted(self.candidates):
+            terminalreporter.write_line(f"  {nodeid}")
+
+
+class UnusedDbMarkAudit(SessionReport, QueryObserver):
+    """Reports the tests marked with ``django_db`` which executed no database
+    queries, by module, in the terminal summary, and optionally fails them.
+    """
+
+    report_attr = "django_unused_db_mark"
+
+    def __init__(self, fail: bool) -> None:
+        self.fail = fail
+        #: The names of the marked tests and of the ones executing no queries,
+        #: by module.
+        self.marked_tests: dict[str, list[str]] = {}
+        self.unused_tests: dict[str, list[str]] = {}
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item: pytest.Item) -> None:
+        from .fixtures import get_db_plan
+
+        self._nodeid = item.nodeid
+        # The queries of a live server are executed in its own thread, so they
+        # are not seen.
+        self._marked = get_db_plan(item).marked and (
+            "live_server" not in getattr(item, "fixturenames", ())
+        )
+        self._passed = False
+        self._unused = False
+        self._queries = 0
+
+    def after_query(self, query: Query) -> None:
+        if not query.internal:
+            self._queries += 1
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(
+        self, call: pytest.CallInfo[None]
+    ) -> Generator[None, pluggy.Result[pytest.TestReport]]:
+        outcome = yield
+        report = outcome.get_result()
+        if not self._marked:
+            return
+        if call.when == "setup":
+            self._passed = report.passed
+        elif call.when == "call":
+            # Failed or skipped tests may not have reached their queries.
+            self._unused = self._passed and report.passed and not self._queries
+            if self._unused and self.fail:
+                report.outcome = "failed"
+                report.longrepr = (
+                    "The test is marked with django_db but executed no database queries "
+                    "(--django-unused-db-marks=fail)"
+                )
+        else:
+            setattr(report, self.report_attr, self.pop_test_data())
+
+    def pop_test_data(self) -> dict[str, Any]:
+        return {"nodeid": self._nodeid, "unused": self._unused}
+
+    def add_test_data(self, data: dict[str, Any]) -> None:
+        module, _, name = data["nodeid"].partition("::")
+        self.marked_tests.setdefault(module, []).append(name)
+        if data["unused"]:
+            self.unused_tests.setdefault(module, []).append(name)
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        terminalreporter.write_sep("=", "django_db-marked tests without database queries")
+        if not self.unused_tests:
+            terminalreporter.write_line("All marked tests executed database queries.")
+            return
+        for module, names in sorted(self.unused_tests.items()):
+            terminalreporter.write_line(
+                f"{module}: {len(names)} of {len(self.marked_tests[module])} marked tests"
+            )
+            for name in sorted(names):
+                terminalreporter.write_line(f"  {name}")
+
+
+class WorkerFiles:
+    """Base class of the plugins writing a file, which with pytest-xdist each
+    worker writes under its own name, and the controller merges into its own
+    file at the end of the session.
+    """
+
+    #: The key of the path of the file of a worker in its ``workeroutput``.
+    workeroutput_key: str
+
+    def __init__(self) -> None:
+        self._worker_paths: list[Path] = []
+
+    @staticmethod
+    def get_worker_path(config: pytest.Config, path: Path) -> Path:
+        """Get the path of the file of the current worker, if any."""
+        workerinput = getattr(config, "workerinput", None)
+        if workerinput is None:
+            return path
+        return path.with_name(f"{path.stem}.{workerinput['workerid']}{path.suffix}")
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node: Any) -> None:
+        # Not set if the worker crashed.
+        path = getattr(node, "workeroutput", {}).get(self.workeroutput_key)
+        if path is not None:
+            self._worker_paths.append(Path(path))
+
+    def merge_worker_files(
+        self, config: pytest.Config, path: Path, merge: Callable[[Path], None]
+    ) -> None:
+        """In a worker, send the path of its file to the controller. In the
+        controller, merge the files of the workers, in the order of their IDs,
+        with ``merge``, and remove them."""
+        workeroutput = getattr(config, "workeroutput", None)
+        if workeroutput is not None:
+            workeroutput[self.workeroutput_key] = str(path)
+        for worker_path in sorted(self._worker_paths, key=lambda p: (len(p.name), p.name)):
+            merge(worker_path)
+            worker_path.unlink()
+        self._worker_paths = []
+
+
+class QueryLog(WorkerFiles, QueryObserver):
+    """Writes a JSON line for each query to the ``--django-query-log`` file.
+
+    With pytest-xdist, each worker writes its own file, which the controller
+    appends to its file at the end of the session.
+    """
+
+    workeroutput_key = "django_query_log"
+
+    def __init__(self, config: pytest.Config, path: Path) -> None:
+        super().__init__()
+        path = self.get_worker_path(config, path)
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Closed at the end of the session.
+        self._file = path.open("w", encoding="utf-8")
+        # The queries whose rows may still be fetched.
+        self._pending: list[Query] = []
+
+    def after_query(self, query: Query) -> None:
+        # The results of the previous queries are usually fully read by now.
+        self._flush()
+        self._pending.append(query)
+
+    def _flush(self) -> None:
+        for query in self._pending:
+            record = {
+                "nodeid": query.nodeid,
+                "phase": query.phase,
+                "fixture": query.fixture,
+                "alias": query.alias,
+                "sql": normalize_sql(query.sql),
+                "duration": query.duration,
+                "rows": query.rows,
+            }
+            self._file.write(json.dumps(record) + "\n")
+        self._pending = []
+
+    def pytest_runtest_logreport(self) -> None:
+        self._flush()
+
+    def _append_file(self, path: Path) -> None:
+        with path.open(encoding="utf-8") as f:
+            shutil.copyfileobj(f, self._file)
+
+    def pytest_sessionfinish(self, session: pytest.Session) -> None:
+        self._flush()
+        self.merge_worker_files(session.config, self.path, self._append_file)
+        self._file.close()
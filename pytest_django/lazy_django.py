@@ -4,8 +4,14 @@ Helpers to load Django lazily when Django settings can't be configured.
 
 from __future__ import annotations
 
+import contextlib
+import importlib.abc
+import importlib.machinery
+import importlib.util
 import os
 import sys
+import types
+from collections.abc import Callable, Sequence
 from typing import Any
 
 import pytest
@@ -24,6 +30,10 @@ def django_settings_is_configured() -> bool:
     configured flag in the Django settings object if django.conf has already
     been imported.
     """
+    # Not configured yet with `--django-lazy-setup`.
+    if any(isinstance(finder, DeferredSetup) for finder in sys.meta_path):
+        return False
+
     ret = bool(os.environ.get("DJANGO_SETTINGS_MODULE"))
 
     if not ret and "django.conf" in sys.modules:
@@ -38,3 +48,92 @@ def get_django_version() -> tuple[int, int, int, str, int]:
 
     version: tuple[int, int, int, str, int] = django.VERSION
     return version
+
+
+class DeferredSetup(importlib.abc.MetaPathFinder):
+    """The setup of Django deferred by ``--django-lazy-setup`` until a test
+    needs it.
+
+    While pending, Django is reported as not configured. It is also an import
+    hook, which sets Django up before the import of the models module of an
+    installed app, e.g. by a conftest, as the models can only be defined once
+    Django is set up. The settings are loaded to find the installed apps, which
+    does not require the setup.
+    """
+
+    def __init__(self, setup: Callable[[], None], load_settings: Callable[[], None]) -> None:
+        self._setup = setup
+        self._load_settings = load_settings
+        self._app_names: tuple[str, ...] | None = None
+
+    @property
+    def pending(self) -> bool:
+        return self in sys.meta_path
+
+    def install(self) -> None:
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self) -> None:
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def setup(self) -> None:
+        """Set Django up, if it is still pending."""
+        if self.pending:
+            self.uninstall()
+            self._setup()
+
+    def _get_app_names(self) -> tuple[str, ...]:
+        """Get the entries of ``INSTALLED_APPS``, or none if the settings
+        cannot be loaded, to report the error when a test needs Django."""
+        if self._app_names is None:
+            # For the imports by the settings module.
+            self._app_names = ()
+            with contextlib.suppress(Exception):
+                self._load_settings()
+
+                from django.conf import settings
+
+                self._app_names = tuple(settings.INSTALLED_APPS)
+        return self._app_names
+
+    def _is_app_models_module(self, fullname: str) -> bool:
+        package, _, name = fullname.rpartition(".")
+        if name != "models" or not package:
+            return False
+        # An entry is either the package of the app, or the path of its
+        # `AppConfig` subclass, which is usually within the package.
+        return any(
+            app_name == package or app_name.startswith(f"{package}.")
+            for app_name in self._get_app_names()
+        )
+
+    def find_spec(
+        self,
+        fullname: str,
+        path: Sequence[str] | None,  # noqa: ARG002
+        target: types.ModuleType | None = None,  # noqa: ARG002
+    ) -> importlib.machinery.ModuleSpec | None:
+        if not self._is_app_models_module(fullname):
+            return None
+        self.setup()
+        # Imported by the setup, so it must not be executed again.
+        module = sys.modules.get(fullname)
+        if module is None:
+            return None
+        return importlib.util.spec_from_loader(fullname, _ImportedLoader(module))
+
+
+class _ImportedLoader(importlib.abc.Loader):
+    """Loads a module which is already imported."""
+
+    def __init__(self, module: types.ModuleType) -> None:
+        self._module = module
+        self._spec = module.__spec__
+
+    def create_module(self, spec: importlib.machinery.ModuleSpec) -> types.ModuleType:  # noqa: ARG002
+        return self._module
+
+    def exec_module(self, module: types.ModuleType) -> None:
+        # Replaced by the import system.
+        module.__spec__ = self._spec
@@ -8,12 +8,14 @@ from __future__ import annotations
 
 import argparse
 import contextlib
+import functools
 import inspect
 import os
 import pathlib
 import sys
+import threading
 import types
-from collections.abc import Generator
+from collections.abc import Callable, Generator
 from contextlib import AbstractContextManager
 from functools import reduce
 from typing import TYPE_CHECKING, Any, NoReturn
@@ -22,41 +24,85 @@ import pytest
 
 from .django_compat import is_django_unittest
 from .fixtures import (
+    BackgroundDatabaseSetup,
     _django_db_helper,  # noqa: F401
+    _get_database_group,
     _live_server_helper,  # noqa: F401
+    _routes_databases,
     admin_client,  # noqa: F401
     admin_user,  # noqa: F401
     async_client,  # noqa: F401
     async_rf,  # noqa: F401
+    background_db_setup_key,
     client,  # noqa: F401
     db,  # noqa: F401
     django_assert_max_num_queries,  # noqa: F401
+    django_assert_max_query_time,  # noqa: F401
+    django_assert_no_seq_scans,  # noqa: F401
     django_assert_num_queries,  # noqa: F401
     django_capture_on_commit_callbacks,  # noqa: F401
     django_db_createdb,  # noqa: F401
     django_db_keepdb,  # noqa: F401
     django_db_modify_db_settings,  # noqa: F401
     django_db_modify_db_settings_parallel_suffix,  # noqa: F401
+    django_db_modify_db_settings_shard_suffix,  # noqa: F401
     django_db_modify_db_settings_tox_suffix,  # noqa: F401
     django_db_modify_db_settings_xdist_suffix,  # noqa: F401
     django_db_reset_sequences,  # noqa: F401
     django_db_serialized_rollback,  # noqa: F401
     django_db_setup,  # noqa: F401
     django_db_use_migrations,  # noqa: F401
+    django_query_snapshot,  # noqa: F401
     django_user_model,  # noqa: F401
     django_username_field,  # noqa: F401
+    get_db_plan,
     live_server,  # noqa: F401
+    query_snapshot_notices_key,
     rf,  # noqa: F401
+    routed_databases_key,
     settings,  # noqa: F401
+    store_db_plan,
     transactional_db,  # noqa: F401
-    validate_django_db,
 )
-from .lazy_django import django_settings_is_configured, skip_if_no_django
+from .instrumentation import (
+    DbMetrics,
+    DbUsageReport,
+    FixtureQueryReport,
+    LargeResultReport,
+    QueryInstrumentation,
+    QueryLog,
+    QueryTimeLimit,
+    SqlCommenter,
+    TransactionAudit,
+    UnusedDbMarkAudit,
+)
+from .lazy_django import DeferredSetup, django_settings_is_configured, skip_if_no_django
+from .profiling import (
+    MemoryReport,
+    SlowestTestsProfiler,
+    StartupProfile,
+    startup_django_setup,
+    startup_profile_key,
+    startup_step,
+)
+from .scheduling import (
+    DurationHistory,
+    assign_shards,
+    duration_history_key,
+    fit_session_setup,
+    get_history_sort_key,
+    get_selected_durations,
+    get_session_setups,
+    parse_shard,
+    predict_worker_count,
+)
+from .tracing import Tracer, trace_span, tracer_key
 
 
 if TYPE_CHECKING:
     import django
     import django.apps.registry
+    import pluggy
 
 
 SETTINGS_MODULE_ENV = "DJANGO_SETTINGS_MODULE"
@@ -149,6 +195,213 @@ def pytest_addoption(parser: pytest.Parser) -> None:
         default=False,
         help="Fail for invalid variables in templates.",
     )
+    group.addoption(
+        "--update-query-snapshots",
+        action="store_true",
+        dest="update_query_snapshots",
+        default=False,
+        help="Update the snapshot files of the django_query_snapshot fixture.",
+    )
+    group.addoption(
+        "--django-query-timeout",
+        action="store",
+        type=float,
+        dest="django_query_timeout",
+        default=None,
+        metavar="ms",
+        help="Fail tests which execute a single database query taking longer "
+        "than this many milliseconds.",
+    )
+    group.addoption(
+        "--django-sql-comments",
+        action="store_true",
+        dest="django_sql_comments",
+        default=False,
+        help="Append a comment with the test, phase and fixture executing it "
+        "to every database query, in the sqlcommenter format.",
+    )
+    group.addoption(
+        "--django-query-log",
+        action="store",
+        dest="django_query_log",
+        default=None,
+        metavar="path",
+        help="Write a JSON line for each database query to the given file.",
+    )
+    group.addoption(
+        "--django-db-metrics",
+        action="store_true",
+        dest="django_db_metrics",
+        default=False,
+        help="Record the number of database queries, the database time and the "
+        "number of database connections of each test in its user properties, "
+        "e.g. for --junitxml.",
+    )
+    group.addoption(
+        "--django-db-report",
+        action="store_true",
+        dest="django_db_report",
+        default=False,
+        help="Show the number and duration of the tests by kind of database "
+        "access, and the costliest transactional tests.",
+    )
+    group.addoption(
+        "--django-transaction-audit",
+        action="store_true",
+        dest="django_transaction_audit",
+        default=False,
+        help="Report the transactional tests which showed no need for "
+        "transactions, as candidates to be converted to non-transactional tests.",
+    )
+    group.addoption(
+        "--django-unused-db-marks",
+        action="store",
+        dest="django_unused_db_marks",
+        default=None,
+        choices=("report", "fail"),
+        help="Report the tests marked with django_db which executed no "
+        "database queries, or fail them.",
+    )
+    group.addoption(
+        "--django-profile-slowest",
+        action="store",
+        type=int,
+        dest="django_profile_slowest",
+        default=None,
+        metavar="N",
+        help="Profile the call phase of the tests which were the slowest in the "
+        "previous runs and write the profiles of the N slowest ones, summarized in "
+        "the terminal summary.",
+    )
+    group.addoption(
+        "--django-profile-threshold",
+        action="store",
+        type=float,
+        dest="django_profile_threshold",
+        default=0.0,
+        metavar="seconds",
+        help="Only profile the tests which took at least this many seconds in the "
+        "previous runs, and keep their profiles if they take as long again. Default: 0.",
+    )
+    group.addoption(
+        "--django-profile-dir",
+        action="store",
+        dest="django_profile_dir",
+        default="prof",
+        metavar="path",
+        help="The directory the profiles are written to. Default: prof.",
+    )
+    group.addoption(
+        "--django-memory-report",
+        action="store",
+        type=int,
+        dest="django_memory_report",
+        default=None,
+        metavar="N",
+        help="Trace the memory allocations and report the N tests leaving the "
+        "most memory and Django state behind, and the fixtures retaining memory.",
+    )
+    group.addoption(
+        "--django-test-order",
+        action="store",
+        dest="django_test_order",
+        choices=["slowest-first", "failed-first"],
+        default=None,
+        help="Record the durations of the tests in the pytest cache, and order the "
+        "tests by their duration in the previous runs, slowest first, within the "
+        "groups of tests using the database the same way. With failed-first, the "
+        "tests which failed in the last run come first.",
+    )
+    group.addoption(
+        "--django-dist",
+        action="store_true",
+        dest="django_dist",
+        default=False,
+        help="With pytest-xdist, distribute the tests to the workers by their "
+        "duration in the previous runs, recorded in the pytest cache, rather than "
+        "by their number.",
+    )
+    group.addoption(
+        "--django-auto-workers",
+        action="store_true",
+        dest="django_auto_workers",
+        default=False,
+        help="With pytest-xdist and -n auto, choose the number of workers "
+        "predicted to run the selected tests the fastest, from the durations of "
+        "the tests and of the setup of the test databases in the previous runs.",
+    )
+    group.addoption(
+        "--django-shard",
+        action="store",
+        dest="django_shard",
+        default=None,
+        type=parse_shard,
+        metavar="i/N",
+        help="Only run the i-th of N shards of the tests, of about the same "
+        "duration in the previous runs, and add a suffix like _shard1 to the "
+        "names of the test databases.",
+    )
+    group.addoption(
+        "--django-route-databases",
+        action="store_true",
+        dest="django_route_databases",
+        default=False,
+        help="With pytest-xdist and --dist loadgroup, run the tests which use "
+        "databases other than the default one in an xdist group per set of "
+        "databases, so that only the workers running them set these databases up.",
+    )
+    group.addoption(
+        "--django-background-db-setup",
+        action="store_true",
+        dest="django_background_db_setup",
+        default=False,
+        help="Set up the test databases of the previous run in a background thread "
+        "while the tests are collected.",
+    )
+    group.addoption(
+        "--django-lazy-setup",
+        action="store_true",
+        dest="django_lazy_setup",
+        default=False,
+        help="Only load the Django settings and set Django up when a collected test "
+        "or an imported models module needs it.",
+    )
+    group.addoption(
+        "--django-startup-profile",
+        action="store_true",
+        dest="django_startup_profile",
+        default=False,
+        help="Show the time of each step of the initialization of Django, with "
+        "django.setup() broken down by app, in the report header.",
+    )
+    group.addoption(
+        "--django-trace",
+        action="store",
+        dest="django_trace",
+        default=None,
+        metavar="path",
+        help="Write spans of the Django setup, the test databases, the tests and "
+        "the queries to a file in the Chrome trace event format.",
+    )
+    group.addoption(
+        "--django-fixture-report",
+        action="store",
+        type=int,
+        dest="django_fixture_report",
+        default=None,
+        metavar="N",
+        help="Show the N fixtures executing the most database time, with their "
+        "number of queries (N=0 for all).",
+    )
+    group.addoption(
+        "--django-report-rows",
+        action="store",
+        type=int,
+        dest="django_report_rows",
+        default=None,
+        metavar="N",
+        help="Report the database queries returning more than N rows at the end of the session.",
+    )
     parser.addini(
         INVALID_TEMPLATE_VARS_ENV,
         "Fail for invalid variables in templates.",
@@ -234,6 +487,11 @@ def _setup_django(config: pytest.Config) -> None:
     if "django" not in sys.modules:
         return
 
+    # With `--django-lazy-setup`, Django is only set up when a test needs it.
+    deferred_setup = config.stash.get(deferred_setup_key, None)
+    if deferred_setup is not None and deferred_setup.pending:
+        return
+
     import django.conf
 
     # Avoid force-loading Django when settings are not properly configured.
@@ -243,10 +501,15 @@ def _setup_django(config: pytest.Config) -> None:
     import django.apps
 
     if not django.apps.apps.ready:
-        django.setup()
+        with trace_span(config, "django.setup"), startup_django_setup(config):
+            django.setup()
 
     blocking_manager = config.stash[blocking_manager_key]
-    blocking_manager.block()
+    if blocking_manager.is_active:
+        blocking_manager.block()
+    else:
+        with startup_step(config, "DjangoDbBlocker.block()"):
+            blocking_manager.block()
 
 
 def _get_boolean_value(
@@ -269,6 +532,7 @@ def _get_boolean_value(
 
 
 report_header_key = pytest.StashKey[list[str]]()
+deferred_setup_key = pytest.StashKey[DeferredSetup]()
 
 
 @pytest.hookimpl()
@@ -320,9 +584,16 @@ def pytest_load_initial_conftests(
     report_header: list[str] = []
     early_config.stash[report_header_key] = report_header
     early_config.stash[blocking_manager_key] = DjangoDbBlocker(_ispytest=True)
+    if options.django_trace:
+        early_config.stash[tracer_key] = Tracer(
+            pathlib.Path(options.django_trace).expanduser().resolve()
+        )
+    if options.django_startup_profile:
+        early_config.stash[startup_profile_key] = StartupProfile()
 
     try:
-        _initialize_django(early_config, options, args, report_header)
+        with trace_span(early_config, "_initialize_django"):
+            _initialize_django(early_config, options, args, report_header)
     except Exception:
         # `--help`/`--version` never run tests, so they must keep working on a
         # broken configuration (issue #235); a real run still fails loudly.
@@ -346,7 +617,8 @@ def _initialize_django(
     )
 
     if django_find_project:
-        _django_project_scan_outcome = _add_django_project_to_path(args)
+        with startup_step(early_config, "_add_django_project_to_path"):
+            _django_project_scan_outcome = _add_django_project_to_path(args)
     else:
         _django_project_scan_outcome = PROJECT_SCAN_DISABLED
 
@@ -381,20 +653,40 @@ def _initialize_django(
             report_header.append(f"configuration: {dc} (from {dc_source})")
             os.environ[CONFIGURATION_ENV] = dc
 
+    # Also called by the import hook of `--django-lazy-setup`, before the setup.
+    @functools.cache
+    def load_settings() -> None:
+        if dc:
             # Install the django-configurations importer
-            import configurations.importer
+            with startup_step(early_config, "configurations.importer.install()"):
+                import configurations.importer
 
-            configurations.importer.install()
+                configurations.importer.install()
 
         # Forcefully load Django settings, throws ImportError or
         # ImproperlyConfigured if settings cannot be loaded.
         from django.conf import settings as dj_settings
 
-        with _handle_import_error(_django_project_scan_outcome):
+        with (
+            startup_step(early_config, f"import {ds}"),
+            _handle_import_error(_django_project_scan_outcome),
+        ):
             dj_settings.DATABASES  # noqa: B018
 
-    # Populates the app registry, which fails on a broken INSTALLED_APPS.
-    _setup_django(early_config)
+    def setup() -> None:
+        if ds:
+            load_settings()
+
+        # Populates the app registry, which fails on a broken INSTALLED_APPS.
+        _setup_django(early_config)
+
+    if ds and options.django_lazy_setup:
+        report_header.append("setup: lazy")
+        deferred_setup = DeferredSetup(setup, load_settings)
+        early_config.stash[deferred_setup_key] = deferred_setup
+        deferred_setup.install()
+    else:
+        setup()
 
 
 @pytest.hookimpl(trylast=True)
@@ -410,6 +702,159 @@ def pytest_configure(config: pytest.Config) -> None:
     # it's fully initialized here.
     _setup_django(config)
 
+    if config.getoption("django_sql_comments"):
+        # First, so that the other observers see the commented queries.
+        _get_query_instrumentation(config).observers.insert(0, SqlCommenter())
+
+    query_timeout = config.getoption("django_query_timeout")
+    if query_timeout is not None:
+        _get_query_instrumentation(config).observers.append(QueryTimeLimit(query_timeout))
+
+    query_log_path = config.getoption("django_query_log")
+    if query_log_path is not None:
+        instrumentation = _get_query_instrumentation(config)
+        instrumentation.track_rows = True
+        query_log = QueryLog(config, pathlib.Path(query_log_path).expanduser().resolve())
+        instrumentation.observers.append(query_log)
+        config.pluginmanager.register(query_log, "django_query_log")
+
+    if config.getoption("django_db_metrics"):
+        instrumentation = _get_query_instrumentation(config)
+        db_metrics = DbMetrics(instrumentation)
+        instrumentation.observers.append(db_metrics)
+        config.pluginmanager.register(db_metrics, "django_db_metrics")
+
+    if config.getoption("django_db_report"):
+        config.pluginmanager.register(DbUsageReport(), "django_db_usage_report")
+
+    if config.getoption("django_transaction_audit"):
+        config.pluginmanager.register(TransactionAudit(), "django_transaction_audit")
+
+    unused_db_marks = config.getoption("django_unused_db_marks")
+    if unused_db_marks is not None:
+        unused_db_mark_audit = UnusedDbMarkAudit(fail=unused_db_marks == "fail")
+        _get_query_instrumentation(config).observers.append(unused_db_mark_audit)
+        config.pluginmanager.register(unused_db_mark_audit, "django_unused_db_mark_audit")
+
+    fixture_report = config.getoption("django_fixture_report")
+    if fixture_report is not None:
+        fixture_query_report = FixtureQueryReport(fixture_report)
+        _get_query_instrumentation(config).observers.append(fixture_query_report)
+        config.pluginmanager.register(fixture_query_report, "django_fixture_query_report")
+
+    report_rows = config.getoption("django_report_rows")
+    if report_rows is not None:
+        instrumentation = _get_query_instrumentation(config)
+        instrumentation.track_rows = True
+        large_result_report = LargeResultReport(report_rows)
+        instrumentation.observers.append(large_result_report)
+        config.pluginmanager.register(large_result_report, "django_large_result_report")
+
+    if config.getoption("django_background_db_setup"):
+        if getattr(config, "cache", None) is None:
+            raise pytest.UsageError(
+                "--django-background-db-setup requires the cacheprovider plugin."
+            )
+        background_db_setup = BackgroundDatabaseSetup(config, config.stash[blocking_manager_key])
+        config.stash[background_db_setup_key] = background_db_setup
+        config.pluginmanager.register(background_db_setup, "django_background_db_setup")
+
+    _register_schedulers(config)
+    _register_profilers(config)
+
+
+def _register_schedulers(config: pytest.Config) -> None:
+    """Register the plugins recording the history of the tests to schedule
+    and profile them, enabled by command line options."""
+    for option, dest in (
+        ("--django-test-order", "django_test_order"),
+        ("--django-dist", "django_dist"),
+        ("--django-auto-workers", "django_auto_workers"),
+        ("--django-shard", "django_shard"),
+        ("--django-profile-slowest", "django_profile_slowest"),
+    ):
+        if config.getoption(dest) and duration_history_key not in config.stash:
+            if getattr(config, "cache", None) is None:
+                raise pytest.UsageError(f"{option} requires the cacheprovider plugin.")
+            history = DurationHistory(config)
+            config.stash[duration_history_key] = history
+            config.pluginmanager.register(history, "django_duration_history")
+
+    # The workers run with --dist no, the controller checks the option.
+    if config.getoption("django_route_databases") and config.getoption("dist", "no") not in (
+        "no",
+        "loadgroup",
+    ):
+        raise pytest.UsageError("--django-route-databases requires --dist loadgroup.")
+
+
+@pytest.hookimpl(optionalhook=True, tryfirst=True)
+def pytest_xdist_auto_num_workers(config: pytest.Config) -> int | None:
+    # Without the cache, _register_schedulers() reports the error.
+    if not config.getoption("django_auto_workers") or not config.pluginmanager.has_plugin(
+        "cacheprovider"
+    ):
+        return None
+
+    from _pytest.cacheprovider import Cache
+    from xdist.plugin import pytest_xdist_auto_num_workers as get_cpu_count
+
+    # Called before the cache of the config is set up.
+    cache = Cache.for_config(config, _ispytest=True)
+    durations = get_selected_durations(config, cache.get(DurationHistory.cache_key, {}))
+    if not durations:
+        return None
+    session_setup = fit_session_setup(get_session_setups(cache))
+    workers, prediction = predict_worker_count(durations, session_setup, get_cpu_count(config))
+    config.stash[report_header_key].append(f"workers: {workers} (predicted {prediction:.1f}s)")
+    return workers
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_make_scheduler(config: pytest.Config, log: Any) -> Any:
+    if not config.getoption("django_dist") or config.getoption("dist") != "load":
+        return None
+
+    from .xdist_scheduling import CostLoadScheduling
+
+    return CostLoadScheduling(config, log, config.stash.get(duration_history_key, None))
+
+
+def _register_profilers(config: pytest.Config) -> None:
+    """Register the plugins profiling the tests, enabled by command line options."""
+    profile_slowest = config.getoption("django_profile_slowest")
+    if profile_slowest:
+        profiler = SlowestTestsProfiler(
+            profile_slowest,
+            config.getoption("django_profile_threshold"),
+            pathlib.Path(config.getoption("django_profile_dir")).expanduser().resolve(),
+            config.stash[duration_history_key],
+        )
+        config.pluginmanager.register(profiler, "django_slowest_tests_profiler")
+
+    tracer = config.stash.get(tracer_key, None)
+    if tracer is not None:
+        _get_query_instrumentation(config).observers.append(tracer)
+        config.pluginmanager.register(tracer, "django_tracer")
+
+    memory_report = config.getoption("django_memory_report")
+    if memory_report:
+        config.pluginmanager.register(MemoryReport(memory_report), "django_memory_report")
+
+    startup_profile = config.stash.get(startup_profile_key, None)
+    if startup_profile is not None:
+        config.pluginmanager.register(startup_profile, "django_startup_profile")
+
+
+def _get_query_instrumentation(config: pytest.Config) -> QueryInstrumentation:
+    """Get the query instrumentation, enabling it on first use."""
+    if query_instrumentation_key not in config.stash:
+        instrumentation = QueryInstrumentation()
+        config.stash[query_instrumentation_key] = instrumentation
+        config.stash[blocking_manager_key]._instrumentation = instrumentation
+        config.pluginmanager.register(instrumentation, "django_query_instrumentation")
+    return config.stash[query_instrumentation_key]
+
 
 @pytest.hookimpl()
 def pytest_report_header(config: pytest.Config) -> list[str] | None:
@@ -450,6 +895,10 @@ def pytest_collectstart(collector: pytest.Collector) -> None:
 
 # Convert Django test tags on test methods to pytest marks.
 def pytest_itemcollected(item: pytest.Item) -> None:
+    deferred_setup = item.config.stash.get(deferred_setup_key, None)
+    if deferred_setup is not None and deferred_setup.pending and _needs_django(item):
+        deferred_setup.setup()
+
     if "django" not in sys.modules:
         return
 
@@ -469,52 +918,178 @@ def pytest_itemcollected(item: pytest.Item) -> None:
         item.add_marker(tag)
 
 
+# The fixtures of pytest-django which all the tests request through its autouse
+# fixtures, and which do nothing without Django.
+_autouse_fixture_dependencies = ("django_db_blocker", "django_test_environment")
+
+
+def _needs_django(item: pytest.Item) -> bool:
+    """Return whether the test needs Django to be set up, through the marks or
+    fixtures of pytest-django, or as a Django test case."""
+    if any(
+        item.get_closest_marker(name)
+        for name in ("django_db", "urls", "django_isolate_apps", "ignore_template_errors")
+    ):
+        return True
+
+    # A Django test case can only be defined once `django.test` is imported.
+    if "django.test" in sys.modules and is_django_unittest(item):
+        return True
+
+    fixtureinfo = getattr(item, "_fixtureinfo", None)
+    if fixtureinfo is None:
+        return False
+    return any(
+        not name.startswith("_")
+        and name not in _autouse_fixture_dependencies
+        and fixturedefs[-1].func.__module__.startswith(f"{__package__}.")
+        for name, fixturedefs in fixtureinfo.name2fixturedefs.items()
+    )
+
+
 @pytest.hookimpl(tryfirst=True)
-def pytest_collection_modifyitems(items: list[pytest.Item]) -> None:
+def pytest_collection_modifyitems(config: pytest.Config, items: list[pytest.Item]) -> None:
     # If Django is not configured we don't need to bother
-    if not django_settings_is_configured():
-        return
+    if django_settings_is_configured():
+        _reorder_tests(config, items)
+
+    shard = config.getoption("django_shard")
+    if shard is not None:
+        _select_shard(config, items, shard)
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_finish(session: pytest.Session) -> None:
+    # The other plugins and the conftests may add marks to the tests in their
+    # own pytest_collection_modifyitems, so the plans are only stored once all
+    # of them ran.
+    for item in session.items:
+        store_db_plan(item)
 
-    from django.test import TestCase, TransactionTestCase
 
+def _reorder_tests(config: pytest.Config, items: list[pytest.Item]) -> None:
     # Reorder the tests as Django does:
     # https://docs.djangoproject.com/en/6.0/topics/testing/overview/#order-in-which-tests-are-executed
 
     def get_order_number(test: pytest.Item) -> int:
-        test_cls = getattr(test, "cls", None)
-        if test_cls and issubclass(test_cls, TransactionTestCase):
-            # Note, TestCase is a subclass of TransactionTestCase.
-            uses_db = True
-            transactional = not issubclass(test_cls, TestCase)
-        else:
-            marker_db = test.get_closest_marker("django_db")
-            if marker_db:
-                (
-                    transaction,
-                    reset_sequences,
-                    _databases,
-                    _serialized_rollback,
-                    _available_apps,
-                ) = validate_django_db(marker_db)
-                uses_db = True
-                transactional = transaction or reset_sequences
-            else:
-                uses_db = False
-                transactional = False
-            fixtures = getattr(test, "fixturenames", [])
-            transactional = transactional or (
-                "transactional_db" in fixtures or "live_server" in fixtures
-            )
-            uses_db = uses_db or "db" in fixtures
-
-        if transactional:
+        plan = get_db_plan(test)
+        if plan.transactional:
             return 1
-        elif uses_db:
+        elif plan.uses_db:
             return 0
         else:
             return 2
 
-    items.sort(key=get_order_number)
+    # Within each of these, group the tests of a class, or the tests of a
+    # module outside of its classes, with the same database signature, in the
+    # order of their first test, so that consecutive tests share the state of
+    # Django instead of switching it back and forth. The modules and classes
+    # are not split, as their fixtures would be set up again.
+    scopes: dict[tuple[int, str], int] = {}
+    groups: dict[tuple[int, str, tuple[Any, ...]], int] = {}
+
+    def get_sort_key(test: pytest.Item) -> tuple[int, int, int]:
+        order_number = get_order_number(test)
+        scope = test.getparent(pytest.Class) or test.getparent(pytest.Module)
+        scope_id = "" if scope is None else scope.nodeid
+        signature = _get_db_signature(test)
+        return (
+            order_number,
+            scopes.setdefault((order_number, scope_id), len(scopes)),
+            groups.setdefault((order_number, scope_id, signature), len(groups)),
+        )
+
+    test_order = config.getoption("django_test_order")
+    if test_order is None:
+        items.sort(key=get_sort_key)
+    else:
+        # Within each group, order the tests by their history.
+        get_history_key = get_history_sort_key(config, test_order)
+        items.sort(key=lambda test: (*get_sort_key(test), *get_history_key(test)))
+
+    # Before pytest-xdist adds the groups to the node IDs.
+    if _routes_databases(config):
+        for test in items:
+            database_group = _get_database_group(test)
+            if database_group is not None:
+                test.add_marker(pytest.mark.xdist_group(database_group))
+
+
+def _select_shard(config: pytest.Config, items: list[pytest.Item], shard: tuple[int, int]) -> None:
+    """Deselect the tests of the other shards of ``--django-shard``."""
+    index, count = shard
+    # The tests using the same other databases are kept in the same shard, so
+    # that a single shard sets these databases up.
+    if django_settings_is_configured():
+        groups = [_get_database_group(test) for test in items]
+    else:
+        groups = [None] * len(items)
+    shards = assign_shards(
+        [test.nodeid for test in items], groups, count, config.stash[duration_history_key]
+    )
+    selected = [
+        test for test, test_shard in zip(items, shards, strict=True) if test_shard == index - 1
+    ]
+    deselected = [
+        test for test, test_shard in zip(items, shards, strict=True) if test_shard != index - 1
+    ]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+def _get_db_signature(test: pytest.Item) -> tuple[Any, ...]:
+    """Get the settings of a test which determine the state of Django around
+    it: its databases, available apps, sequences reset and serialized
+    rollback, and its URLconf and isolated apps."""
+    from django.db import DEFAULT_DB_ALIAS
+
+    plan = get_db_plan(test)
+    databases = plan.databases
+    if databases is None:
+        databases = (DEFAULT_DB_ALIAS,)
+    elif databases != "__all__":
+        databases = tuple(sorted(databases))
+
+    def get_marker_value(name: str, validate: Callable[[pytest.Mark], Any]) -> Any:
+        marker = test.get_closest_marker(name)
+        if marker is None:
+            return None
+        try:
+            value = validate(marker)
+        except (TypeError, ValueError):
+            # Reported when the test runs.
+            return None
+        return value if isinstance(value, str) else tuple(value)
+
+    return (
+        databases,
+        None if plan.available_apps is None else tuple(plan.available_apps),
+        bool(plan.reset_sequences),
+        bool(plan.serialized_rollback),
+        get_marker_value("urls", validate_urls),
+        get_marker_value("django_isolate_apps", validate_django_isolate_apps),
+    )
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(
+    item: pytest.Item, call: pytest.CallInfo[None]
+) -> Generator[None, pluggy.Result[pytest.TestReport]]:
+    outcome = yield
+    # The query snapshots created while the test is set up are reported with
+    # its call.
+    notices = item.stash.get(query_snapshot_notices_key, None)
+    if not notices or call.when == "setup":
+        return
+    report = outcome.get_result()
+    text = "\n\n".join(notices)
+    notices.clear()
+    if report.passed:
+        report.outcome = "failed"
+        report.longrepr = text
+    else:
+        report.sections.append(("Query snapshots", text))
 
 
 def pytest_unconfigure(config: pytest.Config) -> None:
@@ -526,6 +1101,10 @@ def pytest_unconfigure(config: pytest.Config) -> None:
         while blocking_manager.is_active:
             blocking_manager.restore()
 
+    deferred_setup = config.stash.get(deferred_setup_key, None)
+    if deferred_setup is not None:
+        deferred_setup.uninstall()
+
 
 @pytest.fixture(autouse=True, scope="session")
 def django_test_environment(request: pytest.FixtureRequest) -> Generator[None]:
@@ -590,6 +1169,10 @@ def _django_db_marker(request: pytest.FixtureRequest) -> None:
     """Implement the django_db marker, internal to pytest-django."""
     marker = request.node.get_closest_marker("django_db")
     if marker:
+        if not get_db_plan(request.node).marked:
+            # The mark was added after the collection, e.g. with
+            # request.applymarker().
+            store_db_plan(request.node)
         request.getfixturevalue("_django_db_helper")
 
 
@@ -623,6 +1206,12 @@ def _django_setup_unittest(
         # The `databases` propery seems like the best indicator for that.
         if request.cls.databases:
             request.getfixturevalue("django_db_setup")
+            routed_databases = request.config.stash.get(routed_databases_key, None)
+            if routed_databases is not None:
+                from django.db import connections
+
+                databases = request.cls.databases
+                routed_databases.setup(connections if databases == "__all__" else databases)
             db_unblock = django_db_blocker.unblock()
         else:
             db_unblock = contextlib.nullcontext()
@@ -888,6 +1477,18 @@ class DjangoDbBlocker:
 
         self._history = []  # type: ignore[var-annotated]
         self._real_ensure_connection = None
+        self._instrumentation: QueryInstrumentation | None = None
+        # The threads which are not blocked, see _unblock_thread().
+        self._unblocked_threads: set[int] = set()
+
+        def blocking_wrapper(connection: Any, *args: Any, **kwargs: Any) -> Any:
+            if threading.get_ident() in self._unblocked_threads:
+                return self._real_ensure_connection(connection, *args, **kwargs)  # type: ignore[misc]
+            __tracebackhide__ = True
+            return self._blocking_wrapper()
+
+        # Bound to the database connections, unlike _blocking_wrapper().
+        self._blocking_ensure_connection = blocking_wrapper
 
     @property
     def _dj_db_wrapper(self) -> django.db.backends.base.base.BaseDatabaseWrapper:
@@ -915,14 +1516,30 @@ class DjangoDbBlocker:
         """Enable access to the Django database."""
         self._save_active_wrapper()
         self._dj_db_wrapper.ensure_connection = self._real_ensure_connection
+        if self._instrumentation is not None:
+            self._instrumentation.install()
         return _DatabaseBlockerContextManager(self)
 
     def block(self) -> AbstractContextManager[None]:
         """Disable access to the Django database."""
         self._save_active_wrapper()
-        self._dj_db_wrapper.ensure_connection = self._blocking_wrapper
+        self._dj_db_wrapper.ensure_connection = self._blocking_ensure_connection
         return _DatabaseBlockerContextManager(self)
 
+    @contextlib.contextmanager
+    def _unblock_thread(self) -> Generator[None]:
+        """Enable access to the Django database in the current thread, even
+        while it is blocked, e.g. to set up the test databases in the
+        background."""
+        # Saves the real implementation.
+        self._dj_db_wrapper  # noqa: B018
+        thread = threading.get_ident()
+        self._unblocked_threads.add(thread)
+        try:
+            yield
+        finally:
+            self._unblocked_threads.discard(thread)
+
     def restore(self) -> None:
         """Undo a previous call to block() or unblock().
 
@@ -939,6 +1556,7 @@ class DjangoDbBlocker:
 
 # On Config.stash.
 blocking_manager_key = pytest.StashKey[DjangoDbBlocker]()
+query_instrumentation_key = pytest.StashKey[QueryInstrumentation]()
 
 
 def validate_urls(marker: pytest.Mark) -> list[str]:
@@ -0,0 +1,516 @@
+"""Profiling of the time and memory used by the tests and the initialization
+of Django."""
+
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import gc
+import heapq
+import pstats
+import re
+import time
+import tracemalloc
+from collections.abc import Callable, Generator, Iterator
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import pytest
+
+from .instrumentation import SessionReport, wrap_method
+from .lazy_django import django_settings_is_configured
+from .scheduling import DurationHistory
+
+
+if TYPE_CHECKING:
+    import pluggy
+
+
+# The parts of Django whose top frames are summarized, by the paths of their
+# modules.
+FRAME_CATEGORIES = {
+    "ORM": ("/django/db/",),
+    "templates": ("/django/template/", "/django/templatetags/"),
+    "middleware": ("/django/middleware/", "middleware.py"),
+}
+
+
+def _frame_category(filename: str) -> str | None:
+    filename = filename.replace("\\", "/")
+    for category, patterns in FRAME_CATEGORIES.items():
+        if any(pattern in filename for pattern in patterns):
+            return category
+    return None
+
+
+def summarize_profile(
+    profile: cProfile.Profile, count: int = 3
+) -> dict[str, list[tuple[str, float]]]:
+    """Get the ``count`` functions with the highest cumulative time of each
+    category of :data:`FRAME_CATEGORIES` in the profile."""
+    frames: dict[str, list[tuple[str, float]]] = {category: [] for category in FRAME_CATEGORIES}
+    stats: dict[tuple[str, int, str], Any] = pstats.Stats(profile).stats  # type: ignore[attr-defined]
+    for (filename, lineno, funcname), (_, _, _, cumulative, _) in stats.items():
+        category = _frame_category(filename)
+        if category is not None:
+            # Shorten the paths of Django's modules.
+            index = filename.replace("\\", "/").rfind("/django/")
+            path = filename[index + 1 :] if index != -1 else filename
+            frames[category].append((f"{funcname} ({path}:{lineno})", cumulative))
+    return {
+        category: heapq.nlargest(count, category_frames, key=lambda frame: frame[1])
+        for category, category_frames in frames.items()
+    }
+
+
+class SlowestTestsProfiler:
+    """Profiles the call phase of the tests which were the slowest in the
+    previous runs, keeps the profiles of the ``--django-profile-slowest``
+    slowest ones taking at least ``--django-profile-threshold`` seconds, and
+    summarizes them in the terminal summary.
+
+    The other tests run without the overhead of the profiler, and their
+    durations are recorded by the :class:`DurationHistory`, so the tests
+    which never ran are only profiled in the next run. The durations of the
+    profiled tests are not recorded, as the profiler slows them down.
+
+    With pytest-xdist, each worker writes the profiles of its own slowest
+    tests, and sends the summaries of the candidates to the controller along
+    with their reports. The controller removes the profiles of the tests which
+    are not among the slowest of the session.
+    """
+
+    report_attr = "django_profile"
+
+    #: The number of tests profiled for each profile kept, as the durations
+    #: of the tests vary between runs.
+    candidates_per_profile = 2
+
+    def __init__(
+        self, count: int, threshold: float, directory: Path, history: DurationHistory
+    ) -> None:
+        self.count = count
+        self.threshold = threshold
+        self.directory = directory
+        self.history = history
+        # The node IDs of the tests to profile.
+        self._candidates: set[str] = set()
+        # The slowest tests of this process, as (duration, nodeid, profile).
+        self._profiles: list[tuple[float, str, cProfile.Profile]] = []
+        # The summaries of the slowest tests of the session, as
+        # (duration, nodeid, frames).
+        self.summaries: list[tuple[float, str, dict[str, Any]]] = []
+        self._summary: dict[str, Any] | None = None
+        # Whether the current test was profiled.
+        self._profiled = False
+        # The tests which were pushed out of the summaries.
+        self._evicted: set[str] = set()
+
+    def get_path(self, nodeid: str) -> Path:
+        """Get the path of the profile of a test."""
+        return self.directory / (re.sub(r"[^\w.-]+", "_", nodeid).strip("_") + ".pstats")
+
+    def pytest_collection_finish(self, session: pytest.Session) -> None:
+        durations = []
+        for item in session.items:
+            duration = self.history.get_expected_duration(item.nodeid)
+            if duration is not None and duration >= self.threshold:
+                durations.append((duration, item.nodeid))
+        self._candidates = {
+            nodeid
+            for _, nodeid in heapq.nlargest(self.count * self.candidates_per_profile, durations)
+        }
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item: pytest.Item) -> Generator[None]:
+        if item.nodeid not in self._candidates:
+            yield
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active.
+            yield
+            return
+        self._profiled = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            profile.disable()
+        duration = time.perf_counter() - start
+        if duration < self.threshold:
+            return
+        if len(self._profiles) == self.count:
+            if duration <= self._profiles[0][0]:
+                return
+            heapq.heapreplace(self._profiles, (duration, item.nodeid, profile))
+        else:
+            heapq.heappush(self._profiles, (duration, item.nodeid, profile))
+        self._summary = {
+            "nodeid": item.nodeid,
+            "duration": duration,
+            "frames": summarize_profile(profile),
+        }
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(
+        self, call: pytest.CallInfo[None]
+    ) -> Generator[None, pluggy.Result[pytest.TestReport]]:
+        outcome = yield
+        if call.when != "call":
+            return
+        if self._profiled:
+            setattr(outcome.get_result(), DurationHistory.skip_attr, True)
+            self._profiled = False
+        if self._summary is not None:
+            setattr(outcome.get_result(), self.report_attr, self._summary)
+            self._summary = None
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        summary = getattr(report, self.report_attr, None)
+        if summary is None:
+            return
+        item = (summary["duration"], summary["nodeid"], summary["frames"])
+        if len(self.summaries) == self.count:
+            self._evicted.add(heapq.heappushpop(self.summaries, item)[1])
+        else:
+            heapq.heappush(self.summaries, item)
+
+    def pytest_sessionfinish(self) -> None:
+        if self._profiles:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for _, nodeid, profile in self._profiles:
+                profile.dump_stats(self.get_path(nodeid))
+        # With pytest-xdist, the workers have finished by now.
+        for nodeid in self._evicted - {nodeid for _, nodeid, _ in self.summaries}:
+            self.get_path(nodeid).unlink(missing_ok=True)
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        terminalreporter.write_sep("=", f"profiles of the slowest {self.count} tests")
+        if not self.summaries:
+            terminalreporter.write_line(
+                f"No test took at least {self.threshold:g}s in this run and the previous "
+                "ones, no profiles were written."
+            )
+            return
+        for duration, nodeid, frames in sorted(self.summaries, reverse=True):
+            terminalreporter.write_line(f"{duration:.2f}s {nodeid}")
+            terminalreporter.write_line(f"  profile: {self.get_path(nodeid)}")
+            for category, category_frames in frames.items():
+                if not category_frames:
+                    continue
+                terminalreporter.write_line(f"  {category}:")
+                for frame, cumulative in category_frames:
+                    terminalreporter.write_line(f"    {cumulative:8.3f}s {frame}")
+
+
+def get_django_state_sizes() -> dict[str, int]:
+    """Get the sizes of Django's process-wide caches and registries, which
+    grow when tests leave state behind."""
+    if not django_settings_is_configured():
+        return {}
+
+    from django.apps import apps
+    from django.core import mail
+    from django.db import connections
+    from django.template import engines
+    from django.urls import resolvers
+
+    sizes = {
+        "queries_log": sum(
+            len(connection.queries_log) for connection in connections.all(initialized_only=True)
+        ),
+        "mail.outbox": len(getattr(mail, "outbox", ())),
+        "URL resolvers": (
+            resolvers._get_cached_resolver.cache_info().currsize
+            + resolvers.get_ns_resolver.cache_info().currsize
+        ),
+        "apps models": sum(len(models) for models in apps.all_models.values()),
+    }
+    if apps.is_installed("django.contrib.contenttypes"):
+        from django.contrib.contenttypes.models import ContentType
+
+        sizes["ContentType cache"] = sum(
+            len(cache) for cache in ContentType.objects._cache.values()
+        )
+    # Only look at the template engines and loaders which were already used,
+    # rather than creating them.
+    templates = 0
+    for backend in engines._engines.values():
+        engine = getattr(backend, "engine", None)
+        if engine is not None and "template_loaders" in engine.__dict__:
+            for loader in engine.template_loaders:
+                templates += len(getattr(loader, "get_template_cache", ()))
+    sizes["template cache"] = templates
+    return sizes
+
+
+def format_size(size: float) -> str:
+    """Format a number of bytes."""
+    if abs(size) < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KiB", "MiB"):
+        size /= 1024
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} GiB"
+
+
+class MemoryReport(SessionReport):
+    """Reports the tests and fixtures which leave memory behind, using
+    :mod:`tracemalloc`, along with the growth of Django's caches, in the
+    terminal summary.
+
+    The memory left behind by a test is the difference between the traced
+    memory after its teardown and after the teardown of the previous test,
+    ignoring the allocations of pytest itself. The memory retained by the
+    fixtures of a wider scope than the function is attributed to the fixtures
+    rather than to the test setting them up.
+    """
+
+    report_attr = "django_memory"
+
+    #: The number of allocation sites shown for each test.
+    max_sites = 3
+
+    _ignored_files = (
+        tracemalloc.__file__,
+        "*/_pytest/*",
+        "*/pluggy/*",
+        "*/xdist/*",
+        "*/execnet/*",
+        "*/pytest_django/instrumentation.py",
+        "*/pytest_django/profiling.py",
+    )
+
+    def __init__(self, count: int) -> None:
+        #: The number of tests shown.
+        self.count = count
+        self._started = False
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._state: dict[str, int] = {}
+        self._nodeid = ""
+        # The memory retained by the fixtures set up during the current test.
+        self._fixtures: dict[str, int] = {}
+        # The tests leaving the most memory behind, as (size, nodeid, data).
+        self.tests: list[tuple[int, str, dict[str, Any]]] = []
+        # The memory retained by the fixtures, by fixture name.
+        self.fixtures: dict[str, int] = {}
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        gc.collect()
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, pattern) for pattern in self._ignored_files]
+        )
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self) -> None:
+        # Start after the collection, so that importing the test modules
+        # is not attributed to the first test.
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started = True
+        self._snapshot = self._take_snapshot()
+        self._state = get_django_state_sizes()
+
+    def pytest_runtest_setup(self, item: pytest.Item) -> None:
+        self._nodeid = item.nodeid
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef: pytest.FixtureDef[Any]) -> Generator[None]:
+        if fixturedef.scope == "function" or not tracemalloc.is_tracing():
+            yield
+            return
+        before = tracemalloc.get_traced_memory()[0]
+        yield
+        size = tracemalloc.get_traced_memory()[0] - before
+        self._fixtures[fixturedef.argname] = self._fixtures.get(fixturedef.argname, 0) + size
+
+    def pop_test_data(self) -> dict[str, Any] | None:
+        if self._snapshot is None:
+            return None
+        snapshot = self._take_snapshot()
+        stats = snapshot.compare_to(self._snapshot, "lineno")
+        self._snapshot = snapshot
+        state = get_django_state_sizes()
+        caches = {
+            name: size - self._state.get(name, 0)
+            for name, size in state.items()
+            if size != self._state.get(name, 0)
+        }
+        self._state = state
+        fixtures = self._fixtures
+        self._fixtures = {}
+        growth = sum(stat.size_diff for stat in stats)
+        return {
+            "nodeid": self._nodeid,
+            "size": growth - sum(size for size in fixtures.values() if size > 0),
+            "sites": [
+                (f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", stat.size_diff)
+                for stat in stats[: self.max_sites]
+                if stat.size_diff > 0
+            ],
+            "caches": caches,
+            "fixtures": fixtures,
+        }
+
+    def add_test_data(self, data: dict[str, Any]) -> None:
+        for argname, size in data["fixtures"].items():
+            self.fixtures[argname] = self.fixtures.get(argname, 0) + size
+        if data["size"] <= 0 and not any(size > 0 for size in data["caches"].values()):
+            return
+        item = (data["size"], data["nodeid"], data)
+        if len(self.tests) == self.count:
+            heapq.heappushpop(self.tests, item)
+        else:
+            heapq.heappush(self.tests, item)
+
+    def pytest_sessionfinish(self) -> None:
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        terminalreporter.write_sep("=", f"memory left behind by the {self.count} largest tests")
+        if not self.tests:
+            terminalreporter.write_line("No test left memory or Django state behind.")
+        for size, nodeid, data in sorted(self.tests, reverse=True):
+            terminalreporter.write_line(f"{format_size(size):>10} {nodeid}")
+            for site, site_size in data["sites"]:
+                terminalreporter.write_line(f"    {format_size(site_size):>10} {site}")
+            if data["caches"]:
+                caches = ", ".join(f"{name} {delta:+d}" for name, delta in data["caches"].items())
+                terminalreporter.write_line(f"    Django state: {caches}")
+        fixtures = sorted(
+            ((size, argname) for argname, size in self.fixtures.items() if size > 0),
+            reverse=True,
+        )
+        if fixtures:
+            terminalreporter.write_line("Memory retained by the fixtures of a wider scope:")
+            for size, argname in fixtures[: self.count]:
+                terminalreporter.write_line(f"{format_size(size):>10} {argname}")
+
+
+class StartupStep:
+    """A step of the initialization of Django, with the steps it consists of."""
+
+    __slots__ = ("duration", "name", "steps")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.duration = 0.0
+        self.steps: list[StartupStep] = []
+
+
+class StartupProfile:
+    """Times the steps of the initialization of Django by pytest-django: adding
+    the project to the path, installing the django-configurations importer,
+    importing the settings, ``django.setup()`` and blocking the database
+    access.
+
+    ``django.setup()`` is broken down by app, into the import of the app, of
+    its models and its ``ready()`` method, the slowest first. The steps are
+    shown in the report header, and those not shown there, e.g. when Django is
+    set up lazily after it, in the terminal summary.
+    """
+
+    def __init__(self) -> None:
+        self.steps: list[StartupStep] = []
+        self._stack: list[StartupStep] = []
+        # The number of steps shown in the report header.
+        self._reported = 0
+
+    @contextlib.contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """Time the block as a step, within the current one if any."""
+        step = StartupStep(name)
+        (self._stack[-1].steps if self._stack else self.steps).append(step)
+        self._stack.append(step)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            step.duration = time.perf_counter() - start
+            self._stack.pop()
+
+    @contextlib.contextmanager
+    def django_setup(self) -> Iterator[None]:
+        """Time ``django.setup()``, called in the block, by app."""
+        from django.apps import AppConfig
+
+        app_configs: list[Any] = []
+
+        def create(func: Callable[..., Any], cls: type, entry: str) -> Any:
+            with self.step(f"import {entry}"):
+                app_config = func(cls, entry)
+            # The methods may be overridden by each app.
+            app_config.import_models = self._timed(
+                app_config.import_models, f"import {app_config.name}.models"
+            )
+            app_config.ready = self._timed(app_config.ready, f"ready() of {app_config.name}")
+            app_configs.append(app_config)
+            return app_config
+
+        restore = wrap_method(AppConfig, "create", create)
+        try:
+            with self.step("django.setup()"):
+                yield
+        finally:
+            restore()
+            for app_config in app_configs:
+                del app_config.import_models
+                del app_config.ready
+
+    def _timed(self, func: Callable[[], None], name: str) -> Callable[[], None]:
+        def timed() -> None:
+            with self.step(name):
+                func()
+
+        return timed
+
+    def _format_steps(self, steps: list[StartupStep], depth: int = 1) -> list[str]:
+        lines = []
+        for step in steps:
+            lines.append(f"{'  ' * depth}{step.name}: {step.duration:.3f}s")
+            lines.extend(
+                self._format_steps(
+                    sorted(step.steps, key=lambda step: step.duration, reverse=True), depth + 1
+                )
+            )
+        return lines
+
+    def pytest_report_header(self) -> list[str]:
+        self._reported = len(self.steps)
+        total = sum(step.duration for step in self.steps)
+        return [f"django startup: {total:.3f}s", *self._format_steps(self.steps)]
+
+    def pytest_terminal_summary(self, terminalreporter: pytest.TerminalReporter) -> None:
+        steps = self.steps[self._reported :]
+        if not steps:
+            return
+        terminalreporter.write_sep("=", "Django startup profile")
+        for line in self._format_steps(steps, depth=0):
+            terminalreporter.write_line(line)
+
+
+startup_profile_key = pytest.StashKey[StartupProfile]()
+
+
+def startup_step(config: pytest.Config, name: str) -> contextlib.AbstractContextManager[None]:
+    """Time the block as a step of the initialization of Django when
+    ``--django-startup-profile`` is used."""
+    profile = config.stash.get(startup_profile_key, None)
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.step(name)
+
+
+def startup_django_setup(config: pytest.Config) -> contextlib.AbstractContextManager[None]:
+    """Time ``django.setup()``, called in the block, by app when
+    ``--django-startup-profile`` is used."""
+    profile = config.stash.get(startup_profile_key, None)
+    if profile is None:
+        return contextlib.nullcontext()
+    return profile.django_setup()
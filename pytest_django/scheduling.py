@@ -0,0 +1,316 @@
+"""Scheduling of the tests using their history, recorded in the pytest cache."""
+
+from __future__ import annotations
+
+import argparse
+import time
+from collections.abc import Callable, Generator, Sequence
+from typing import TYPE_CHECKING, Any
+
+import pytest
+
+
+if TYPE_CHECKING:
+    import pluggy
+
+
+class DurationHistory:
+    """Records the durations of the tests in the pytest cache, to order them
+    by their expected duration in later runs.
+
+    The durations of the tests which did not run are kept, so that running a
+    subset of the tests does not forget the others. The setup of the fixtures
+    of a wider scope than the function, e.g. of the test databases, is not
+    counted in the duration of the test which happens to set them up.
+    """
+
+    report_attr = "django_shared_setup"
+
+    #: The attribute set on the reports of the tests whose duration is not to
+    #: be recorded, e.g. as they were profiled.
+    skip_attr = "django_skip_duration"
+
+    cache_key = "django/durations"
+
+    #: The cache key of the time spent by a process setting up the session
+    #: fixtures, e.g. the test databases, by number of processes setting them
+    #: up at the same time.
+    setup_cache_key = "django/session_setup"
+
+    def __init__(self, config: pytest.Config) -> None:
+        assert config.cache is not None
+        self.config = config
+        #: The durations of the previous runs, by node ID.
+        self.durations: dict[str, float] = config.cache.get(self.cache_key, {})
+        # The durations of this run, and the tests whose duration is not
+        # recorded.
+        self._durations: dict[str, float] = {}
+        self._skipped: set[str] = set()
+        # The time spent setting up the fixtures of a wider scope than the
+        # function in the current test.
+        self._shared_setup = 0.0
+        self._depth = 0
+        # The time spent setting up the session fixtures by this process, and
+        # by the workers with pytest-xdist.
+        self._session_setup = 0.0
+        self._worker_session_setups: list[float] = []
+
+    def get_expected_duration(self, nodeid: str) -> float | None:
+        """Get the duration of the test in the previous runs, if it ran."""
+        return self.durations.get(nodeid)
+
+    def get_default_duration(self) -> float:
+        """Get the duration expected of the tests which never ran: the mean
+        duration of the others."""
+        if not self.durations:
+            return 0.0
+        return sum(self.durations.values()) / len(self.durations)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef: pytest.FixtureDef[Any]) -> Generator[None]:
+        if fixturedef.scope == "function":
+            yield
+            return
+        # The fixture may request others dynamically.
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if not self._depth:
+                duration = time.perf_counter() - start
+                self._shared_setup += duration
+                if fixturedef.scope == "session":
+                    self._session_setup += duration
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(
+        self, call: pytest.CallInfo[None]
+    ) -> Generator[None, pluggy.Result[pytest.TestReport]]:
+        outcome = yield
+        if call.when == "setup":
+            setattr(outcome.get_result(), self.report_attr, self._shared_setup)
+            self._shared_setup = 0.0
+
+    def pytest_runtest_logreport(self, report: pytest.TestReport) -> None:
+        if getattr(report, self.skip_attr, False):
+            self._skipped.add(report.nodeid)
+        duration = max(report.duration - getattr(report, self.report_attr, 0.0), 0.0)
+        self._durations[report.nodeid] = self._durations.get(report.nodeid, 0.0) + duration
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node: Any) -> None:
+        # Not set if the worker crashed.
+        session_setup = getattr(node, "workeroutput", {}).get("django_session_setup")
+        if session_setup is not None:
+            self._worker_session_setups.append(session_setup)
+
+    def pytest_sessionfinish(self, session: pytest.Session) -> None:
+        # With pytest-xdist, the controller records the durations of all the
+        # workers.
+        workeroutput = getattr(session.config, "workeroutput", None)
+        if workeroutput is not None:
+            workeroutput["django_session_setup"] = self._session_setup
+            return
+        assert session.config.cache is not None
+        recorded = {
+            nodeid: duration
+            for nodeid, duration in self._durations.items()
+            if nodeid not in self._skipped
+        }
+        if recorded:
+            durations = {**self.durations, **recorded}
+            session.config.cache.set(
+                self.cache_key,
+                {nodeid: round(duration, 6) for nodeid, duration in durations.items()},
+            )
+        # The runs which set up nothing, e.g. without database tests, keep the
+        # time of the previous ones.
+        session_setup = max([self._session_setup, *self._worker_session_setups])
+        if session_setup:
+            workers = len(self._worker_session_setups) or 1
+            session_setups = get_session_setups(session.config.cache)
+            session_setups[workers] = round(session_setup, 6)
+            session.config.cache.set(
+                self.setup_cache_key,
+                {str(workers): duration for workers, duration in sorted(session_setups.items())},
+            )
+
+
+duration_history_key = pytest.StashKey[DurationHistory]()
+
+
+def get_history_sort_key(
+    config: pytest.Config, order: str
+) -> Callable[[pytest.Item], tuple[bool, float]]:
+    """Get the function giving the key to order the tests within their
+    database groups, for the ``--django-test-order`` option: the slowest
+    tests first, after the tests which failed in the last run for
+    ``failed-first``."""
+    history = config.stash[duration_history_key]
+    default_duration = history.get_default_duration()
+    lastfailed: dict[str, bool] = {}
+    if order == "failed-first":
+        assert config.cache is not None
+        lastfailed = config.cache.get("cache/lastfailed", {})
+
+    def get_sort_key(item: pytest.Item) -> tuple[bool, float]:
+        duration = history.get_expected_duration(item.nodeid)
+        if duration is None:
+            duration = default_duration
+        return item.nodeid not in lastfailed, -duration
+
+    return get_sort_key
+
+
+def get_session_setups(cache: pytest.Cache) -> dict[int, float]:
+    """Get the recorded times spent setting up the session fixtures, by number
+    of processes setting them up at the same time."""
+    session_setups = cache.get(DurationHistory.setup_cache_key, {})
+    # Recorded as a single time by older versions.
+    if not isinstance(session_setups, dict):
+        return {}
+    return {int(workers): duration for workers, duration in session_setups.items()}
+
+
+def fit_session_setup(session_setups: dict[int, float]) -> tuple[float, float]:
+    """Fit the time a worker spends setting up the session fixtures, e.g. the
+    test databases, to ``base + contention * (workers - 1)``, as the workers
+    set them up at the same time, e.g. on the same database server.
+
+    Get ``(base, contention)``. The contention is fitted by least squares, and
+    is 0 until the times of different numbers of workers are recorded.
+    """
+    if not session_setups:
+        return 0.0, 0.0
+    count = len(session_setups)
+    mean_workers = sum(session_setups) / count
+    mean_duration = sum(session_setups.values()) / count
+    variance = sum((workers - mean_workers) ** 2 for workers in session_setups)
+    contention = 0.0
+    if variance:
+        contention = max(
+            sum(
+                (workers - mean_workers) * (duration - mean_duration)
+                for workers, duration in session_setups.items()
+            )
+            / variance,
+            0.0,
+        )
+    return mean_duration - contention * (mean_workers - 1), contention
+
+
+def predict_wall_time(
+    durations: Sequence[float], session_setup: tuple[float, float], workers: int
+) -> float:
+    """Predict the wall time of running tests of the given durations on the
+    given number of workers, which each set up the session fixtures first,
+    taking the time fitted by :func:`fit_session_setup`."""
+    base, contention = session_setup
+    setup = max(base + contention * (workers - 1), 0.0)
+    return setup + max(sum(durations) / workers, max(durations, default=0.0))
+
+
+def predict_worker_count(
+    durations: Sequence[float], session_setup: tuple[float, float], max_workers: int
+) -> tuple[int, float]:
+    """Get the number of workers predicted to run tests of the given durations
+    the fastest, the smallest one in case of a tie, with its predicted wall
+    time.
+
+    As the workers set up the session fixtures at the same time, each one
+    slows the setup of the others down, so that beyond some number of
+    workers, another one is predicted to make the run slower.
+    """
+    return min(
+        (
+            (workers, predict_wall_time(durations, session_setup, workers))
+            for workers in range(1, max_workers + 1)
+        ),
+        key=lambda prediction: prediction[1],
+    )
+
+
+def get_selected_durations(config: pytest.Config, durations: dict[str, float]) -> list[float]:
+    """Get the recorded durations of the tests selected by the command line
+    arguments, before they are collected.
+
+    Only the paths and node IDs are taken into account, not e.g. ``-k``.
+    """
+    prefixes = []
+    for arg in config.args:
+        path, sep, rest = arg.partition("::")
+        try:
+            relative_path = (
+                (config.invocation_params.dir / path).resolve().relative_to(config.rootpath)
+            )
+        except ValueError:
+            # Outside of the root directory, the node IDs are not relative to it.
+            return list(durations.values())
+        prefix = relative_path.as_posix()
+        if prefix == ".":
+            return list(durations.values())
+        prefixes.append(prefix + sep + rest)
+
+    return [
+        duration
+        for nodeid, duration in durations.items()
+        if any(
+            nodeid == prefix or nodeid.startswith((f"{prefix}/", f"{prefix}::", f"{prefix}["))
+            for prefix in prefixes
+        )
+    ]
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    """Parse the ``i/N`` value of ``--django-shard``."""
+    index, sep, count = value.partition("/")
+    try:
+        shard = int(index), int(count)
+    except ValueError:
+        shard = 0, 0
+    if not sep or not 1 <= shard[0] <= shard[1]:
+        raise argparse.ArgumentTypeError(
+            f"expected the shard as i/N, with 1 <= i <= N, got {value!r}"
+        )
+    return shard
+
+
+def assign_shards(
+    nodeids: Sequence[str],
+    groups: Sequence[str | None],
+    count: int,
+    history: DurationHistory,
+) -> list[int]:
+    """Assign the tests to ``count`` shards of about the same expected
+    duration, and get the shard of each test, from 0.
+
+    The tests of the same group are assigned to the same shard. The assignment
+    only depends on the tests, in their order, and their recorded durations, so
+    the shards run on different machines with the same durations select
+    disjoint sets of the tests.
+    """
+    default_duration = history.get_default_duration() or 1.0
+    units: dict[str | int, list[int]] = {}
+    for index, group in enumerate(groups):
+        units.setdefault(index if group is None else group, []).append(index)
+
+    def get_duration(index: int) -> float:
+        duration = history.get_expected_duration(nodeids[index])
+        return default_duration if duration is None else duration
+
+    # The longest units first, each to the shard with the shortest duration.
+    # The sort is stable, so the ties are in the order of the tests.
+    unit_durations = [
+        (sum(get_duration(index) for index in unit), unit) for unit in units.values()
+    ]
+    unit_durations.sort(key=lambda unit_duration: -unit_duration[0])
+    shards = [0] * len(nodeids)
+    shard_durations = [0.0] * count
+    for duration, unit in unit_durations:
+        shard = shard_durations.index(min(shard_durations))
+        shard_durations[shard] += duration
+        for index in unit:
+            shards[index] = shard
+    return shards
@@ -0,0 +1,198 @@
+"""Tracing of the pytest-django lifecycle as spans, exported by
+``--django-trace`` to a file in the Chrome trace event format, which can be
+opened in Perfetto or ``chrome://tracing``.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections.abc import Callable, Generator, Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from .instrumentation import Query, QueryObserver, WorkerFiles, normalize_sql, wrap_method
+from .lazy_django import django_settings_is_configured
+
+
+class Tracer(WorkerFiles, QueryObserver):
+    """Records spans of Django's initialization, the setup of the test
+    databases, the tests with their phases and fixtures, the
+    ``_pre_setup``/``_post_teardown`` of the Django test cases, the start of
+    the live server and the queries.
+
+    With pytest-xdist, each worker writes its own file, whose events the
+    controller merges into its file at the end of the session, so that the
+    workers appear as separate processes of the timeline.
+    """
+
+    workeroutput_key = "django_trace"
+
+    #: The length of the SQL statements naming the query spans.
+    max_name_length = 80
+
+    def __init__(self, path: Path) -> None:
+        super().__init__()
+        self.path = path
+        self.events: list[dict[str, Any]] = []
+        self._pid = os.getpid()
+        self._threads: dict[int, str] = {}
+        self._restore: list[Callable[[], None]] = []
+
+    def _tid(self) -> int:
+        tid = threading.get_native_id()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        return tid
+
+    def add_span(
+        self, name: str, category: str, start: int, duration: int, args: dict[str, Any]
+    ) -> None:
+        """Add a span, with its start and duration in nanoseconds of
+        :func:`time.monotonic_ns`."""
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start / 1000,
+            "dur": duration / 1000,
+            "pid": self._pid,
+            "tid": self._tid(),
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[None]:
+        """Record the duration of the block as a span."""
+        start = time.monotonic_ns()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start, time.monotonic_ns() - start, args)
+
+    def after_query(self, query: Query) -> None:
+        duration = int(query.duration * 1e9)
+        sql = normalize_sql(query.sql)
+        args = {"sql": query.sql, "alias": query.alias}
+        if query.fixture is not None:
+            args["fixture"] = query.fixture
+        if query.error is not None:
+            args["error"] = repr(query.error)
+        self.add_span(
+            sql[: self.max_name_length], "query", time.monotonic_ns() - duration, duration, args
+        )
+
+    def _traced(self, category: str) -> Callable[..., Any]:
+        def wrapper(func: Callable[..., Any], obj: Any, *args: Any, **kwargs: Any) -> Any:
+            # `obj` is either a test case or a database creation.
+            connection = getattr(obj, "connection", None)
+            span_args = {} if connection is None else {"alias": connection.alias}
+            with self.span(func.__name__, category, **span_args):
+                return func(obj, *args, **kwargs)
+
+        return wrapper
+
+    def pytest_sessionstart(self) -> None:
+        if not django_settings_is_configured():
+            return
+
+        from django.db.backends.base.creation import BaseDatabaseCreation
+        from django.test import TransactionTestCase
+
+        self._restore = [
+            wrap_method(TransactionTestCase, "_pre_setup", self._traced("testcase")),
+            wrap_method(TransactionTestCase, "_post_teardown", self._traced("testcase")),
+            *(
+                wrap_method(BaseDatabaseCreation, name, self._traced("db_setup"))
+                for name in (
+                    "create_test_db",
+                    "clone_test_db",
+                    "serialize_db_to_string",
+                    "destroy_test_db",
+                )
+            ),
+        ]
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item: pytest.Item) -> Generator[None]:
+        with self.span(item.nodeid, "test"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self) -> Generator[None]:
+        with self.span("setup", "phase"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self) -> Generator[None]:
+        with self.span("call", "phase"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self) -> Generator[None]:
+        with self.span("teardown", "phase"):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef: pytest.FixtureDef[Any]) -> Generator[None]:
+        with self.span(fixturedef.argname, "fixture", scope=fixturedef.scope):
+            yield
+
+    def pytest_sessionfinish(self, session: pytest.Session) -> None:
+        for restore in reversed(self._restore):
+            restore()
+        self._restore = []
+
+        path = self.get_worker_path(session.config, self.path)
+        workerinput = getattr(session.config, "workerinput", None)
+        process_name = "pytest" if workerinput is None else workerinput["workerid"]
+        events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self._pid,
+                "args": {"name": process_name},
+            },
+            *(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self._pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self._threads.items()
+            ),
+            *self.events,
+        ]
+
+        def merge(worker_path: Path) -> None:
+            with worker_path.open(encoding="utf-8") as f:
+                events.extend(json.load(f)["traceEvents"])
+
+        self.merge_worker_files(session.config, path, merge)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+tracer_key = pytest.StashKey[Tracer]()
+
+
+def trace_span(
+    config: pytest.Config, name: str, category: str = "django", **args: Any
+) -> contextlib.AbstractContextManager[None]:
+    """Record the duration of the block as a span when ``--django-trace`` is
+    used."""
+    tracer = config.stash.get(tracer_key, None)
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, category, **args)
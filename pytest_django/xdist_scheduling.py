@@ -0,0 +1,159 @@
+"""The pytest-xdist scheduler of ``--django-dist``.
+
+Only imported when pytest-xdist creates its scheduler, as it depends on
+pytest-xdist.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any
+
+import pytest
+from xdist.scheduler import LoadScheduling
+from xdist.workermanage import WorkerController
+
+
+if TYPE_CHECKING:
+    from .scheduling import DurationHistory
+
+
+class CostLoadScheduling(LoadScheduling):
+    """Distributes the tests like ``--dist load``, but by their expected cost
+    instead of their number.
+
+    The cost of a test is its duration in the previous runs, which accounts
+    for the cost of its database access, e.g. for the flush of the database
+    after a transactional test. Each worker is sent tests until the cost of
+    its pending tests reaches a batch, a part of its share of the remaining
+    ones, so that the costly tests, like the transactional ones, are sent one
+    at a time to the workers which are free, rather than in clusters.
+
+    The tests are always taken from the front of the collection, so each
+    worker runs its tests in the order Django requires: the
+    non-transactional database tests first, then the transactional ones.
+    """
+
+    #: The minimum cost of a test, in seconds.
+    min_cost = 0.001
+
+    #: The part of its share of the cost of the remaining tests which is sent
+    #: to a worker at once.
+    batch_fraction = 1 / 4
+
+    #: The part of a batch left on a worker when it is refilled.
+    refill_fraction = 1 / 2
+
+    collection: list[str] | None
+
+    def __init__(self, config: pytest.Config, log: Any, history: DurationHistory | None) -> None:
+        super().__init__(config, log)
+        self.history = history
+        #: The expected cost of each test, by index in the collection.
+        self.costs: list[float] = []
+        self._pending_cost = 0.0
+        # The maximum number of tests sent at once.
+        self._max_count = 0
+
+    def _get_costs(self, collection: Sequence[str]) -> list[float]:
+        if self.history is None:
+            return [1.0] * len(collection)
+        default_cost = self.history.get_default_duration() or 1.0
+        costs = []
+        for nodeid in collection:
+            duration = self.history.get_expected_duration(nodeid)
+            costs.append(max(default_cost if duration is None else duration, self.min_cost))
+        return costs
+
+    def _update_pending_cost(self) -> None:
+        self._pending_cost = sum(self.costs[index] for index in self.pending)
+
+    def _get_batch_cost(self) -> float:
+        return self._pending_cost / len(self.node2pending) * self.batch_fraction
+
+    def schedule(self) -> None:
+        assert self.collection_is_completed
+
+        # Collections are identical, schedule the new nodes.
+        if self.collection is not None:
+            for node in self.nodes:
+                self.check_schedule(node)
+            return
+
+        if not self._check_nodes_have_same_collection():
+            self.log("**Different tests collected, aborting run**")
+            return
+
+        collection = next(iter(self.node2collection.values()))
+        self.collection = collection
+        self.costs = self._get_costs(collection)
+        self.pending[:] = range(len(collection))
+        self._update_pending_cost()
+        if not collection:
+            return
+        self._max_count = len(collection) if self.maxschedchunk is None else self.maxschedchunk
+
+        for node in self.nodes:
+            self._send_batch(node)
+
+        if not self.pending:
+            for node in self.nodes:
+                node.shutdown()
+
+    def check_schedule(self, node: WorkerController, duration: float = 0) -> None:  # noqa: ARG002
+        if node.shutting_down:
+            return
+
+        if self.pending:
+            # Refill the node once it has a single test left, or less than
+            # `refill_fraction` of a batch.
+            node_pending = self.node2pending[node]
+            node_cost = sum(self.costs[index] for index in node_pending)
+            if len(node_pending) < 2 or node_cost < self._get_batch_cost() * self.refill_fraction:
+                self._send_batch(node)
+        else:
+            node.shutdown()
+
+        self.log("num items waiting for node:", len(self.pending))
+
+    def _send_batch(self, node: WorkerController) -> None:
+        """Send tests to the node until the cost of its pending tests reaches
+        a batch, and it has at least two of them, the test it runs and the
+        next one."""
+        batch_cost = self._get_batch_cost()
+        node_pending = self.node2pending[node]
+        node_cost = sum(self.costs[index] for index in node_pending)
+        count = 0
+        for index in self.pending:
+            if count == self._max_count or (
+                len(node_pending) + count >= 2 and node_cost >= batch_cost
+            ):
+                break
+            node_cost += self.costs[index]
+            count += 1
+        self._send_tests(node, count)
+
+    def _send_tests(self, node: WorkerController, num: int) -> None:
+        self._pending_cost -= sum(self.costs[index] for index in self.pending[:num])
+        super()._send_tests(node, num)
+
+    def mark_test_pending(self, item: str) -> None:
+        assert self.collection is not None
+        self.pending.insert(0, self.collection.index(item))
+        self._update_pending_cost()
+        for node in self.node2pending:
+            self.check_schedule(node)
+
+    def remove_node(self, node: WorkerController) -> str | None:
+        pending = self.node2pending.pop(node)
+        if not pending:
+            return None
+
+        assert self.collection is not None
+        crashitem: str = self.collection[pending.pop(0)]
+        # Keep the pending tests in the order of the collection.
+        self.pending[:] = sorted(self.pending + pending)
+        self._update_pending_cost()
+        for other_node in self.node2pending:
+            self.check_schedule(other_node)
+        return crashitem
@@ -7,6 +7,7 @@ from django.db import connection, transaction
 
 from .helpers import DjangoPytester
 
+from pytest_django.fixtures import db_plan_key, get_db_plan
 from pytest_django_test.app.models import Item, SecondItem
 
 
@@ -377,6 +378,21 @@ class TestDatabaseMarker:
         marker = request.node.get_closest_marker("django_db")
         assert marker.kwargs["available_apps"] == ["pytest_django_test.app"]
 
+    @pytest.mark.django_db(databases=["default", "second"])
+    def test_db_plan(
+        self,
+        request: pytest.FixtureRequest,
+        transactional_db: None,  # noqa: ARG002
+    ) -> None:
+        plan = request.node.stash[db_plan_key]
+        assert get_db_plan(request.node) is plan
+        assert plan.marked
+        assert plan.uses_db
+        assert plan.transactional
+        assert not plan.reset_sequences
+        assert plan.databases == ["default", "second"]
+        assert plan.reasons == ("django_db mark", "transactional_db fixture")
+
     @pytest.mark.django_db
     def test_available_apps_default(self) -> None:
         from django.apps import apps
@@ -505,6 +521,41 @@ def test_pre_setup_runs_once_per_test(django_pytester: DjangoPytester) -> None:
     result.assert_outcomes(passed=2)
 
 
+def test_marks_added_by_conftest(django_pytester: DjangoPytester) -> None:
+    """The django_db marks added by the other plugins and the conftests in
+    their pytest_collection_modifyitems are taken into account."""
+    django_pytester.makeconftest(
+        """
+        import pytest
+
+        def pytest_collection_modifyitems(items):
+            for item in items:
+                if item.name == "test_marked":
+                    item.add_marker(pytest.mark.django_db)
+                elif item.name == "test_marked_transactional":
+                    item.add_marker(pytest.mark.django_db(transaction=True))
+        """
+    )
+    django_pytester.create_test_module(
+        """
+        from django.db import connection
+
+        from .app.models import Item
+
+        def test_marked():
+            Item.objects.create(name="foo")
+            assert connection.in_atomic_block
+
+        def test_marked_transactional():
+            Item.objects.create(name="foo")
+            assert not connection.in_atomic_block
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess("-v", "--reuse-db")
+    result.assert_outcomes(passed=2)
+
+
 class Test_database_blocking:
     def test_db_access_in_conftest(self, django_pytester: DjangoPytester) -> None:
         """Make sure database access in conftest module is prohibited."""
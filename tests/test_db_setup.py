@@ -104,17 +104,17 @@ def test_db_order(django_pytester: DjangoPytester) -> None:
     result.stdout.fnmatch_lines(
         [
             "*test_run_first_fixture*",
-            "*test_run_first_fixture_class*",
-            "*test_run_first_django_test_case*",
             "*test_run_first_decorator*",
             "*test_run_first_serialized_rollback_decorator*",
+            "*test_run_first_fixture_class*",
+            "*test_run_first_django_test_case*",
             "*test_run_second_decorator*",
             "*test_run_second_fixture*",
             "*test_run_second_live_server_fixture*",
             "*test_run_second_reset_sequences_fixture*",
+            "*test_run_second_reset_sequences_decorator*",
             "*test_run_second_transaction_test_case*",
             "*test_run_second_fixture_class*",
-            "*test_run_second_reset_sequences_decorator*",
             "*test_run_last_simple_test_case*",
             "*test_run_last_test_case*",
         ],
@@ -122,6 +122,156 @@ def test_db_order(django_pytester: DjangoPytester) -> None:
     )
 
 
+def test_db_order_by_signature(django_pytester: DjangoPytester) -> None:
+    """The tests of a module, outside of its classes, and the tests of a
+    class are grouped by their database signature, in the order of the first
+    test of each group."""
+
+    django_pytester.create_test_module(
+        """
+        import pytest
+        from django.test import TestCase
+
+        @pytest.mark.django_db
+        def test_default_1():
+            pass
+
+        @pytest.mark.django_db(databases=["default", "second"])
+        def test_databases_1():
+            pass
+
+        @pytest.mark.django_db(available_apps=["tpkg.app"])
+        def test_available_apps_1():
+            pass
+
+        class MyTestCase(TestCase):
+            databases = {"second", "default"}
+
+            def test_databases_2(self):
+                pass
+
+        @pytest.mark.urls("tpkg.app.urls")
+        def test_urls_1():
+            pass
+
+        def test_no_db_1():
+            pass
+
+        @pytest.mark.django_db(available_apps=["tpkg.app"])
+        def test_available_apps_2():
+            pass
+
+        @pytest.mark.django_isolate_apps("tpkg.app")
+        def test_isolate_apps_1():
+            pass
+
+        def test_default_2(db):
+            pass
+
+        @pytest.mark.urls("tpkg.app.urls")
+        def test_urls_2():
+            pass
+
+        def test_no_db_2():
+            pass
+
+        @pytest.mark.django_isolate_apps("tpkg.app")
+        def test_isolate_apps_2():
+            pass
+    """
+    )
+    result = django_pytester.runpytest_subprocess("-q", "--collect-only")
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(
+        [
+            "*test_default_1",
+            "*test_default_2",
+            "*test_databases_1",
+            "*test_available_apps_1",
+            "*test_available_apps_2",
+            "*test_databases_2",
+            "*test_urls_1",
+            "*test_urls_2",
+            "*test_no_db_1",
+            "*test_no_db_2",
+            "*test_isolate_apps_1",
+            "*test_isolate_apps_2",
+        ],
+        consecutive=True,
+    )
+
+
+def test_db_order_keeps_modules_and_classes(django_pytester: DjangoPytester) -> None:
+    """The tests with the same database signature are not grouped across
+    modules and classes, whose fixtures would be set up again."""
+    django_pytester.makeconftest(
+        """
+        import pathlib
+
+        import pytest
+
+        setups = []
+
+        @pytest.fixture(scope="module", autouse=True)
+        def module_fixture(request):
+            setups.append(request.module.__name__)
+
+        @pytest.fixture(scope="class", autouse=True)
+        def class_fixture(request):
+            if request.cls is not None:
+                setups.append(request.cls.__name__)
+
+        def pytest_sessionfinish():
+            pathlib.Path("setups").write_text(" ".join(setups))
+        """
+    )
+    code = """
+        import pytest
+
+        @pytest.mark.django_db
+        def test_1():
+            pass
+
+        @pytest.mark.django_db(databases=["default", "second"])
+        def test_2():
+            pass
+
+        class TestClass:
+            @pytest.mark.django_db
+            def test_3(self):
+                pass
+
+            @pytest.mark.django_db(databases=["default", "second"])
+            def test_4(self):
+                pass
+
+            @pytest.mark.django_db
+            def test_5(self):
+                pass
+    """
+    django_pytester.create_test_module(code, "test_a.py")
+    django_pytester.create_test_module(code, "test_b.py")
+
+    result = django_pytester.runpytest_subprocess("-v")
+    result.assert_outcomes(passed=10)
+    result.stdout.fnmatch_lines(
+        [
+            "*test_a.py::test_1 PASSED*",
+            "*test_a.py::test_2 PASSED*",
+            "*test_a.py::TestClass::test_3 PASSED*",
+            "*test_a.py::TestClass::test_5 PASSED*",
+            "*test_a.py::TestClass::test_4 PASSED*",
+            "*test_b.py::test_1 PASSED*",
+            "*test_b.py::test_2 PASSED*",
+            "*test_b.py::TestClass::test_3 PASSED*",
+            "*test_b.py::TestClass::test_5 PASSED*",
+            "*test_b.py::TestClass::test_4 PASSED*",
+        ]
+    )
+    setups = (django_pytester.path / "setups").read_text()
+    assert setups == "tpkg.test_a TestClass tpkg.test_b TestClass"
+
+
 def test_db_reuse(django_pytester: DjangoPytester) -> None:
     """
     Test the re-use db functionality.
@@ -461,6 +611,161 @@ class TestSqliteWithToxAndXdist:
         result.stdout.fnmatch_lines(["*PASSED*test_inner*"])
 
 
+class TestSqliteWithShardAndXdist:
+    db_settings: ClassVar = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": "db_name",
+            "TEST": {"NAME": "test_custom_db_name"},
+        }
+    }
+
+    def test_db_with_shard_suffix(
+        self,
+        django_pytester: DjangoPytester,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        "A test to check that the Tox, shard and xdist suffixes work together."
+        pytest.importorskip("xdist")
+        monkeypatch.setenv("TOX_PARALLEL_ENV", "py37-django22")
+
+        django_pytester.create_test_module(
+            """
+            import pytest
+            from django.db import connections
+
+            @pytest.mark.django_db
+            def test_inner():
+
+                (conn, ) = connections.all()
+
+                assert conn.vendor == 'sqlite'
+                db_name = conn.creation._get_test_db_name()
+                assert db_name == 'test_custom_db_name_py37-django22_shard1_gw0'
+        """
+        )
+
+        result = django_pytester.runpytest_subprocess(
+            "--tb=short", "-vv", "-n1", "--django-shard=1/1"
+        )
+        assert result.ret == 0
+        result.stdout.fnmatch_lines(["*PASSED*test_inner*"])
+
+
+class TestBackgroundDbSetup:
+    db_settings: ClassVar = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": "db_name",
+            "TEST": {"NAME": "test_db_name"},
+        }
+    }
+
+    def test_background_db_setup(
+        self,
+        django_pytester: DjangoPytester,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        django_pytester.makeconftest(
+            """
+            import os
+            import threading
+
+            import django.test.utils
+            import pytest
+            from django.conf import settings
+
+            _setup_databases = django.test.utils.setup_databases
+
+            def setup_databases(*args, **kwargs):
+                with open("setup.log", "a") as f:
+                    f.write(threading.current_thread().name + "\\n")
+                return _setup_databases(*args, **kwargs)
+
+            django.test.utils.setup_databases = setup_databases
+
+            @pytest.fixture(scope="session")
+            def django_db_modify_db_settings(django_db_modify_db_settings_parallel_suffix):
+                if os.environ.get("OTHER_TEST_DB"):
+                    settings.DATABASES["default"]["TEST"]["NAME"] = "test_other_db_name"
+            """
+        )
+        django_pytester.create_test_module(
+            """
+            import pytest
+            from django.db import connection
+
+            from .app.models import Item
+
+            @pytest.mark.django_db(serialized_rollback=True)
+            def test_db():
+                assert hasattr(connection, "_test_serialized_contents")
+                Item.objects.create(name="spam")
+                assert Item.objects.count() == 1
+
+            def test_no_db():
+                pass
+            """
+        )
+        log_path = django_pytester.path / "setup.log"
+
+        def run_setups() -> list[str]:
+            log_path.unlink(missing_ok=True)
+            result = django_pytester.runpytest_subprocess("--django-background-db-setup")
+            result.assert_outcomes(passed=2)
+            assert not (django_pytester.path / "test_db_name").exists()
+            assert not (django_pytester.path / "test_other_db_name").exists()
+            return log_path.read_text().split()
+
+        # The first run records the databases to set up.
+        assert run_setups() == ["MainThread"]
+        assert run_setups() == ["django_db_setup"]
+
+        # The name of the test database changed, so it is set up again.
+        monkeypatch.setenv("OTHER_TEST_DB", "1")
+        assert run_setups() == ["django_db_setup", "MainThread"]
+
+
+class TestBackgroundDbSetupInMemory:
+    db_settings: ClassVar = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": ":memory:",
+        }
+    }
+
+    def test_background_db_setup_in_memory(self, django_pytester: DjangoPytester) -> None:
+        django_pytester.create_test_module(
+            """
+            import pytest
+            from django.db import connection
+
+            @pytest.mark.django_db
+            def test_db():
+                pass
+            """
+        )
+        django_pytester.makeconftest(
+            """
+            import threading
+
+            import django.test.utils
+
+            _setup_databases = django.test.utils.setup_databases
+
+            def setup_databases(*args, **kwargs):
+                print("setup in", threading.current_thread().name)
+                return _setup_databases(*args, **kwargs)
+
+            django.test.utils.setup_databases = setup_databases
+            """
+        )
+        for _ in range(2):
+            result = django_pytester.runpytest_subprocess("--django-background-db-setup", "-s")
+            result.assert_outcomes(passed=1)
+            result.stdout.fnmatch_lines(["*setup in MainThread*"])
+
+
 class TestSqliteInMemoryWithXdist:
     db_settings: ClassVar = {
         "default": {
@@ -25,11 +25,14 @@ from django.utils.encoding import force_str
 from .helpers import DjangoPytester
 
 from pytest_django import (
+    DjangoAssertMaxQueryTime,
+    DjangoAssertNoSeqScans,
     DjangoAssertNumQueries,
     DjangoCaptureOnCommitCallbacks,
     DjangoDbBlocker,
     Settings,
 )
+from pytest_django.fixtures import _explain_postgresql
 from pytest_django_test.app.models import Item
 
 
@@ -152,6 +155,110 @@ def test_django_assert_max_num_queries_db(
         assert "1-foo" in captured.captured_queries[0]["sql"]
 
 
+@pytest.mark.django_db
+def test_django_assert_num_queries_capture_limit(
+    request: pytest.FixtureRequest,
+    django_assert_num_queries: DjangoAssertNumQueries,
+    django_assert_max_num_queries: DjangoAssertNumQueries,
+) -> None:
+    with nonverbose_config(request.config):
+        with django_assert_num_queries(5, capture_limit=2) as captured:
+            for i in range(5):
+                Item.objects.create(name=f"item-{i}")
+        assert len(captured) == 5
+        assert captured.capture_limit == 2
+        assert len(captured.captured_queries) == 2
+        assert "item-3" in captured[0]["sql"]
+        assert "item-4" in captured[1]["sql"]
+
+        # Without a capture limit, Django's context is used.
+        with django_assert_num_queries(1) as default_captured:
+            Item.objects.create(name="foo")
+        assert default_captured.final_queries is not None
+
+        with django_assert_max_num_queries(3, capture_limit=0) as captured:
+            Item.objects.create(name="foo")
+            Item.objects.count()
+        assert len(captured) == 2
+        assert captured.captured_queries == []
+
+        with pytest.raises(pytest.fail.Exception) as excinfo:  # noqa: PT012
+            with django_assert_max_num_queries(1, capture_limit=1):
+                Item.objects.count()
+                Item.objects.count()
+        assert excinfo.value.args == (
+            (
+                "Expected to perform 1 queries or less but 2 were done "
+                "(add -v option to show queries)"
+            ),
+        )
+
+
+@pytest.mark.django_db(transaction=True)
+def test_django_assert_num_queries_capture_limit_transactions(
+    django_assert_num_queries: DjangoAssertNumQueries,
+) -> None:
+    # The transaction statements are counted as without a capture limit.
+    with django_assert_num_queries(3) as default_captured:
+        with transaction.atomic():
+            Item.objects.create(name="foo")
+    with django_assert_num_queries(3, capture_limit=1) as captured:
+        with transaction.atomic():
+            Item.objects.create(name="foo")
+    assert captured.captured_queries[0]["sql"] == default_captured[-1]["sql"]
+
+
+def test_django_assert_num_queries_capture_limit_output_verbose(
+    django_pytester: DjangoPytester,
+) -> None:
+    django_pytester.create_test_module(
+        """
+        from django.contrib.contenttypes.models import ContentType
+        import pytest
+
+        @pytest.mark.django_db
+        def test_queries(django_assert_max_num_queries):
+            with django_assert_max_num_queries(2, capture_limit=1):
+                for i in range(3):
+                    ContentType.objects.filter(pk=i).count()
+    """
+    )
+    result = django_pytester.runpytest_subprocess("--tb=short", "-v")
+    result.stdout.fnmatch_lines(
+        [
+            "*Expected to perform 2 queries or less but 3 were done*",
+            "*Last 1 of 3 queries:*",
+            '*WHERE "django_content_type"."id" = 2*',
+        ]
+    )
+    assert result.ret == 1
+
+
+@pytest.mark.django_db
+def test_django_assert_num_queries_max_rows(
+    django_assert_num_queries: DjangoAssertNumQueries,
+    django_assert_max_num_queries: DjangoAssertNumQueries,
+) -> None:
+    for i in range(3):
+        Item.objects.create(name=f"item-{i}")
+
+    with django_assert_num_queries(2, max_rows=1):
+        Item.objects.first()
+        Item.objects.filter(name="item-0").get()
+
+    with pytest.raises(pytest.fail.Exception) as excinfo:  # noqa: PT012
+        with django_assert_max_num_queries(2, max_rows=2, info="Too many rows"):
+            list(Item.objects.all())
+            Item.objects.count()
+    msg = excinfo.value.args[0]
+    assert msg.startswith(
+        "Expected every query to return at most 2 rows, but 1 query returned more\n"
+        "Too many rows\n\n"
+        "3 rows: SELECT "
+    )
+    assert 'FROM "app_item"' in msg
+
+
 @pytest.mark.django_db(transaction=True)
 def test_django_assert_num_queries_transactional_db(
     request: pytest.FixtureRequest,
@@ -277,6 +384,167 @@ def test_django_assert_num_queries_output_info(django_pytester: DjangoPytester)
     assert result.ret == 1
 
 
+@pytest.mark.django_db
+def test_django_assert_max_query_time(
+    django_assert_max_query_time: DjangoAssertMaxQueryTime,
+) -> None:
+    with django_assert_max_query_time(60_000):
+        Item.objects.create(name="foo")
+
+    with pytest.raises(pytest.fail.Exception) as excinfo:  # noqa: PT012
+        with django_assert_max_query_time(0, info="Everything is slow"):
+            Item.objects.count()
+            Item.objects.exists()
+    msg = excinfo.value.args[0]
+    assert msg.startswith(
+        "Expected every query to take at most 0 ms, but 2 queries took longer\n"
+        "Everything is slow\n\n"
+    )
+    assert 'SELECT COUNT(*) AS "__count" FROM "app_item"' in msg
+
+
+@pytest.mark.django_db
+def test_django_assert_no_seq_scans(
+    django_assert_no_seq_scans: DjangoAssertNoSeqScans,
+) -> None:
+    item = Item.objects.create(name="foo")
+    Item.objects.create(name="bar")
+
+    with django_assert_no_seq_scans():
+        Item.objects.get(pk=item.pk)
+
+    # Only queries on tables above `min_rows` rows are flagged.
+    with django_assert_no_seq_scans(min_rows=2):
+        Item.objects.filter(name="foo").first()
+
+    with pytest.raises(pytest.fail.Exception) as excinfo:  # noqa: PT012
+        with django_assert_no_seq_scans(info="Item names are not indexed"):
+            for _ in range(3):
+                list(Item.objects.filter(name="foo"))
+    msg = excinfo.value.args[0]
+    assert msg.startswith(
+        "Expected no full table scans on tables with more than 0 rows, "
+        "but 1 query does one\nItem names are not indexed\n\n"
+    )
+    assert "Full scan of app_item (2 rows). Plan:" in msg
+
+
+@pytest.mark.django_db
+def test_django_assert_no_seq_scans_queries_not_counted(
+    django_assert_num_queries: DjangoAssertNumQueries,
+    django_assert_no_seq_scans: DjangoAssertNoSeqScans,
+) -> None:
+    Item.objects.create(name="foo")
+
+    # The EXPLAIN, table names and row count queries are not counted.
+    with django_assert_num_queries(1) as captured:
+        with pytest.raises(pytest.fail.Exception):
+            with django_assert_no_seq_scans():
+                list(Item.objects.filter(name="foo"))
+    assert "EXPLAIN" not in captured[0]["sql"]
+
+
+class FakePostgresqlCursor:
+    def __init__(self, plan: dict[str, object]) -> None:
+        self.plan = plan
+
+    def execute(self, sql: str, params: object = None) -> None:
+        pass
+
+    def fetchone(self) -> tuple[object]:
+        return ([{"Plan": self.plan}],)
+
+
+def test_explain_postgresql_full_index_scan() -> None:
+    # With sequential scans disabled, PostgreSQL reads the whole index of a
+    # table when no index is usable, filtering the rows.
+    plan: dict[str, object] = {
+        "Node Type": "Nested Loop",
+        "Plans": [
+            {
+                "Node Type": "Index Scan",
+                "Relation Name": "app_item",
+                "Index Name": "app_item_pkey",
+                "Filter": "((name)::text = 'foo'::text)",
+            },
+            {
+                "Node Type": "Index Scan",
+                "Relation Name": "app_seconditem",
+                "Index Name": "app_seconditem_pkey",
+                "Index Cond": "(id = 1)",
+            },
+        ],
+    }
+    lines, scanned = _explain_postgresql(FakePostgresqlCursor(plan), "SELECT ...", ())
+    assert lines == [
+        "Nested Loop",
+        "  Index Scan on app_item",
+        "  Index Scan on app_seconditem",
+    ]
+    assert scanned == ["app_item"]
+
+
+def test_django_query_snapshot(django_pytester: DjangoPytester) -> None:
+    test_module = django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        @pytest.mark.django_db
+        def test_queries(django_query_snapshot):
+            with django_query_snapshot():
+                list(Item.objects.filter(name="foo"))
+            with django_query_snapshot("count"):
+                Item.objects.count()
+        """
+    )
+    snapshot_dir = test_module.parent / "__query_snapshots__" / "test_the_test"
+
+    # All the snapshots are created, and reported once the test ran.
+    result = django_pytester.runpytest_subprocess()
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*_ test_queries _*",
+            "*Query snapshot *test_queries.sql did not exist and was created*",
+            "*Query snapshot *test_queries.count.sql did not exist and was created*",
+        ]
+    )
+    result.stdout.no_fnmatch_line("*ERROR at teardown*")
+    assert (snapshot_dir / "test_queries.sql").read_text() == (
+        'SELECT "app_item"."id", "app_item"."name" FROM "app_item" WHERE "app_item"."name" = ?\n'
+    )
+    assert (snapshot_dir / "test_queries.count.sql").exists()
+
+    result = django_pytester.runpytest_subprocess()
+    result.assert_outcomes(passed=1)
+
+    test_module.write_text(
+        test_module.read_text().replace(
+            'list(Item.objects.filter(name="foo"))',
+            'list(Item.objects.filter(name="foo"))\n        Item.objects.first()',
+        )
+    )
+    result = django_pytester.runpytest_subprocess()
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*Executed queries do not match the query snapshot *test_queries.sql:",
+            "--- snapshot",
+            "+++ executed",
+            '+SELECT "app_item"."id", "app_item"."name" FROM "app_item" ORDER BY *LIMIT ?',
+            "Use the --update-query-snapshots option to accept the changes.",
+        ]
+    )
+
+    result = django_pytester.runpytest_subprocess("--update-query-snapshots")
+    result.assert_outcomes(passed=1)
+    result = django_pytester.runpytest_subprocess()
+    result.assert_outcomes(passed=1)
+    assert len((snapshot_dir / "test_queries.sql").read_text().splitlines()) == 2
+
+
 @pytest.mark.django_db
 def test_django_capture_on_commit_callbacks(
     django_capture_on_commit_callbacks: DjangoCaptureOnCommitCallbacks,
@@ -119,3 +119,105 @@ def test_help_with_unusable_configuration(django_pytester: DjangoPytester) -> No
 
     result.stdout.fnmatch_lines(["*usage:*"])
     assert result.ret == 0
+
+
+def test_lazy_setup_without_django_tests(django_pytester: DjangoPytester) -> None:
+    django_pytester.makepyfile(
+        """
+        import django.apps
+
+        from pytest_django.lazy_django import django_settings_is_configured
+
+        def test_pure():
+            assert not django.apps.apps.ready
+            assert not django_settings_is_configured()
+        """
+    )
+    result = django_pytester.runpytest_subprocess("--django-lazy-setup")
+    result.stdout.fnmatch_lines(["django: settings: tpkg.the_settings (from env), setup: lazy"])
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize(
+    "test",
+    [
+        """
+        @pytest.mark.django_db
+        def test_django():
+            assert apps.ready
+        """,
+        """
+        def test_django(settings):
+            assert apps.ready
+        """,
+        """
+        from django.test import SimpleTestCase
+
+        class TestDjango(SimpleTestCase):
+            def test_django(self):
+                assert apps.ready
+        """,
+    ],
+    ids=["mark", "fixture", "test_case"],
+)
+def test_lazy_setup_with_django_test(django_pytester: DjangoPytester, test: str) -> None:
+    django_pytester.makepyfile(
+        test_pure="""
+        from django.apps import apps
+
+        def test_pure():
+            pass
+        """,
+        test_django=dedent(
+            """
+            import pytest
+            from django.apps import apps
+            """
+        )
+        + dedent(test),
+    )
+    result = django_pytester.runpytest_subprocess("--django-lazy-setup")
+    result.assert_outcomes(passed=2)
+
+
+def test_lazy_setup_conftest_imports_models(django_pytester: DjangoPytester) -> None:
+    django_pytester.makeconftest(
+        """
+        from django.apps import apps
+
+        from tpkg.app import models
+
+        # The models module is only executed once, by the setup of Django.
+        assert apps.get_model("app", "Item") is models.Item
+        """
+    )
+    django_pytester.makepyfile(
+        """
+        from django.apps import apps
+
+        def test_pure():
+            assert apps.ready
+        """
+    )
+    result = django_pytester.runpytest_subprocess("--django-lazy-setup")
+    result.assert_outcomes(passed=1)
+
+
+def test_lazy_setup_imports_other_models(django_pytester: DjangoPytester) -> None:
+    """Only the models modules of the installed apps set Django up."""
+    schemas = django_pytester.project_root / "tpkg" / "schemas"
+    schemas.mkdir()
+    (schemas / "__init__.py").touch()
+    (schemas / "models.py").write_text("class Point:\n    pass\n")
+    django_pytester.makepyfile(
+        """
+        from django.apps import apps
+
+        from tpkg.schemas.models import Point
+
+        def test_pure():
+            assert not apps.ready
+        """
+    )
+    result = django_pytester.runpytest_subprocess("--django-lazy-setup")
+    result.assert_outcomes(passed=1)
@@ -0,0 +1,548 @@
+"""Tests for the query instrumentation and the reports enabled by command line
+options."""
+
+from __future__ import annotations
+
+import json
+from xml.etree import ElementTree as ET
+
+import pytest
+
+from .helpers import DjangoPytester
+
+from pytest_django.instrumentation import normalize_sql
+
+
+def test_query_timeout(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        @pytest.fixture
+        def item(db):
+            return Item.objects.create(name="foo")
+
+        def test_no_queries(db):
+            pass
+
+        @pytest.mark.django_db
+        def test_query(item):
+            assert Item.objects.count() == 1
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-query-timeout=60000")
+    result.assert_outcomes(passed=2)
+
+    # The database setup of pytest-django itself is not limited.
+    result = django_pytester.runpytest_subprocess("--django-query-timeout=0")
+    result.assert_outcomes(passed=1, errors=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*ERROR at setup of test_query*",
+            "*Failed: Query took * ms, exceeding the --django-query-timeout of 0 ms:",
+            '*INSERT INTO "app_item" ("name") VALUES (%s)*',
+        ]
+    )
+
+
+def test_query_timeout_with_other_observers(django_pytester: DjangoPytester) -> None:
+    """The query failing the test is still seen by the other observers."""
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        @pytest.mark.django_db
+        def test_query():
+            Item.objects.create(name="foo")
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess(
+        "--django-query-timeout=0",
+        "--django-query-log=queries.jsonl",
+        "--django-db-metrics",
+        "--junitxml=junit.xml",
+    )
+    result.assert_outcomes(failed=1)
+
+    records = [
+        json.loads(line)
+        for line in (django_pytester.path / "queries.jsonl").read_text().splitlines()
+    ]
+    assert [
+        record["phase"]
+        for record in records
+        if record["sql"].startswith('INSERT INTO "app_item" ("name") VALUES (?)')
+    ] == ["call"]
+
+    (testcase,) = ET.parse(django_pytester.path / "junit.xml").iter("testcase")
+    properties = {prop.attrib["name"]: prop.attrib["value"] for prop in testcase.iter("property")}
+    assert properties["django_db_queries"] == "1"
+
+
+def test_report_rows(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        @pytest.fixture
+        def items(db):
+            Item.objects.bulk_create(Item(name=str(i)) for i in range(5))
+
+        def test_small(items):
+            assert Item.objects.first() is not None
+
+        def test_large(items):
+            assert len(Item.objects.all()) == 5
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-report-rows=3")
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(
+        [
+            "*= Django queries returning more than 3 rows =*",
+            "*::test_large (call): fetched 5 *rows",
+            '    SELECT * FROM "app_item"',
+        ]
+    )
+    result.stdout.no_fnmatch_line("*test_small*")
+
+    result = django_pytester.runpytest_subprocess("--django-report-rows=5")
+    result.assert_outcomes(passed=2)
+    result.stdout.no_fnmatch_line("*Django queries returning*")
+
+
+def test_sql_comments(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+        from django.db import connection
+
+        from .app.models import Item
+
+        executed = []
+
+        def record(execute, sql, params, many, context):
+            executed.append(sql)
+            return execute(sql, params, many, context)
+
+        @pytest.fixture
+        def item(db):
+            with connection.execute_wrapper(record):
+                return Item.objects.create(name="foo")
+
+        def test_comments(item):
+            with connection.execute_wrapper(record), connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                cursor.execute("SELECT %s", ["50%"])
+                assert cursor.fetchone() == ("50%",)
+                cursor.execute("SELECT 1 /* mine */")
+            assert executed[0].endswith(
+                " /*fixture='item',phase='setup',"
+                "test='tpkg%%2Ftest_the_test.py%%3A%%3Atest_comments'*/"
+            )
+            assert executed[1:] == [
+                "SELECT 1 /*phase='call',test='tpkg%2Ftest_the_test.py%3A%3Atest_comments'*/",
+                "SELECT %s /*phase='call',test='tpkg%%2Ftest_the_test.py%%3A%%3Atest_comments'*/",
+                "SELECT 1 /* mine */",
+            ]
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-sql-comments")
+    result.assert_outcomes(passed=1)
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_query_log(django_pytester: DjangoPytester, xdist: bool) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        @pytest.fixture
+        def item(db):
+            return Item.objects.create(name="foo")
+
+        def test_one(item):
+            assert list(Item.objects.filter(pk__in=[1, 2])) == [item]
+
+        def test_two(item):
+            assert Item.objects.count() == 1
+        """
+    )
+    log = django_pytester.path / "logs" / "queries.jsonl"
+
+    args = ["--django-query-log=logs/queries.jsonl"]
+    if xdist:
+        args += ["-p", "xdist", "-n", "2"]
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+
+    # The files of the workers are merged.
+    assert [path.name for path in log.parent.iterdir()] == ["queries.jsonl"]
+    records = [json.loads(line) for line in log.read_text().splitlines()]
+    test_records = [record for record in records if record["fixture"] != "django_db_setup"]
+    by_sql = {(record["nodeid"], record["sql"]): record for record in test_records}
+
+    select = by_sql[
+        (
+            "tpkg/test_the_test.py::test_one",
+            (
+                'SELECT "app_item"."id", "app_item"."name" FROM "app_item" '
+                'WHERE "app_item"."id" IN (...)'
+            ),
+        )
+    ]
+    assert select["alias"] == "default"
+    assert select["phase"] == "call"
+    assert select["fixture"] is None
+    assert select["rows"] == 1
+    assert select["duration"] >= 0
+
+    (insert,) = (
+        record
+        for record in test_records
+        if record["nodeid"] == "tpkg/test_the_test.py::test_two"
+        and record["sql"].startswith('INSERT INTO "app_item" ("name") VALUES (?)')
+    )
+    assert insert["phase"] == "setup"
+    assert insert["fixture"] == "item"
+    assert insert["rows"] is None
+
+
+def test_fixture_report(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        @pytest.fixture
+        def item(db):
+            item = Item.objects.create(name="foo")
+            yield item
+            item.delete()
+
+        @pytest.fixture
+        def no_queries():
+            pass
+
+        @pytest.mark.usefixtures("no_queries")
+        def test_one(item):
+            assert Item.objects.count() == 1
+
+        def test_two(item):
+            pass
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-fixture-report=0")
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(
+        [
+            "*= Django fixtures by database time =*",
+            "  db time  queries  setups  fixture",
+            "*s        4       2  item",
+        ]
+    )
+    result.stdout.no_fnmatch_line("*no_queries*")
+    result.stdout.no_fnmatch_line("*django_db_setup*")
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_db_metrics(django_pytester: DjangoPytester, xdist: bool) -> None:
+    django_pytester.makeconftest(
+        """
+        import json
+
+        def pytest_runtest_logreport(report):
+            if report.when == "teardown":
+                with open("metrics.jsonl", "a") as f:
+                    f.write(json.dumps([report.nodeid, report.django_db_metrics]) + "\\n")
+        """
+    )
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        def test_no_db():
+            pass
+
+        @pytest.mark.django_db
+        def test_db():
+            Item.objects.create(name="foo")
+            assert Item.objects.count() == 1
+        """
+    )
+
+    args = ["--django-db-metrics", "--junitxml=junit.xml"]
+    if xdist:
+        args += ["-p", "xdist", "-n", "2"]
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+
+    metrics = dict(
+        json.loads(line)
+        for line in (django_pytester.path / "metrics.jsonl").read_text().splitlines()
+    )
+    assert metrics["tpkg/test_the_test.py::test_no_db"] == {
+        "queries": 0,
+        "time": 0,
+        "connections": 0,
+    }
+    db_metrics = metrics["tpkg/test_the_test.py::test_db"]
+    assert db_metrics["queries"] == 2
+    assert db_metrics["time"] > 0
+
+    testcases = ET.parse(django_pytester.path / "junit.xml").iter("testcase")
+    properties = {
+        testcase.attrib["name"]: {
+            prop.attrib["name"]: prop.attrib["value"] for prop in testcase.iter("property")
+        }
+        for testcase in testcases
+    }
+    assert properties["test_no_db"] == {
+        "django_db_queries": "0",
+        "django_db_time": "0.0",
+        "django_db_connections": "0",
+    }
+    assert properties["test_db"]["django_db_queries"] == "2"
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_db_report(django_pytester: DjangoPytester, xdist: bool) -> None:
+    django_pytester.create_test_module(
+        """
+        import time
+
+        import pytest
+        from django.test import TestCase, TransactionTestCase
+
+        def test_no_db():
+            pass
+
+        @pytest.mark.django_db
+        def test_db():
+            pass
+
+        class TestDbCase(TestCase):
+            def test_db(self):
+                pass
+
+        @pytest.mark.django_db(transaction=True)
+        def test_transactional():
+            pass
+
+        @pytest.mark.django_db(reset_sequences=True)
+        def test_reset_sequences():
+            time.sleep(0.4)
+
+        class TestSerializedRollback(TransactionTestCase):
+            serialized_rollback = True
+
+            def test_serialized_rollback(self):
+                time.sleep(0.2)
+        """
+    )
+
+    # A single worker sets up the database in the first test using it, which
+    # is not a transactional one, so that the order of the costliest tests is
+    # that of their sleeps.
+    args = ["--django-db-report"]
+    if xdist:
+        args += ["-p", "xdist", "-n", "1"]
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=6)
+    result.stdout.fnmatch_lines(
+        [
+            "*= Django database usage =*",
+            "kind                  tests      time  _pre_setup  _post_teardown",
+            "no db                     1 *s *s *s",
+            "db                        2 *s *s *s",
+            "transactional_db          1 *s *s *s",
+            "reset_sequences           1 *s *s *s",
+            "serialized_rollback       1 *s *s *s",
+            "",
+            "Costliest transactional tests:",
+            # In the order of their durations.
+            "*s reset_sequences      tpkg/test_the_test.py::test_reset_sequences",
+            "*s serialized_rollback  tpkg/*::test_serialized_rollback",
+            "*s transactional_db     tpkg/test_the_test.py::test_transactional",
+        ]
+    )
+
+
+def test_transaction_audit(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import threading
+
+        import pytest
+        from django.db import connection, transaction
+        from django.test import TransactionTestCase
+
+        from .app.models import Item
+
+        @pytest.mark.django_db
+        def test_db():
+            Item.objects.create(name="foo")
+
+        @pytest.mark.django_db(transaction=True)
+        def test_copy_pasted():
+            Item.objects.create(name="foo")
+
+        class TestCopyPasted(TransactionTestCase):
+            def test_it(self):
+                Item.objects.create(name="foo")
+
+        @pytest.mark.django_db(transaction=True)
+        def test_on_commit():
+            called = []
+            with transaction.atomic():
+                transaction.on_commit(lambda: called.append(True))
+            assert called
+
+        @pytest.mark.django_db(transaction=True)
+        def test_thread():
+            Item.objects.create(name="foo")
+
+            def count():
+                assert Item.objects.count() == 1
+                connection.close()
+
+            thread = threading.Thread(target=count)
+            thread.start()
+            thread.join()
+
+        def test_live_server(live_server):
+            pass
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-transaction-audit")
+    result.assert_outcomes(passed=6)
+    result.stdout.fnmatch_lines(
+        [
+            "*= Django transactional tests audit =*",
+            "2 of 5 transactional tests showed no need for transactions:",
+            "  tpkg/test_the_test.py::TestCopyPasted::test_it",
+            "  tpkg/test_the_test.py::test_copy_pasted",
+            "*= 6 passed in *",
+        ]
+    )
+
+
+def test_reports_restore_test_case(django_pytester: DjangoPytester) -> None:
+    """The reports wrapping the methods of the Django test cases restore them,
+    whatever the order of their wrappers."""
+    django_pytester.makeconftest(
+        """
+        from django.test import TransactionTestCase
+
+        pre_setup = TransactionTestCase.__dict__["_pre_setup"]
+
+        def pytest_unconfigure():
+            restored = TransactionTestCase.__dict__["_pre_setup"] is pre_setup
+            print("restored:", restored)
+        """
+    )
+    django_pytester.create_test_module(
+        """
+        from django.test import TestCase
+
+        class TestDb(TestCase):
+            def test_db(self):
+                pass
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess(
+        "-s",
+        "--django-db-report",
+        "--django-transaction-audit",
+        "--django-trace=trace.json",
+    )
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(["restored: True"])
+
+
+def test_unused_db_marks(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        pytestmark = pytest.mark.django_db
+
+        @pytest.fixture
+        def item():
+            return Item.objects.create(name="foo")
+
+        def test_query():
+            assert Item.objects.count() == 0
+
+        def test_fixture_query(item):
+            pass
+
+        def test_no_query():
+            pass
+
+        @pytest.mark.skip
+        def test_skipped():
+            pass
+
+        def test_live_server(live_server):
+            pass
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-unused-db-marks=report")
+    result.assert_outcomes(passed=4, skipped=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*= django_db-marked tests without database queries =*",
+            "tpkg/test_the_test.py: 1 of 4 marked tests",
+            "  test_no_query",
+            "*= 4 passed, 1 skipped in *",
+        ]
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-unused-db-marks=fail")
+    result.assert_outcomes(passed=3, skipped=1, failed=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*_ test_no_query _*",
+            "The test is marked with django_db but executed no database queries*",
+        ]
+    )
+    result.stdout.no_fnmatch_line("*ERROR at teardown*")
+
+
+def test_normalize_sql() -> None:
+    assert normalize_sql(
+        """SELECT "app_item"."id", "app_item"."name"
+        FROM "app_item"
+        WHERE ("app_item"."name" = 'it''s' AND "app_item"."id" IN (1, 2, 3))
+        LIMIT 21"""
+    ) == (
+        'SELECT "app_item"."id", "app_item"."name" FROM "app_item" '
+        'WHERE ("app_item"."name" = ? AND "app_item"."id" IN (...)) LIMIT ?'
+    )
+    assert normalize_sql('SAVEPOINT "s140234_x12"') == 'SAVEPOINT "s?_x?"'
+    assert normalize_sql("SELECT 1 /*test='test_it'*/") == "SELECT ?"
+    assert normalize_sql('SELECT "id" FROM "t" WHERE "id" IN (%s, %s)') == (
+        'SELECT "id" FROM "t" WHERE "id" IN (...)'
+    )
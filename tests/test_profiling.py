@@ -0,0 +1,216 @@
+"""Tests for the profiling of the tests and of the initialization of Django."""
+
+from __future__ import annotations
+
+import json
+import pstats
+import re
+
+import pytest
+
+from .helpers import DjangoPytester
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_profile_slowest(django_pytester: DjangoPytester, xdist: bool) -> None:
+    django_pytester.create_test_module(
+        """
+        import time
+
+        import pytest
+        from django.template import Context, Template
+
+        from .app.models import Item
+
+        @pytest.mark.django_db
+        def test_slow():
+            Item.objects.create(name="foo")
+            assert Template("{{ item.name }}").render(
+                Context({"item": Item.objects.get()})
+            ) == "foo"
+            time.sleep(0.5)
+
+        def test_fast():
+            pass
+        """
+    )
+
+    args = ["--django-profile-slowest=1"]
+    if xdist:
+        args += ["-p", "xdist", "-n", "2"]
+    # The tests which never ran are not profiled.
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(["No test took at least 0s in this run and the previous ones*"])
+    durations_path = django_pytester.path / ".pytest_cache" / "v" / "django" / "durations"
+    durations = json.loads(durations_path.read_text())
+    assert durations["tpkg/test_the_test.py::test_slow"] >= 0.5
+
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+    profile = django_pytester.path / "prof" / "tpkg_test_the_test.py_test_slow.pstats"
+    result.stdout.fnmatch_lines(
+        [
+            "*= profiles of the slowest 1 tests =*",
+            "*s tpkg/test_the_test.py::test_slow",
+            f"  profile: {profile}",
+            "  ORM:",
+            "*s * (django/db/*)",
+            "  templates:",
+            "*s * (django/template/*)",
+        ]
+    )
+    result.stdout.no_fnmatch_line("*test_fast*")
+    assert [path.name for path in profile.parent.iterdir()] == [profile.name]
+    stats = pstats.Stats(str(profile))
+    assert any(funcname == "test_slow" for (_, _, funcname) in stats.stats)  # type: ignore[attr-defined]
+    # The durations of the profiled tests are not recorded.
+    assert json.loads(durations_path.read_text()) == durations
+
+
+def test_profile_threshold(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        def test_fast():
+            pass
+        """
+    )
+
+    for _ in range(2):
+        result = django_pytester.runpytest_subprocess(
+            "--django-profile-slowest=1", "--django-profile-threshold=10"
+        )
+        result.assert_outcomes(passed=1)
+        result.stdout.fnmatch_lines(
+            [
+                "No test took at least 10s in this run and the previous ones, no profiles were written."
+            ]
+        )
+    assert not (django_pytester.path / "prof").exists()
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_memory_report(django_pytester: DjangoPytester, xdist: bool) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+        from django.db import models
+
+        LEAK = []
+
+        @pytest.fixture(scope="module")
+        def big_module_fixture():
+            return bytearray(2_000_000)
+
+        def test_leak():
+            LEAK.append(bytearray(3_000_000))
+
+            class Leaked(models.Model):
+                class Meta:
+                    app_label = "app"
+
+        def test_fixture(big_module_fixture):
+            pass
+
+        def test_clean():
+            data = bytearray(3_000_000)
+            del data
+        """
+    )
+
+    # Report every test and fixture, so that the ones of pytest-django itself
+    # do not push those of the module out of the report.
+    args = ["--django-memory-report=10"]
+    if xdist:
+        args += ["-p", "xdist", "-n", "1"]
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=3)
+    result.stdout.fnmatch_lines(
+        [
+            "*= memory left behind by the 10 largest tests =*",
+            "*MiB tpkg/test_the_test.py::test_leak",
+            "*MiB */tpkg/test_the_test.py:12",
+            "*Django state: apps models +1",
+            "Memory retained by the fixtures of a wider scope:",
+        ]
+    )
+    sizes = parse_memory_report(result.stdout.lines)
+    assert sizes["tpkg/test_the_test.py::test_leak"] > 2**21
+    assert sizes["big_module_fixture"] > 2**20
+    # The memory of the fixture is not attributed to the test requesting it.
+    assert sizes.get("tpkg/test_the_test.py::test_fixture", 0) < 2**20
+    assert sizes.get("tpkg/test_the_test.py::test_clean", 0) < 2**20
+
+
+def parse_memory_report(lines: list[str]) -> dict[str, float]:
+    """Get the sizes in bytes of the tests, sites and fixtures of a memory report."""
+    units = {"B": 1, "KiB": 2**10, "MiB": 2**20, "GiB": 2**30}
+    sizes = {}
+    for line in lines:
+        match = re.fullmatch(r" *(-?[\d.]+) (B|KiB|MiB|GiB) (\S+)", line)
+        if match:
+            sizes[match[3]] = float(match[1]) * units[match[2]]
+    return sizes
+
+
+@pytest.mark.django_project(
+    extra_settings="""
+    INSTALLED_APPS = [
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'tpkg.app.apps.TestApp',
+    ]
+    """
+)
+@pytest.mark.parametrize("lazy", [False, True])
+def test_startup_profile(django_pytester: DjangoPytester, lazy: bool) -> None:
+    django_pytester.create_app_file(
+        """
+        import time
+
+        from django.apps import AppConfig
+
+
+        class TestApp(AppConfig):
+            name = 'tpkg.app'
+
+            def ready(self):
+                time.sleep(0.5)
+        """,
+        "apps.py",
+    )
+    django_pytester.create_test_module(
+        """
+        def test_db(db):
+            pass
+        """
+    )
+
+    args = ["--django-startup-profile"]
+    if lazy:
+        args.append("--django-lazy-setup")
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=1)
+    steps = [
+        "  import tpkg.the_settings: *s",
+        "  django.setup(): *s",
+        # The slowest first.
+        "    ready() of tpkg.app: *s",
+        "    import django.contrib.auth: *s",
+        "  DjangoDbBlocker.block(): *s",
+    ]
+    if lazy:
+        result.stdout.fnmatch_lines(
+            [
+                "django startup: *s",
+                "  _add_django_project_to_path: *s",
+                "collected 1 item",
+                "*= Django startup profile =*",
+                *(step[2:] for step in steps),
+            ]
+        )
+    else:
+        result.stdout.fnmatch_lines(
+            ["django startup: *s", "  _add_django_project_to_path: *s", *steps, "collected 1 item"]
+        )
+        result.stdout.no_fnmatch_line("*= Django startup profile =*")
@@ -0,0 +1,535 @@
+"""Tests for the scheduling of the tests using their history."""
+
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from .helpers import DjangoPytester
+
+from pytest_django.scheduling import (
+    DurationHistory,
+    assign_shards,
+    fit_session_setup,
+    predict_wall_time,
+    predict_worker_count,
+)
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_test_order_slowest_first(django_pytester: DjangoPytester, xdist: bool) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        @pytest.mark.django_db
+        def test_db_fast():
+            pass
+
+        @pytest.mark.django_db
+        def test_db_slow():
+            pass
+
+        @pytest.mark.django_db(transaction=True)
+        def test_transactional_fast():
+            pass
+
+        @pytest.mark.django_db(transaction=True)
+        def test_transactional_slow():
+            pass
+
+        def test_no_db_fast():
+            pass
+
+        def test_no_db_slow():
+            pass
+        """
+    )
+
+    # The durations are recorded by the controller with pytest-xdist.
+    args = ["--django-test-order=slowest-first"]
+    if xdist:
+        args += ["-p", "xdist", "-n", "2"]
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=6)
+    durations_path = django_pytester.path / ".pytest_cache" / "v" / "django" / "durations"
+    durations = json.loads(durations_path.read_text())
+    assert sorted(durations) == [
+        f"tpkg/test_the_test.py::test_{name}"
+        for name in (
+            "db_fast",
+            "db_slow",
+            "no_db_fast",
+            "no_db_slow",
+            "transactional_fast",
+            "transactional_slow",
+        )
+    ]
+
+    # Predictable durations. The tests without database are the slowest, but
+    # they still run after the database tests.
+    durations = {
+        "tpkg/test_the_test.py::test_db_fast": 0.1,
+        "tpkg/test_the_test.py::test_db_slow": 0.3,
+        "tpkg/test_the_test.py::test_transactional_fast": 0.05,
+        "tpkg/test_the_test.py::test_transactional_slow": 0.2,
+        "tpkg/test_the_test.py::test_no_db_fast": 0.4,
+        "tpkg/test_the_test.py::test_no_db_slow": 1.0,
+    }
+    durations_path.write_text(json.dumps(durations))
+    result = django_pytester.runpytest_subprocess(
+        "--django-test-order=slowest-first", "--collect-only", "-q"
+    )
+    result.stdout.fnmatch_lines(
+        [
+            "*::test_db_slow",
+            "*::test_db_fast",
+            "*::test_transactional_slow",
+            "*::test_transactional_fast",
+            "*::test_no_db_slow",
+            "*::test_no_db_fast",
+        ],
+        consecutive=True,
+    )
+
+    # Without the option, the history is not used.
+    result = django_pytester.runpytest_subprocess("--collect-only", "-q")
+    result.stdout.fnmatch_lines(["*::test_db_fast", "*::test_db_slow"], consecutive=True)
+
+
+def test_test_order_failed_first(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import pathlib
+        import time
+
+        def test_slow():
+            time.sleep(0.2)
+
+        def test_fails():
+            assert not pathlib.Path("fail").exists()
+
+        def test_fast():
+            pass
+        """
+    )
+
+    fail = django_pytester.path / "fail"
+    fail.touch()
+    result = django_pytester.runpytest_subprocess("--django-test-order=failed-first")
+    result.assert_outcomes(passed=2, failed=1)
+
+    fail.unlink()
+    result = django_pytester.runpytest_subprocess("--django-test-order=failed-first", "-v")
+    result.assert_outcomes(passed=3)
+    result.stdout.fnmatch_lines(
+        [
+            "*::test_fails PASSED*",
+            "*::test_slow PASSED*",
+            "*::test_fast PASSED*",
+        ]
+    )
+
+
+def test_test_order_requires_cache(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        def test_foo():
+            pass
+        """
+    )
+
+    result = django_pytester.runpytest_subprocess(
+        "--django-test-order=slowest-first", "-p", "no:cacheprovider"
+    )
+    result.stderr.fnmatch_lines(["ERROR: --django-test-order requires the cacheprovider plugin."])
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+def test_django_dist(django_pytester: DjangoPytester) -> None:
+    django_pytester.makeconftest(
+        """
+        def pytest_sessionfinish(session):
+            dsession = session.config.pluginmanager.getplugin("dsession")
+            if dsession is not None:
+                print("scheduler:", type(dsession.sched).__name__)
+        """
+    )
+    django_pytester.create_test_module(
+        """
+        import os
+
+        import pytest
+
+        def record(kind):
+            with open(f"order.{os.environ['PYTEST_XDIST_WORKER']}", "a") as f:
+                f.write(kind + "\\n")
+
+        @pytest.mark.parametrize("i", range(10))
+        @pytest.mark.django_db
+        def test_db(i):
+            record("db")
+
+        @pytest.mark.parametrize("i", range(4))
+        @pytest.mark.django_db(transaction=True)
+        def test_transactional(i):
+            record("transactional")
+
+        @pytest.mark.parametrize("i", range(10))
+        def test_no_db(i):
+            record("no_db")
+        """
+    )
+
+    # The second run uses the durations of the first one.
+    for _ in range(2):
+        for path in django_pytester.path.glob("order.*"):
+            path.unlink()
+        result = django_pytester.runpytest_subprocess(
+            "-p", "xdist", "-n", "2", "--django-dist", "-s"
+        )
+        result.assert_outcomes(passed=24)
+        result.stdout.fnmatch_lines(["*scheduler: CostLoadScheduling"])
+
+    kinds = ["db", "transactional", "no_db"]
+    paths = list(django_pytester.path.glob("order.*"))
+    assert paths
+    for path in paths:
+        order = path.read_text().split()
+        # Each worker runs its tests in the order Django requires.
+        assert order == sorted(order, key=kinds.index)
+
+
+def test_auto_workers(django_pytester: DjangoPytester, monkeypatch: pytest.MonkeyPatch) -> None:
+    # The maximum number of workers.
+    monkeypatch.setenv("PYTEST_XDIST_AUTO_NUM_WORKERS", "4")
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        @pytest.mark.parametrize("i", range(8))
+        @pytest.mark.django_db
+        def test_db(i):
+            pass
+        """
+    )
+
+    # Without recorded durations, the workers of -n auto are kept.
+    result = django_pytester.runpytest_subprocess(
+        "-p", "xdist", "-n", "auto", "--django-auto-workers"
+    )
+    result.assert_outcomes(passed=8)
+    result.stdout.fnmatch_lines(["4 workers [[]8 items[]]"])
+    result.stdout.no_fnmatch_line("*predicted*")
+    cache_path = django_pytester.path / ".pytest_cache" / "v" / "django"
+    assert json.loads((cache_path / "session_setup").read_text())["4"] > 0
+
+    # Predictable durations.
+    durations = {f"tpkg/test_the_test.py::test_db[{i}]": 1.0 for i in range(8)}
+    (cache_path / "durations").write_text(json.dumps(durations))
+    (cache_path / "session_setup").write_text(json.dumps({"1": 0.5}))
+    result = django_pytester.runpytest_subprocess(
+        "-p", "xdist", "-n", "auto", "--django-auto-workers"
+    )
+    result.assert_outcomes(passed=8)
+    result.stdout.fnmatch_lines(
+        ["django: *, workers: 4 (predicted 2.5s)", "4 workers [[]8 items[]]"]
+    )
+
+    # Only the durations of the selected tests are taken into account.
+    (cache_path / "durations").write_text(json.dumps(durations))
+    (cache_path / "session_setup").write_text(json.dumps({"1": 0.5}))
+    result = django_pytester.runpytest_subprocess(
+        "-p", "xdist", "-n", "auto", "--django-auto-workers", "tpkg/test_the_test.py::test_db[0]"
+    )
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(
+        ["django: *, workers: 1 (predicted 1.5s)", "1 worker [[]1 item[]]"]
+    )
+
+
+def test_predict_worker_count() -> None:
+    # The tests are spread over the workers, up to the slowest one.
+    assert predict_worker_count([1.0] * 8, (0.0, 0.0), 4) == (4, 2.0)
+    assert predict_worker_count([1.0] * 8 + [4.0], (0.0, 0.0), 8) == (3, 4.0)
+    assert predict_worker_count([], (1.0, 0.0), 8) == (1, 1.0)
+    # Each worker slows the setup of the others down, so that more of them are
+    # predicted to be slower.
+    assert predict_worker_count([1.0] * 12, (2.0, 1.0), 8) == (3, 8.0)
+    assert predict_wall_time([1.0] * 12, (2.0, 1.0), 6) > predict_wall_time(
+        [1.0] * 12, (2.0, 1.0), 3
+    )
+    assert predict_worker_count([0.1] * 10, (10.0, 1.0), 8) == (1, 11.0)
+
+
+def test_fit_session_setup() -> None:
+    assert fit_session_setup({}) == (0.0, 0.0)
+    # The contention is unknown with a single number of workers.
+    assert fit_session_setup({4: 5.0}) == (5.0, 0.0)
+    assert fit_session_setup({1: 2.0, 4: 5.0}) == pytest.approx((2.0, 1.0))
+    assert fit_session_setup({1: 2.0, 2: 3.5, 3: 4.0}) == pytest.approx((13 / 6, 1.0))
+    # The setup is not predicted to be faster with more workers.
+    assert fit_session_setup({1: 5.0, 4: 2.0}) == (3.5, 0.0)
+
+
+def test_shard(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        @pytest.mark.parametrize("i", range(6))
+        @pytest.mark.django_db
+        def test_default(i):
+            pass
+
+        @pytest.mark.parametrize("i", range(2))
+        @pytest.mark.django_db(databases=["default", "second"])
+        def test_second(i):
+            pass
+
+        @pytest.mark.parametrize("i", range(4))
+        def test_no_db(i):
+            pass
+        """
+    )
+
+    shards = []
+    for index in (1, 2):
+        # The shards run on separate machines, without recorded durations.
+        durations_path = django_pytester.path / ".pytest_cache/v/django/durations"
+        durations_path.unlink(missing_ok=True)
+        result = django_pytester.runpytest_subprocess(f"--django-shard={index}/2", "-v")
+        result.assert_outcomes(passed=6)
+        result.stdout.fnmatch_lines(["*collected 12 items / 6 deselected / 6 selected"])
+        shards.append({line.split()[0] for line in result.outlines if "PASSED" in line})
+
+    assert not shards[0] & shards[1]
+    assert len(shards[0] | shards[1]) == 12
+    # The tests using the second database are in the same shard.
+    assert (
+        len({index for index, shard in enumerate(shards) for test in shard if "second" in test})
+        == 1
+    )
+
+    result = django_pytester.runpytest_subprocess("--django-shard=3/2")
+    result.stderr.fnmatch_lines(
+        ["*argument --django-shard: expected the shard as i/N, with 1 <= i <= N, got '3/2'"]
+    )
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+def test_assign_shards() -> None:
+    nodeids = [f"test_{i}" for i in range(6)]
+    # The tests which never ran take the mean duration, 2.75s.
+    history = FakeHistory({"test_0": 4.0, "test_1": 3.0, "test_2": 3.0, "test_3": 1.0})
+    assert assign_shards(nodeids, [None] * 6, 2, history) == [0, 1, 1, 0, 0, 1]  # type: ignore[arg-type]
+    # The tests of a group are assigned together.
+    groups = [None, "second", None, "second", None, None]
+    assert assign_shards(nodeids, groups, 2, history) == [0, 1, 0, 1, 1, 1]  # type: ignore[arg-type]
+
+
+def test_route_databases(django_pytester: DjangoPytester) -> None:
+    django_pytester.makeconftest(
+        """
+        import os
+
+        import django.test.utils
+
+        _setup_databases = django.test.utils.setup_databases
+
+        def setup_databases(*args, aliases, **kwargs):
+            with open(f"setup.{os.environ['PYTEST_XDIST_WORKER']}", "a") as f:
+                f.write(",".join(sorted(aliases)) + "\\n")
+            return _setup_databases(*args, aliases=aliases, **kwargs)
+
+        django.test.utils.setup_databases = setup_databases
+        """
+    )
+    django_pytester.create_test_module(
+        """
+        import os
+
+        import pytest
+        from django.test import TestCase
+
+        from .app.models import SecondItem
+
+        @pytest.mark.parametrize("i", range(10))
+        @pytest.mark.django_db
+        def test_default(i):
+            pass
+
+        @pytest.mark.parametrize("i", range(3))
+        @pytest.mark.django_db(databases=["default", "second"])
+        def test_second(i):
+            SecondItem.objects.create(name="spam")
+            with open(f"second.{os.environ['PYTEST_XDIST_WORKER']}", "a") as f:
+                f.write("test\\n")
+
+        class TestSecond(TestCase):
+            databases = {"default", "second"}
+
+            def test_second(self):
+                assert SecondItem.objects.count() == 0
+                with open(f"second.{os.environ['PYTEST_XDIST_WORKER']}", "a") as f:
+                    f.write("test\\n")
+        """
+    )
+    result = django_pytester.runpytest_subprocess(
+        "-p", "xdist", "-n", "2", "--dist", "loadgroup", "--django-route-databases", "-v"
+    )
+    result.assert_outcomes(passed=14)
+    result.stdout.fnmatch_lines(["*test_second?0?@django_db:second*"])
+
+    # The tests using the second database run on a single worker, the only
+    # one to set it up.
+    (second_path,) = django_pytester.path.glob("second.*")
+    assert second_path.read_text().split() == ["test"] * 4
+    worker = second_path.suffix
+    for path in django_pytester.path.glob("setup.*"):
+        setups = path.read_text().split()
+        if path.suffix == worker:
+            assert setups == ["default", "second"]
+        else:
+            assert setups == ["default"]
+
+
+def test_route_databases_requires_loadgroup(django_pytester: DjangoPytester) -> None:
+    django_pytester.create_test_module(
+        """
+        def test_foo():
+            pass
+        """
+    )
+    result = django_pytester.runpytest_subprocess(
+        "-p", "xdist", "-n", "2", "--django-route-databases"
+    )
+    result.stderr.fnmatch_lines(["ERROR: --django-route-databases requires --dist loadgroup."])
+    assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+class FakeConfig:
+    def getvalue(self, name: str) -> object:
+        assert name == "tx"
+        return ["2*popen"]
+
+    def getoption(self, name: str) -> object:
+        assert name == "maxschedchunk"
+        return None
+
+
+class FakeHistory:
+    def __init__(self, durations: dict[str, float]) -> None:
+        self.durations = durations
+
+    def get_expected_duration(self, nodeid: str) -> float | None:
+        return self.durations.get(nodeid)
+
+    def get_default_duration(self) -> float:
+        return sum(self.durations.values()) / len(self.durations)
+
+
+class FakeNode:
+    def __init__(self, name: str) -> None:
+        self.gateway = SimpleNamespace(id=name)
+        self.shutting_down = False
+        self.received: list[int] = []
+
+    def send_runtest_some(self, indices: list[int]) -> None:
+        self.received.extend(indices)
+
+    def shutdown(self) -> None:
+        self.shutting_down = True
+
+
+def test_cost_load_scheduling() -> None:
+    from pytest_django.xdist_scheduling import CostLoadScheduling
+
+    # The transactional tests are clustered, which `--dist load` would send to
+    # a single node in one chunk.
+    collection = [
+        *(f"test_db_{i}" for i in range(100)),
+        *(f"test_transactional_{i}" for i in range(8)),
+        *(f"test_no_db_{i}" for i in range(100)),
+    ]
+    durations = dict.fromkeys(collection, 0.01)
+    durations.update({f"test_transactional_{i}": 1.0 for i in range(8)})
+    scheduler = CostLoadScheduling(FakeConfig(), None, FakeHistory(durations))  # type: ignore[arg-type]
+    nodes = [FakeNode("gw0"), FakeNode("gw1")]
+    for node in nodes:
+        scheduler.add_node(node)
+        scheduler.add_node_collection(node, collection)
+    scheduler.schedule()
+
+    # Simulate the run: the node which finishes its current test first
+    # completes it.
+    clocks = dict.fromkeys(nodes, 0.0)
+    while scheduler.has_pending:
+        node = min(
+            (node for node in nodes if scheduler.node2pending[node]),
+            key=lambda node: clocks[node] + durations[collection[scheduler.node2pending[node][0]]],
+        )
+        index = scheduler.node2pending[node][0]
+        clocks[node] += durations[collection[index]]
+        scheduler.mark_test_complete(node, index)
+
+    assert sorted(nodes[0].received + nodes[1].received) == list(range(len(collection)))
+    for node in nodes:
+        # The order of the collection is kept on each node.
+        assert node.received == sorted(node.received)
+        # The transactional tests are spread.
+        transactional = [index for index in node.received if "transactional" in collection[index]]
+        assert 3 <= len(transactional) <= 5
+        assert node.shutting_down
+    # `--dist load` takes 2.35s and 7.65s.
+    assert abs(clocks[nodes[0]] - clocks[nodes[1]]) < 0.2
+
+
+def test_cost_load_scheduling_refills(pytester: pytest.Pytester) -> None:
+    from pytest_django.xdist_scheduling import CostLoadScheduling
+
+    collection = [f"test_{i}" for i in range(24)]
+    # The last test never ran, its cost is the mean of the others, 0.43s.
+    durations = dict.fromkeys(collection[:-1], 0.1)
+    durations.update({f"test_{i}": 2.0 for i in (0, 1, 8, 16)})
+    config = pytester.parseconfigure()
+    assert config.cache is not None
+    config.cache.set(DurationHistory.cache_key, durations)
+    history = DurationHistory(config)
+    scheduler = CostLoadScheduling(FakeConfig(), None, history)  # type: ignore[arg-type]
+    nodes = [FakeNode("gw0"), FakeNode("gw1")]
+    for node in nodes:
+        scheduler.add_node(node)
+        scheduler.add_node_collection(node, collection)
+
+    def pending_costs() -> list[float]:
+        return [
+            sum(scheduler.costs[index] for index in scheduler.node2pending[node]) for node in nodes
+        ]
+
+    # Each node gets tests until their cost reaches a batch, a quarter of its
+    # share of the remaining ones, and it has two of them, so the first node
+    # gets two costly tests and the second seven.
+    scheduler.schedule()
+    assert scheduler.costs[-1] == pytest.approx(9.9 / 23)
+    assert scheduler.node2pending[nodes[0]] == [0, 1]
+    assert scheduler.node2pending[nodes[1]] == [2, 3, 4, 5, 6, 7, 8]
+    assert pending_costs() == pytest.approx([4.0, 2.6])
+
+    # A node is refilled once it has a single test left.
+    scheduler.mark_test_complete(nodes[0], 0)
+    assert scheduler.node2pending[nodes[0]] == [1, 9]
+    assert pending_costs() == pytest.approx([2.1, 2.6])
+
+    # A node is refilled up to a batch, 0.45s, once less than half of it is
+    # left.
+    scheduler.mark_test_complete(nodes[0], 1)
+    assert scheduler.node2pending[nodes[0]] == [9, 10, 11, 12, 13]
+    assert pending_costs() == pytest.approx([0.5, 2.6])
+
+    # A node with enough pending tests is not refilled.
+    scheduler.mark_test_complete(nodes[1], 2)
+    assert scheduler.node2pending[nodes[1]] == [3, 4, 5, 6, 7, 8]
+    assert pending_costs() == pytest.approx([0.5, 2.5])
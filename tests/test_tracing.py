@@ -0,0 +1,67 @@
+"""Tests for the export of the spans of the pytest-django lifecycle."""
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from .helpers import DjangoPytester
+
+
+@pytest.mark.parametrize("xdist", [False, True])
+def test_trace(django_pytester: DjangoPytester, xdist: bool) -> None:
+    django_pytester.create_test_module(
+        """
+        import pytest
+
+        from .app.models import Item
+
+        @pytest.mark.django_db
+        def test_db():
+            Item.objects.create(name="foo")
+
+        def test_live_server(live_server):
+            assert Item.objects.count() == 0
+        """
+    )
+
+    args = ["--django-trace=trace.json"]
+    if xdist:
+        args += ["-p", "xdist", "-n", "2"]
+    result = django_pytester.runpytest_subprocess(*args)
+    result.assert_outcomes(passed=2)
+
+    trace_path = django_pytester.path / "trace.json"
+    assert [path.name for path in django_pytester.path.glob("trace*")] == ["trace.json"]
+    events = json.loads(trace_path.read_text(encoding="utf-8"))["traceEvents"]
+    processes = {event["args"]["name"] for event in events if event["name"] == "process_name"}
+    assert processes == ({"pytest", "gw0", "gw1"} if xdist else {"pytest"})
+    spans = [event for event in events if event["ph"] == "X"]
+    for span in spans:
+        assert span["dur"] >= 0
+    names = {(span["cat"], span["name"]) for span in spans}
+    assert {
+        ("django", "_initialize_django"),
+        ("django", "django.setup"),
+        ("django", "setup_databases"),
+        ("db_setup", "create_test_db"),
+        ("django", "teardown_databases"),
+        ("db_setup", "destroy_test_db"),
+        ("django", "live_server start"),
+        ("testcase", "_pre_setup"),
+        ("testcase", "_post_teardown"),
+        ("test", "tpkg/test_the_test.py::test_db"),
+        ("test", "tpkg/test_the_test.py::test_live_server"),
+        ("phase", "call"),
+        ("fixture", "django_db_setup"),
+    } <= names
+    (insert,) = (
+        span
+        for span in spans
+        if span["cat"] == "query" and span["name"].startswith('INSERT INTO "app_item"')
+    )
+    assert insert["args"]["alias"] == "default"
+    (test,) = (span for span in spans if span["name"] == "tpkg/test_the_test.py::test_db")
+    assert insert["pid"] == test["pid"]
+    assert test["ts"] <= insert["ts"] <= insert["ts"] + insert["dur"] <= test["ts"] + test["dur"]